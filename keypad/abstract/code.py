@@ -6,6 +6,7 @@ from keypad.buffers.cursor import Cursor
 from keypad.options import GeneralConfig
 from keypad.util import time_limited
 from keypad.core.responder import Responder
+from keypad.core.signal import Signal
 
 class AbstractCompletionResults(metaclass=ABCMeta):
 
@@ -42,6 +43,13 @@ class AbstractCompletionResults(metaclass=ABCMeta):
         Filter the completion results using the given text.
         '''
 
+    @Signal
+    def rows_changed(self):
+        '''
+        Emitted when the rows change other than during a call to `filter`
+        (e.g., when results filtered in a worker process arrive).
+        '''
+
     @abstractmethod
     def dispose(self):
         pass
@@ -296,9 +304,10 @@ class AbstractCodeModel(Responder, metaclass=ABCMeta):
 
 
     @abstractmethod
-    def highlight(self):
+    def highlight(self, time_limit_ms=None):
         '''
-        Rehighlight the buffer.        
+        Rehighlight the buffer, spending at most `time_limit_ms` on it if
+        given. (See `keypad.core.syntaxlib.SyntaxHighlighter.highlight_buffer`.)
 
         Note: This is different than other methods in the code model in that
         it involves mutation of the buffer, and it may be better to make
@@ -346,7 +355,7 @@ class IndentRetainingCodeModel(AbstractCodeModel):
     indent_after = r'[{:]\s*$'
     dedent_before = r'^\s*}\s*$'
 
-    def highlight(self):
+    def highlight(self, time_limit_ms=None):
         pass
 
     def completions_async(self, pos):
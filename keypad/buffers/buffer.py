@@ -1,7 +1,9 @@
 
+import array
 
 from ..                     import util
-from ..core                 import Signal, Struct, AttributedString
+from ..core                 import Signal, Struct, AttributedString, errors
+from .mapped_lines          import MappedLines
 
 class TextModification(Struct):
     pos         = ()
@@ -11,24 +13,24 @@ class TextModification(Struct):
 
     @property
     def inverse(self):
-        assert not self.inserts_and_removes, 'noninvertible'
         return TextModification(pos=self.pos, insert=self.remove, remove=self.insert)
 
     @property
     def insert_end_pos(self):
         y, x = self.pos
 
-        for ch in self.insert:
-            if ch == '\n':
-                y += 1
-                x = 0
-            else:
-                x += 1
+        text = self.insert
+        newlines = text.count('\n')
 
-        return y, x
+        if newlines:
+            return y + newlines, len(text) - text.rfind('\n') - 1
+        else:
+            return y, x + len(text)
 
     def coalesce(self, other):
-        insert_end = other.insert_end_pos
+        if not isinstance(other, TextModification):
+            return None
+
         if (bool(self.insert), bool(self.remove)) != (bool(other.insert), bool(other.remove)) or \
                 self.inserts_and_removes:
             return None 
@@ -41,14 +43,117 @@ class TextModification(Struct):
 
     @property
     def inserts_and_removes(self):
+        '''
+        True if the modification replaces text (see `Buffer.replace`): the
+        text in `remove` is removed first, and then `insert` is inserted.
+        '''
         return self.insert and self.remove
 
 
+def _index_array(values):
+    # Four bytes per value suffice unless the text is gigantic.
+    values = list(values)
+    try:
+        return array.array('I', values)
+    except OverflowError:
+        return array.array('Q', values)
+
+
+class Substitution(object):
+    '''
+    A replacement of the `length` characters at `pos` that only changes
+    parts of them, such as the matches replaced by a substitution.
+
+    Only the changed parts are stored, so that the history of a substitution
+    across a large file doesn't hold copies of all of the text around them.
+    Executing it replaces the whole range with a single `TextModification`.
+    '''
+
+    __slots__ = ('pos', 'length', '_offsets', '_removed', '_remove_lengths',
+                 '_inserted', '_insert_lengths')
+
+    def __init__(self, pos, length, edits):
+        '''
+        `edits` are ``(offset, remove, insert)`` tuples in order, where
+        `offset` is the index in the range of the text to remove.
+        '''
+        self.pos = pos
+        self.length = length
+        self._offsets = _index_array(offset for (offset, _, _) in edits)
+        self._removed = ''.join(remove for (_, remove, _) in edits)
+        self._remove_lengths = _index_array(len(remove) for (_, remove, _) in edits)
+        self._inserted = ''.join(insert for (_, _, insert) in edits)
+        self._insert_lengths = _index_array(len(insert) for (_, _, insert) in edits)
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def __iter__(self):
+        '''
+        Yield the ``(offset, remove, insert)`` tuples of the edits.
+        '''
+        removed, inserted = self._removed, self._inserted
+        r = i = 0
+        for offset, remove_length, insert_length in zip(self._offsets, self._remove_lengths,
+                                                        self._insert_lengths):
+            yield offset, removed[r:r + remove_length], inserted[i:i + insert_length]
+            r += remove_length
+            i += insert_length
+
+    def apply(self, text):
+        '''
+        Return the replacement for `text`, the text of the range.
+        '''
+        inserted = self._inserted
+        parts = []
+        end = i = 0
+        for offset, remove_length, insert_length in zip(self._offsets, self._remove_lengths,
+                                                        self._insert_lengths):
+            parts += text[end:offset], inserted[i:i + insert_length]
+            end = offset + remove_length
+            i += insert_length
+        parts.append(text[end:])
+        return ''.join(parts)
+
+    @property
+    def inverse(self):
+        result = Substitution.__new__(Substitution)
+        result.pos = self.pos
+        result.length = self.length + len(self._inserted) - len(self._removed)
+        shifted = []
+        shift = 0
+        for offset, remove_length, insert_length in zip(self._offsets, self._remove_lengths,
+                                                        self._insert_lengths):
+            shifted.append(offset + shift)
+            shift += insert_length - remove_length
+        result._offsets = _index_array(shifted)
+        result._removed, result._remove_lengths = self._inserted, self._insert_lengths
+        result._inserted, result._insert_lengths = self._removed, self._remove_lengths
+        return result
+
+    def coalesce(self, other):
+        return None
+
+
+def _line_weight(line):
+    # the length of the line, plus one for the newline
+    return len(line._text) + 1
+
 class Buffer(object):
 
+    # Number of edits that may be patched into the cached text before it is
+    # discarded and rebuilt from the lines on the next access.
+    MaxSnapshotDeltas = 16
+
+    # Number of characters read from a file per step when loading it.
+    LoadChunkSize = 1 << 20
+
     def __init__(self):
-        self._lines = [AttributedString()]
+        self._lines = util.LineTree([AttributedString()], weight=_line_weight)
         self._line_view = util.ImmutableListView(self._lines)
+        self._version = 0
+        self._snapshot = ''
+        self._snapshot_deltas = []
         self.code_model = None
         self.history = None
 
@@ -66,19 +171,96 @@ class Buffer(object):
         This signal may help make view implementations more efficient.
         '''
 
+    @property
+    def read_only(self):
+        '''
+        True if the buffer is a read-only view of a memory-mapped file. (See
+        `map_from_path`.)
+        '''
+        return isinstance(self._lines, MappedLines)
+
+    def _check_writable(self):
+        if self.read_only:
+            raise errors.ReadOnlyError('The buffer is a read-only view of a large file.')
+
+    def _replace_lines(self, lines):
+        old_count = len(self._lines)
+        if self.read_only:
+            self._lines.close()
+
+        self._lines = lines
+        self._line_view = util.ImmutableListView(lines)
+        self._version += 1
+        self._snapshot = None
+        self._snapshot_deltas.clear()
+
+        self.lines_added_or_removed(0, len(lines) - old_count)
+
+    def map_from_path(self, path, *, codec_errors='strict', cache_size=None):
+        '''
+        Replace the contents of this buffer with a read-only view of the file
+        located at `path` decoded using UTF-8, without reading the file into
+        memory. (See `MappedLines`.)
+
+        The buffer cannot be modified until `unmap` is called. No
+        `text_modified` signal is emitted, only `lines_added_or_removed`.
+        '''
+        self._replace_lines(MappedLines(path, codec_errors=codec_errors,
+                                        cache_size=cache_size))
+
+    def unmap(self):
+        '''
+        Replace a read-only view created by `map_from_path` with an empty,
+        writable buffer.
+        '''
+        if self.read_only:
+            self._replace_lines(util.LineTree([AttributedString()], weight=_line_weight))
+            self._snapshot = ''
+
     def append_from_path(self, path, *, codec_errors='strict'):
         '''
         Append this buffer with the contents of the file located at `path`
         decoded using UTF-8.
         '''
+        for _ in self.iter_append_from_path(path, codec_errors=codec_errors):
+            pass
+
+    def iter_append_from_path(self, path, *, codec_errors='strict', chunk_size=None):
+        '''
+        Return an iterator that appends the contents of the file located at
+        `path` decoded using UTF-8, one chunk of at most `chunk_size`
+        characters (default: `LoadChunkSize`) per step.
+
+        Each chunk is inserted as its own modification, so the text is never
+        held as a single string and `lines_added_or_removed` is emitted as the
+        file loads. Each step yields the number of bytes read so far.
+
+        The file is opened by the first step, which will therefore raise
+        `FileNotFoundError` if the file does not exist.
+        '''
         import pathlib
 
+        if chunk_size is None:
+            chunk_size = self.LoadChunkSize
+
         with pathlib.Path(path).open('r', encoding='utf-8', errors=codec_errors) as f:
-            def gen():
-                for line in f:
-                    yield line.rstrip('\n')
+            # A newline at the end of the file terminates the last line rather
+            # than beginning a new one, so hold back a trailing newline until
+            # more text follows it.
+            pending = ''
+            while True:
+                chunk = f.read(chunk_size)
+                if not chunk:
+                    break
 
-            self.insert_lines(self.end_pos, gen())
+                chunk = pending + chunk
+                if chunk.endswith('\n'):
+                    chunk, pending = chunk[:-1], '\n'
+                else:
+                    pending = ''
+
+                self.insert(self.end_pos, chunk)
+                yield f.buffer.tell()
 
 
     @property
@@ -93,83 +275,172 @@ class Buffer(object):
         self.insert_lines(pos, text_lines, text=text)
 
     def insert_lines(self, pos, lines, text=None):
+        self._check_writable()
 
-        y, x = pos
         text_lines = list(lines) # TODO: use generator directly
+        y, _ = self._splice_in(pos, text_lines)
 
-        # TODO: this appears to be the best possible with builtin lists. It's also
-        # fast enough for my purposes, but it could use improvement. This library
-        # looks like it might be useful:
-        # https://pypi.python.org/pypi/blist/0.9.4
-        # Just for proof that this technique is actually fast enough:
-        # In [14]: xs = [0 for _ in range((1<<30))]
-        # 
-        # In [15]: %timeit xs.insert(int(len(xs)/2), 0)
-        # 1 loops, best of 3: 437 ms per loop
-        # 
-        # In [16]: len(xs)
-        # Out[16]: 1073741828
-        #
-        # This, of course, does not cover the case of multi-line insertions.
+        if text is None:
+            text = '\n'.join(text_lines)
+        self._record_delta(pos, insert=text)
+        self.text_modified(TextModification(pos=pos, insert=text))
+        if len(text_lines) > 1:
+            self.lines_added_or_removed(y, len(text_lines))
+
+    def _splice_in(self, pos, text_lines):
+        # Insert the lines at the position without emitting any signals,
+        # returning the end of the inserted text.
+        y, x = pos
 
         if len(text_lines) == 0:
-            result = (y, x)
+            return (y, x)
         elif len(text_lines) == 1:
             self._lines[y].insert(x, text_lines[0])
-            result = (y, x + len(text_lines[0]))
+            self._lines.reweigh(y, len(text_lines[0]))
+            return (y, x + len(text_lines[0]))
         else:
             line = self._lines[y]
             removed_text = line.text[x:]
             line.remove(x, None)
             line.append(text_lines[0])
+            self._lines.reweigh(y)
 
 
-            self._lines = self._lines[:y+1] + \
-                [AttributedString(line) for line in text_lines[1:]] + self._lines[y+1:]
-            self._line_view = util.ImmutableListView(self._lines)
+            self._lines[y+1:y+1] = [AttributedString(line) for line in text_lines[1:]]
 
             y += len(text_lines)-1
 
             line = self._lines[y]
             line.append(removed_text)
+            self._lines.reweigh(y)
 
-            result = (y, len(removed_text))
+            return (y, len(removed_text))
+
+    def _splice_out(self, pos, end_pos):
+        # Remove the text between the positions without emitting any
+        # signals.
+        sy, sx = pos
+        ey, ex = end_pos
+
+        if sy == ey:
+            self._lines[sy].remove(sx, ex)
+            self._lines.reweigh(sy, sx - ex)
+        else:
+            self._lines[sy].remove(sx, None)
+            self._lines[ey].remove(0, ex)
+            self._lines[sy].append(self._lines[ey])
+            del self._lines[sy+1:ey+1]
+            self._lines.reweigh(sy)
+
+    @property
+    def version(self):
+        '''
+        A counter that is incremented every time the buffer's text changes.
+
+        Consumers may compare it with a previously observed value to find out
+        whether anything derived from the text is still valid.
+        '''
+        return self._version
+
+    def _record_delta(self, pos, insert='', remove=''):
+        self._version += 1
+
+        if self._snapshot is None:
+            return
+
+        deltas = self._snapshot_deltas
+        index = self.calculate_index(pos)
+
+        if deltas and not remove:
+            # coalesce runs of typing into a single delta
+            last_index, last_remove, last_insert = deltas[-1]
+            if index == last_index + len(last_insert):
+                deltas[-1] = last_index, last_remove, last_insert + insert
+                return
+
+        if len(deltas) >= self.MaxSnapshotDeltas:
+            self._snapshot = None
+            deltas.clear()
+        else:
+            deltas.append((index, len(remove), insert))
 
-        if text is None:
-            text = '\n'.join(text_lines)
-        self.text_modified(TextModification(pos=pos, insert=text))
-        if len(text_lines) > 1:
-            self.lines_added_or_removed(y, len(text_lines))
     @property
     def text(self):
-        return '\n'.join(line.text for line in self._lines)
+        '''
+        The text of the buffer as a single string.
+
+        The string is cached and patched with subsequent edits, so repeated
+        access without intervening modifications returns the same object.
+        The text of a read-only buffer is decoded anew on each access.
+        '''
+        if self.read_only:
+            return self._lines.text
+
+        snapshot = self._snapshot
+        if snapshot is None:
+            snapshot = '\n'.join(line.text for line in self._lines)
+        else:
+            for index, remove, insert in self._snapshot_deltas:
+                snapshot = snapshot[:index] + insert + snapshot[index + remove:]
+
+        self._snapshot = snapshot
+        self._snapshot_deltas.clear()
+        return snapshot
 
     def remove(self, pos, length):
         if length == 0:
             return
 
+        self._check_writable()
+
         sy, sx = pos
         ey, ex = self.calculate_pos(pos, length)
         text = self.span_text(pos, end_pos=(ey, ex))
 
+        self._splice_out(pos, (ey, ex))
 
-        if sy == ey:
-            self._lines[sy].remove(sx, ex)
-        else:
-            self._lines[sy].remove(sx, None)
-            self._lines[ey].remove(0, ex)
-            self._lines[sy].append(self._lines[ey])
-            del self._lines[sy+1:ey+1]
-
+        self._record_delta(pos, remove=text)
         self.text_modified(TextModification(pos=pos, remove=text))
 
         if sy != ey:
             self.lines_added_or_removed(ey, sy - ey)
 
+    def replace(self, pos, length, text):
+        '''
+        Replace the `length` characters at `pos` with `text`, emitting a
+        single `TextModification` that both removes and inserts text.
+        '''
+        if length == 0:
+            return self.insert(pos, text)
+        if not text:
+            return self.remove(pos, length)
+
+        self._check_writable()
+
+        sy, sx = pos
+        ey, ex = self.calculate_pos(pos, length)
+        removed = self.span_text(pos, end_pos=(ey, ex))
+        text_lines = text.split('\n')
+
+        self._splice_out(pos, (ey, ex))
+        end_y, _ = self._splice_in(pos, text_lines)
+
+        self._record_delta(pos, insert=text, remove=removed)
+        self.text_modified(TextModification(pos=pos, insert=text, remove=removed))
+
+        delta = end_y - ey
+        if delta:
+            self.lines_added_or_removed(max(ey, end_y), delta)
+
     def execute(self, modification):
-        if modification.insert:
+        if isinstance(modification, Substitution):
+            text = self.span_text(modification.pos, offset=modification.length)
+            self.replace(modification.pos, modification.length, modification.apply(text))
+        elif modification.inserts_and_removes:
+            self.replace(modification.pos, len(modification.remove), modification.insert)
+        elif modification.insert:
             self.insert(modification.pos, modification.insert)
-        if modification.remove:
+        elif modification.remove:
             self.remove(modification.pos, len(modification.remove))
 
 
@@ -202,32 +473,53 @@ class Buffer(object):
 
     
     def calculate_pos(self, base_pos, offset):
+        '''
+        Return the position `offset` characters away from `base_pos`.
+
+        Positions past the end of the buffer are clamped to `end_pos`.
+        Positions before the start of the buffer have a negative line number.
+
+        Complexity: ``O(log(len(self.lines)))``.
+        '''
         by, bx = base_pos
-        
-        line_start_offset = bx + offset
-        y = by
 
+        # fast path: the position is on the same line
+        x = bx + offset
         try:
-            while line_start_offset > len(self._lines[y]):
-                line_start_offset -= len(self._lines[y]) + 1
-                y += 1
+            if 0 <= x <= len(self._lines[by]):
+                return by, x
         except IndexError:
             return self.end_pos
 
-        while line_start_offset < 0:
-            y -= 1
-            line_start_offset += len(self._lines[y]) + 1
+        index = self.calculate_index(base_pos) + offset
+        if index < 0:
+            return -1, index
+
+        try:
+            return self._lines.find_weight(index)
+        except IndexError:
+            return self.end_pos
 
-        return y, line_start_offset
-    
     def calculate_index(self, pos):
+        '''
+        Return the offset of the position from the start of the buffer.
+
+        Complexity: ``O(log(len(self.lines)))``.
+        '''
         py, px = pos
-        
-        index_to_line = sum(len(line) + 1 for line in self._lines[:py])
-        
-        return index_to_line + px
-        
-    
+        return self._lines.prefix_weight(py) + px
+
+    def line_texts(self, start, stop):
+        '''
+        Return the text of the lines in ``range(start, stop)`` as strings.
+
+        The lines of a read-only buffer are decoded without being kept in
+        memory, so this is the way to scan many of them (e.g., to search).
+        '''
+        if self.read_only:
+            return self._lines.texts(start, stop)
+        return [line.text for line in self._lines[start:stop]]
+
     @property
     def end_pos(self):
         return len(self.lines) - 1, len(self.lines[-1])
@@ -54,6 +54,10 @@ class BufferHistory(object):
         self._scratchpad = []
         self._scratchpad_active = False
 
+        # the change recorded in place of the buffer's modifications, if any
+        # (see `recording`)
+        self._recording = None
+
         self.buff = buff
         buff.history = self
         self.buff.text_modified.connect(self._on_buffer_text_modified)
@@ -90,6 +94,7 @@ class BufferHistory(object):
         '''
 
         if self._ignore_changes: return
+        if self._recording is not None: return
 
         if self._scratchpad_active and (self._transaction_changes is None 
                                         or not self._transaction_changes):
@@ -104,7 +109,7 @@ class BufferHistory(object):
                 self._transaction_changes.append(change)
 
     
-    def _commit_transaction(self):
+    def _commit_transaction(self, amend=False):
         did_anything = False
         if self._clear_at_end_of_transaction:
             self._clear_at_end_of_transaction = False
@@ -114,7 +119,11 @@ class BufferHistory(object):
             did_anything = True
         elif self._transaction_changes:
             # flush the scratchpad changes with the user-created changes
-            self._changesets.append(self._scratchpad + self._transaction_changes)
+            changes = self._scratchpad + self._transaction_changes
+            if amend and self._changesets:
+                self._changesets[-1].extend(changes)
+            else:
+                self._changesets.append(changes)
             self._scratchpad = []
             self._changesets_reversed.clear()
             did_anything = True
@@ -217,12 +226,39 @@ class BufferHistory(object):
             self._clear_at_end_of_transaction = True
 
     @contextmanager
-    def transaction(self):
+    def transaction(self, *, amend=False):
+        '''
+        Record the changes made within the block as one changeset, which is
+        undone in one step.
+
+        If `amend` is true, the changes are added to the last changeset
+        instead, so that a long operation can be carried out over several
+        transactions and still be undone in one step. The caller must make
+        sure that nothing else was recorded in between.
+        '''
         self._begin_transaction()
         try:
             yield 
         finally:
-            self._commit_transaction()
+            self._commit_transaction(amend)
+
+    @contextmanager
+    def recording(self, change):
+        '''
+        Record `change` in place of the modifications made to the buffer
+        within the block, which must have the same effect as executing it.
+        (E.g., a `keypad.buffers.buffer.Substitution`, which is more compact
+        than the modification the buffer emits for it.)
+        '''
+        if self._recording is not None:
+            raise RuntimeError('Already recording a change.')
+
+        self._recording = change
+        try:
+            yield
+        finally:
+            self._recording = None
+        self._on_buffer_text_modified(change)
 
     
     @contextmanager
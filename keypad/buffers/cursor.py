@@ -33,25 +33,29 @@ class Cursor(object):
         
         self_y, self_x = self.pos
         chg_y, chg_x = change.pos
-        end_y, end_x = change.insert_end_pos
 
         t=None
+        replaced = False
 
-        if change.insert:
-            if self.chirality != Cursor.Chirality.Left \
-                    or self_y != chg_y or self_x != chg_x:
-
-                if self_y == chg_y and self_x >= chg_x:
-                    self_y = end_y
-                    self_x = (self_x - chg_x) + end_x
-                elif self_y > chg_y:
-                    self_y += end_y - chg_y
-
+        # A modification that replaces text removes it before inserting.
         if change.remove:
             end_y, end_x = change.inverse.insert_end_pos
 
+            # cursor was in replaced text: keep it on the same line of the
+            # replacement, if there is one
+            if change.insert and (chg_y, chg_x) < (self_y, self_x) < (end_y, end_x):
+                lines = change.insert.split('\n', self_y - chg_y + 1)
+                if self_y - chg_y < len(lines):
+                    if self_y != chg_y:
+                        self_x = min(self_x, len(lines[self_y - chg_y]))
+                    else:
+                        self_x = chg_x + min(self_x - chg_x, len(lines[0]))
+                else:
+                    self_y, self_x = change.insert_end_pos
+                replaced = True
+
             # cursor was in the removed region
-            if (chg_y, chg_x) < (self_y, self_x) < (end_y, end_x):
+            elif (chg_y, chg_x) < (self_y, self_x) < (end_y, end_x):
                 self_y, self_x = chg_y, chg_x
 
             # cursor was outside of the removed region
@@ -68,6 +72,18 @@ class Cursor(object):
                     self_y -= end_y - chg_y 
                     t = 'after last line'
         
+
+        if change.insert and not replaced:
+            end_y, end_x = change.insert_end_pos
+            if self.chirality != Cursor.Chirality.Left \
+                    or self_y != chg_y or self_x != chg_x:
+
+                if self_y == chg_y and self_x >= chg_x:
+                    self_y = end_y
+                    self_x = (self_x - chg_x) + end_x
+                elif self_y > chg_y:
+                    self_y += end_y - chg_y
+
         try:
             self._set_pos((self_y, self_x))
         except:
@@ -0,0 +1,217 @@
+import array
+import bisect
+import collections
+import collections.abc
+import mmap
+import os
+
+from ..core import AttributedString
+
+
+class MappedLines(collections.abc.Sequence):
+    '''
+    A read-only sequence of the lines of a memory-mapped UTF-8 file.
+
+    The index of line offsets is built lazily, one block of
+    `IndexBlockSize` bytes at a time, as far as the lines that have been
+    requested. `AttributedString` objects are created only for the lines that
+    are actually accessed, and at most `cache_size` of them are kept, the
+    least recently used being discarded first. (Attributes set on a discarded
+    line are lost.)
+
+    As when loading a file normally, a newline at the end of the file
+    terminates the last line, and a carriage return before a newline is
+    removed.
+
+    Like `keypad.util.LineTree`, the sequence supports `prefix_weight` and
+    `find_weight`, where the weight of each line is its length plus one.
+    '''
+
+    IndexBlockSize = 1 << 20
+    DefaultCacheSize = 10000
+
+    def __init__(self, path, *, codec_errors='strict', cache_size=None):
+        self._file = open(str(path), 'rb')
+        self._size = os.fstat(self._file.fileno()).st_size
+
+        if self._size:
+            self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        else:
+            self._map = b'' # empty files can't be mapped
+
+        self._errors = codec_errors
+        self._byte_starts = array.array('q', [0])
+        self._char_starts = array.array('q', [0])
+        self._indexed = 0
+        self._count = None
+        self._cache = collections.OrderedDict()
+        self.cache_size = cache_size or self.DefaultCacheSize
+
+    def close(self):
+        self._cache.clear()
+        if self._size:
+            self._map.close()
+        self._file.close()
+
+    @property
+    def fully_indexed(self):
+        return self._indexed >= self._size
+
+    def _index_block(self):
+        '''
+        Extend the index by one block. Return False if the whole file has
+        already been indexed.
+        '''
+        start = self._indexed
+        if start >= self._size:
+            return False
+
+        end = min(start + self.IndexBlockSize, self._size)
+        if end < self._size:
+            # end the block at a line boundary
+            nl = self._map.rfind(b'\n', start, end)
+            if nl < 0:
+                nl = self._map.find(b'\n', end)
+            end = nl + 1 if nl >= 0 else self._size
+
+        data = self._map[start:end]
+        text = data.decode('utf-8', self._errors).replace('\r\n', '\n')
+
+        byte_starts = self._byte_starts
+        char_starts = self._char_starts
+        byte_pos = byte_starts[-1]
+        char_pos = char_starts[-1]
+
+        # The last part is either empty or the unterminated last line of the
+        # file; either way it does not begin a new line.
+        for raw, line in zip(data.split(b'\n')[:-1], text.split('\n')):
+            byte_pos += len(raw) + 1
+            char_pos += len(line) + 1
+            byte_starts.append(byte_pos)
+            char_starts.append(char_pos)
+
+        self._indexed = end
+        return True
+
+    def _index_through_line(self, index):
+        while len(self._byte_starts) <= index + 1 and self._index_block():
+            pass
+
+    def _index_through_offset(self, offset):
+        while self._char_starts[-1] <= offset and self._index_block():
+            pass
+
+    def _decode_line(self, index):
+        self._index_through_line(index)
+        byte_starts = self._byte_starts
+
+        start = byte_starts[index]
+        if index + 1 < len(byte_starts):
+            text = self._map[start:byte_starts[index + 1] - 1].decode('utf-8', self._errors)
+            if text.endswith('\r'):
+                text = text[:-1]
+        else:
+            text = self._map[start:self._size].decode('utf-8', self._errors)
+
+        return AttributedString(text)
+
+    def texts(self, start, stop):
+        '''
+        Return the text of the lines in ``range(start, stop)`` as strings,
+        decoded together and without keeping them in the cache.
+        '''
+        stop = min(stop, len(self))
+        if start >= stop:
+            return []
+
+        self._index_through_line(stop - 1)
+        byte_starts = self._byte_starts
+        begin = byte_starts[start]
+        if stop < len(byte_starts):
+            end = byte_starts[stop] - 1
+        else:
+            end = self._size
+
+        text = self._map[begin:end].decode('utf-8', self._errors)
+        return text.replace('\r\n', '\n').split('\n')
+
+    def __len__(self):
+        if self._count is None:
+            if self.fully_indexed:
+                count = len(self._byte_starts)
+            else:
+                # counting is much cheaper than indexing
+                block = self.IndexBlockSize
+                count = 1 + sum(self._map[i:i+block].count(b'\n')
+                                for i in range(0, self._size, block))
+
+            if self._size and self._map[self._size - 1] == ord('\n'):
+                count -= 1
+
+            self._count = count
+
+        return self._count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            return [self[i] for i in range(*key.indices(len(self)))]
+
+        count = len(self)
+        if key < 0:
+            key += count
+        if not 0 <= key < count:
+            raise IndexError('MappedLines index out of range')
+
+        cache = self._cache
+        try:
+            line = cache[key]
+        except KeyError:
+            line = cache[key] = self._decode_line(key)
+            if len(cache) > self.cache_size:
+                cache.popitem(last=False)
+        else:
+            cache.move_to_end(key)
+
+        return line
+
+    def prefix_weight(self, index):
+        '''
+        Return the number of characters (including newlines) before the
+        given line.
+        '''
+        count = len(self)
+        if index == count:
+            return self.prefix_weight(count - 1) + len(self[count - 1]) + 1
+        elif not 0 <= index < count:
+            raise IndexError('MappedLines index out of range')
+
+        self._index_through_line(index)
+        return self._char_starts[index]
+
+    def find_weight(self, offset):
+        '''
+        Return a tuple ``(line, column)`` for the given character offset.
+
+        Raise `IndexError` if the offset is outside of the file.
+        '''
+        if offset < 0:
+            raise IndexError('MappedLines weight offset out of range')
+
+        self._index_through_offset(offset)
+
+        index = bisect.bisect_right(self._char_starts, offset) - 1
+        column = offset - self._char_starts[index]
+        if index >= len(self) or column > len(self[index]):
+            raise IndexError('MappedLines weight offset out of range')
+
+        return index, column
+
+    @property
+    def text(self):
+        '''
+        Decode the entire file.
+        '''
+        text = self._map[:].decode('utf-8', self._errors).replace('\r\n', '\n')
+        if text.endswith('\n'):
+            text = text[:-1]
+        return text
@@ -69,6 +69,8 @@ class BufferController(Tagged, Responder):
         self.view.buffer        = buff
         self.view.keep          = self
         self.__file_mtime       = 0
+        self._highlight_scheduled = False
+        self._highlight_line    = None
 
         self.manipulator        = BufferManipulator(buff)
         self.config             = config or Config.root
@@ -110,6 +112,8 @@ class BufferController(Tagged, Responder):
 
 
         self._last_path = None
+        self._loader = None
+        self._load_error = None
 
     def __enter__(self):
         return self
@@ -118,8 +122,17 @@ class BufferController(Tagged, Responder):
         self.dispose()
 
     def dispose(self):
+        self.cancel_loading()
+        self._highlight_scheduled = False
         if self.code_model is not None:
             self.code_model = None
+        self.disposed()
+
+    @Signal
+    def disposed(self):
+        '''
+        The controller was disposed of, e.g., because its editor was closed.
+        '''
             
     @Signal
     def selection_moved(self):
@@ -270,6 +283,10 @@ class BufferController(Tagged, Responder):
 
         Requires an active history transaction.
         '''
+        if self.buffer.read_only:
+            self.buffer.unmap()
+            return
+
         start = Cursor(self.buffer)
         end = Cursor(self.buffer).move(*self.buffer.end_pos)
         start.remove_to(end)
@@ -289,15 +306,31 @@ class BufferController(Tagged, Responder):
         Replace the contents of `self.buffer` with the contents of the
         file located at `path` decoded using UTF-8. 
 
+        Files larger than ``general.background_load_threshold`` bytes are
+        loaded in the background: the first chunk is loaded immediately,
+        and the remainder is appended while the editor is idle.
+
+        Files larger than ``general.large_file_threshold`` bytes are opened
+        as read-only, memory-mapped views instead. (See
+        `keypad.buffers.Buffer.map_from_path`.)
+
         Requires an active history transaction.
         '''
 
+        self.cancel_loading()
         self.clear()
+
+        gs = self.general_settings
         try:
-            self.append_from_path(path, codec_errors=codec_errors)
+            size = pathlib.Path(path).stat().st_size
         except FileNotFoundError:
-            if not create_new:
-                raise
+            size = 0
+
+        if size > gs.large_file_threshold:
+            self.buffer.map_from_path(path, codec_errors=codec_errors,
+                                      cache_size=gs.large_file_line_cache)
+        else:
+            self._load_from_path(path, create_new, size, codec_errors)
 
         self.add_tags(path=path)
         self.is_modified = True
@@ -306,11 +339,96 @@ class BufferController(Tagged, Responder):
 
         self.loaded_from_path(path)
 
+    def _load_from_path(self, path, create_new, size, codec_errors):
+        try:
+            loader = self.buffer.iter_append_from_path(path, codec_errors=codec_errors)
+            next(loader, None)
+        except FileNotFoundError:
+            if not create_new:
+                raise
+        else:
+            if size > self.general_settings.background_load_threshold:
+                self._load_in_background(loader)
+            else:
+                for _ in loader:
+                    pass
+
+    @property
+    def is_loading(self):
+        '''
+        True if a file is still being loaded into the buffer in the background.
+        '''
+        return self._loader is not None
+
+    def _load_in_background(self, loader):
+        self._loader = loader
+
+        def step():
+            if self._loader is not loader:
+                return # cancelled or superseded
+
+            try:
+                with self.history.ignoring():
+                    next(loader)
+            except StopIteration:
+                self._loader = None
+                self.finished_loading()
+            except Exception as exc:
+                self._loader = None
+                self._load_error = exc
+                interactive.run('show_error', exc)
+            else:
+                app().timer(0, step)
+
+        app().timer(0, step)
+
+    def finish_loading(self):
+        '''
+        Load the remainder of a file being loaded in the background
+        synchronously.
+        '''
+        loader, self._loader = self._loader, None
+        if loader is not None:
+            try:
+                with self.history.ignoring():
+                    for _ in loader:
+                        pass
+            except Exception as exc:
+                self._load_error = exc
+                raise
+            self.finished_loading()
+
+    def cancel_loading(self):
+        '''
+        Stop loading a file in the background, leaving the part that has
+        already been loaded in the buffer.
+        '''
+        self._load_error = None
+        loader, self._loader = self._loader, None
+        if loader is not None:
+            loader.close()
+
+    @Signal
+    def finished_loading(self):
+        '''
+        A file that was being loaded in the background has been completely
+        loaded.
+        '''
+
     def write_to_path(self, path, *, codec_errors='strict'):
         '''
         Atomically write the contents of `self.buffer` to the file located
         at `path` encoded with UTF-8.
         '''
+        if self.buffer.read_only:
+            raise errors.ReadOnlyError('Large files are opened read-only and cannot be saved.')
+
+        # never write a partially loaded file
+        self.finish_loading()
+        if self._load_error is not None:
+            raise errors.UserError('Refusing to save a buffer that failed to load '
+                                   'completely: {}'.format(self._load_error))
+
         # save the selection position, since it will be moved if it's on top of a scratchpad
         # change
         # TODO: disable screen updates when suppressing the scratchpad
@@ -358,9 +476,16 @@ class BufferController(Tagged, Responder):
         pass
 
     @Signal
-    def buffer_needs_highlight(self):
+    def buffer_needs_highlight(self, time_limit_ms=None):
         pass
 
+    @Signal
+    def view_refreshed(self):
+        '''
+        The view was updated after the buffer was modified, the view was
+        scrolled, or the cursor moved.
+        '''
+
     @Signal
     def completion_requested(self):
         pass
@@ -373,13 +498,49 @@ class BufferController(Tagged, Responder):
         self.view.start_line = start_line
         self.refresh_view(full=True)
 
-    def refresh_view(self, full=False):
-        self.view.lines = self.buffer.lines
+    @Signal
+    def highlight_progress(self, line, line_count):
+        '''
+        Highlighting has reached the given line, and continues in the
+        background. When highlighting is complete, `line` equals
+        `line_count`.
+        '''
+
+    def _highlight(self, time_limit_ms=None):
+        # imported here, since keypad.core.syntaxlib imports keypad.api
+        from ..core.syntaxlib import SyntaxHighlighter
+
+        SyntaxHighlighter.prioritize_lines(self.buffer,
+                                           self.view.first_line,
+                                           self.view.last_line + 1)
 
         if self.code_model is not None:
-            self.code_model.highlight()
+            self.code_model.highlight(time_limit_ms)
         else:
-            self.buffer_needs_highlight()
+            self.buffer_needs_highlight(time_limit_ms)
+
+        line = SyntaxHighlighter.first_pending_line(self.buffer)
+        if line is not None:
+            self._highlight_line = line
+            self.highlight_progress(line, len(self.buffer.lines))
+            if not self._highlight_scheduled:
+                self._highlight_scheduled = True
+                app().timer(0, self._highlight_in_background)
+        elif self._highlight_line is not None:
+            self._highlight_line = None
+            self.highlight_progress(len(self.buffer.lines), len(self.buffer.lines))
+
+    def _highlight_in_background(self):
+        if not self._highlight_scheduled:
+            return # disposed
+
+        self._highlight_scheduled = False
+        self.refresh_view(highlight_time_limit_ms=self.general_settings.background_highlight_slice_ms)
+
+    def refresh_view(self, full=False, *, highlight_time_limit_ms=None):
+        self.view.lines = self.buffer.lines
+
+        self._highlight(highlight_time_limit_ms)
 
         curs = self.canonical_cursor
         if curs is not None:
@@ -453,6 +614,8 @@ class BufferController(Tagged, Responder):
             except (RuntimeError, IndexError):
                 pass
 
+        self.view_refreshed()
+
 #         if full:
 #             self.view.full_redraw()
 #         else:
@@ -74,6 +74,7 @@ class CompletionController(Responder):
         if self.__completions is not None:
             self.__completions.dispose()
         self.__completions = completions
+        completions.rows_changed.connect(self.__on_rows_changed)
 
         self.__refilter_typed()
         if self.__completions is not None:
@@ -105,6 +106,14 @@ class CompletionController(Responder):
             self.__finish()
 
     
+    def __on_rows_changed(self):
+        if self.__completions is None:
+            return
+        if self.__completions.rows:
+            self.__view.completions = self.__completions.rows
+        else:
+            self.__finish()
+
     def __finish(self):
         if self.__completions is not None:
             self.__completions.dispose()
@@ -54,4 +54,9 @@ class BufferModifiedError(UserError):
 
 class NoBufferActiveError(ExistenceError): pass
 
+class ReadOnlyError(UserError):
+    '''
+    The buffer is read-only and cannot be modified.
+    '''
+
 
@@ -1,5 +1,6 @@
 
 import functools
+import multiprocessing
 from concurrent import futures
 
 
@@ -52,6 +53,22 @@ class DeferredExecutor(futures.Executor):
             set_future_result(future, fn, *args, **kw)
 
 
+_process_pool = None
+
+def process_pool():
+    '''
+    Return the `ProcessPoolExecutor` shared by everything that runs plain
+    functions in worker processes, such as grep. The workers are fresh
+    interpreters rather than forks of the GUI process.
+    '''
+    global _process_pool
+    if _process_pool is None:
+        _process_pool = futures.ProcessPoolExecutor(
+            mp_context=multiprocessing.get_context('spawn')
+        )
+    return _process_pool
+
+
 def future_wrap(func):
     @functools.wraps(func)
     def result(*args, **kw):
@@ -1,70 +1,252 @@
+'''
+Fuzzy matching for completions and other lists filtered as the user types.
 
-import re
+A pattern matches a string if its characters appear in the string in order.
+Matches are scored like fzf and Sublime Text do: each matched character
+scores, with bonuses for characters at word boundaries and camelCase humps,
+for runs of consecutive characters, and for matching the case of the
+pattern, and penalties for gaps between them.
+'''
 
+ScoreMatch                  = 16
+ScoreGapStart               = -3
+ScoreGapExtension           = -1
+BonusBoundary               = ScoreMatch // 2
+BonusCamel                  = BonusBoundary - 1
+BonusConsecutive            = -(ScoreGapStart + ScoreGapExtension)
+BonusFirstCharMultiplier    = 2
+BonusCase                   = 1
 
 
-def fuzzy_regex(pattern):
-    if pattern:
-        return re.compile('.*?' + '.*?'.join(map(re.escape, pattern)))
+def _compute_bonus(prev, ch):
+    if prev is None or not prev.isalnum():
+        return BonusBoundary if ch.isalnum() else 0
+    elif prev.islower() and ch.isupper():
+        return BonusCamel
+    elif not prev.isdigit() and ch.isdigit():
+        return BonusCamel
     else:
-        return re.compile('')
+        return 0
+
+_bonuses = {} # (previous character, character) -> bonus
+
+
+def _score(pattern, folded_pattern, string, folded):
+    '''
+    Return the score of the folded (e.g., lowercased) pattern in the folded
+    string, or None if it doesn't match.
+    '''
+    if not folded_pattern:
+        return 0
+
+    # Find the first match, then search backwards from its end for the
+    # shortest one ending there (as fzf does).
+    find = folded.find
+    pos = -1
+    for ch in folded_pattern:
+        pos = find(ch, pos + 1)
+        if pos < 0:
+            return None
+    end = pos
+
+    rfind = folded.rfind
+    for ch in reversed(folded_pattern[:-1]):
+        pos = rfind(ch, 0, pos)
+
+    # Where folding changed the length, positions don't line up, so the
+    # folded text is used for bonuses and case (which then always matches).
+    if len(string) != len(folded):
+        string = folded
+    if len(pattern) != len(folded_pattern):
+        pattern = folded_pattern
+
+    bonuses = _bonuses
+    score = 0
+    last = -2
+    chunk_bonus = 0
+    for i in range(len(folded_pattern)):
+        pos = find(folded_pattern[i], pos, end + 1)
+        ch = string[pos]
+        pair = string[pos - 1] if pos else None, ch
+        bonus = bonuses.get(pair)
+        if bonus is None:
+            bonus = bonuses[pair] = _compute_bonus(*pair)
+
+        if pos == last + 1:
+            chunk_bonus = bonus = max(chunk_bonus, bonus, BonusConsecutive)
+        else:
+            if i:
+                score += ScoreGapStart + ScoreGapExtension * (pos - last - 2)
+            else:
+                bonus *= BonusFirstCharMultiplier
+            chunk_bonus = bonus
+        score += ScoreMatch + bonus
+        if ch == pattern[i]:
+            score += BonusCase
+        last = pos
+        pos += 1
+
+    return score
+
+
+def _fold_all(strings):
+    # Lowercasing one big string is much faster than lowercasing many small
+    # ones, as long as none of them contains the separator.
+    joined = '\n'.join(strings)
+    if joined.count('\n') == len(strings) - 1:
+        folded = joined.lower().split('\n')
+        if len(folded) == len(strings):
+            return folded
+    return [s.lower() for s in strings]
 
 
 class Filter(object):
     def __init__(self, coll, pred):
-        fcoll = [(index, item) for (index, item) 
+        fcoll = [(index, item) for (index, item)
                                 in enumerate(coll)
-                                if pred(item)]        
+                                if pred(item)]
         self._rebuild(fcoll)
-        
+
+    @classmethod
+    def from_indices(cls, coll, indices):
+        '''
+        Return a Filter of the items of `coll` at the given indices, in
+        that order.
+        '''
+        result = cls.__new__(cls)
+        result._rebuild([(index, coll[index]) for index in indices])
+        return result
+
     def _rebuild(self, fcoll):
         self.indices = [x[0] for x in fcoll]
         self.rows = [x[1] for x in fcoll]
-        
+
     def enumerate(self):
         return zip(self.indices, self.rows)
-        
+
     def sort(self, key):
         pairs = sorted(self.enumerate(), key=lambda item: key(item[1]))
         self._rebuild(pairs)
-        
 
-    
+
+class FuzzySearch(object):
+    '''
+    Ranks a fixed list of items by how well their keys match patterns
+    typed one keystroke at a time.
+
+    The keys are computed and lowercased once. When a pattern extends the
+    one before it, only the items that matched that one are scored again,
+    since nothing else can match.
+    '''
+
+    def __init__(self, items, key=None, case_sensitive=False):
+        self.items = list(items)
+        if key is None:
+            self._keys = [str(item) for item in self.items]
+        else:
+            self._keys = [key(item) for item in self.items]
+
+        self._case_sensitive = case_sensitive
+        self._folded = self._keys if case_sensitive else _fold_all(self._keys)
+
+        # (pattern, indices of the matching items) from the last call to
+        # `ranked`
+        self._last = None
+
+    def ranked(self, pattern):
+        '''
+        Return the indices of the items that match the pattern, best first.
+        Items with equal scores are ordered by the length of their keys, and
+        then by their order in the list.
+        '''
+        last = self._last
+        if last is not None and pattern == last[0]:
+            return last[1]
+
+        if last is not None and pattern.startswith(last[0]):
+            candidates = last[1]
+        else:
+            candidates = range(len(self.items))
+
+        folded_pattern = pattern if self._case_sensitive else pattern.lower()
+        keys = self._keys
+        folded = self._folded
+
+        if folded_pattern:
+            # Most candidates are rejected for lacking the character just
+            # typed, which is much quicker to check than scoring them.
+            ch = folded_pattern[-1]
+            candidates = [index for index in candidates if ch in folded[index]]
+
+        if len(folded_pattern) == 1:
+            scored = self._score_one(pattern, candidates)
+        else:
+            score_of = _score
+            scored = []
+            for index in candidates:
+                score = score_of(pattern, folded_pattern, keys[index], folded[index])
+                if score is not None:
+                    scored.append((-score, len(keys[index]), index))
+        scored.sort()
+
+        result = [index for (_, _, index) in scored]
+        self._last = pattern, result
+        return result
+
+    def _score_one(self, pattern, candidates):
+        # `_score` for a single character (usually the first keystroke,
+        # when the most candidates match), without the general bookkeeping.
+        keys = self._keys
+        folded = self._folded
+        folded_pattern = pattern if self._case_sensitive else pattern.lower()
+        bonuses = _bonuses
+        base = ScoreMatch
+
+        scored = []
+        for index in candidates:
+            key = keys[index]
+            pos = folded[index].find(folded_pattern)
+            if len(key) != len(folded[index]):
+                key = folded[index]
+            ch = key[pos]
+            pair = key[pos - 1] if pos else None, ch
+            bonus = bonuses.get(pair)
+            if bonus is None:
+                bonus = bonuses[pair] = _compute_bonus(*pair)
+            score = base + bonus * BonusFirstCharMultiplier
+            if ch == pattern:
+                score += BonusCase
+            scored.append((-score, len(keys[index]), index))
+        return scored
+
+    def filter(self, pattern):
+        '''
+        Return a `Filter` of the items that match the pattern, best first.
+        '''
+        return Filter.from_indices(self.items, self.ranked(pattern))
+
+
 class FuzzyMatcher(object):
     def __init__(self, pattern, case_sensitive=False):
-        if not case_sensitive:
-            pattern = pattern.lower()
+        self.pattern = pattern
         self.__case_sensitive = case_sensitive
-        self.__regex = fuzzy_regex(pattern)
-        
+        self.__folded_pattern = pattern if case_sensitive else pattern.lower()
+
+    def score(self, string):
+        '''
+        Return the score of the pattern in the string, which is higher for
+        better matches, or None if it doesn't match.
+        '''
+        folded = string if self.__case_sensitive else string.lower()
+        return _score(self.pattern, self.__folded_pattern, string, folded)
+
     def match(self, string):
-        if not self.__case_sensitive:
-            string = string.lower()
-        return self.__regex.match(string) is not None
-  
+        return self.score(string) is not None
+
     def filter(self, items, key=None):
-        
-        if key is None:
-            pred = self.match
-        else:
-            def pred(x):
-                return self.match(key(x))
-        
-        return Filter(items, pred)
-        
-    
-#     def filter(self, items, key=None):
-#         indices = []
-#         filtered = []
-#         for index, item in enumerate(items):
-#             if key is None:
-#                 k  = item
-#             else:
-#                 k = key(item)
-#             
-#             if self.match(k):
-#                 indices.append(index)
-#                 filtered.append(item)
-#         return indices, filtered
-# 
-# 
\ No newline at end of file
+        '''
+        Return a `Filter` of the items that match, best first. To filter the
+        same items as the pattern is typed, use a `FuzzySearch` instead.
+        '''
+        search = FuzzySearch(items, key, self.__case_sensitive)
+        return search.filter(self.pattern)
@@ -3,6 +3,7 @@ import sys
 import subprocess
 import pickle
 import concurrent.futures
+import functools
 import threading
 import queue
 import logging
@@ -13,6 +14,12 @@ import os
 class RemoteError(RuntimeError): pass
 class UnexpectedWorkerTerminationError(RuntimeError): pass
 
+# Task priorities. A worker runs the waiting task with the highest priority
+# next, so background work never delays tasks that the user is waiting for.
+NormalPriority      = 0
+PrefetchPriority    = -1
+IdlePriority        = -2
+
 on_windows = platform.system() == 'Windows'
 
 def _make_inheritable(handle):
@@ -49,6 +56,10 @@ def _get_worker_args(rh, wh):
     return result
 
 class ServerProxy(object):
+    def __init__(self):
+        self._next_id = 0
+        self._write_lock = threading.Lock()
+
     def start(self):
         lr, rw = os.pipe()
         rr, lw = os.pipe()
@@ -74,23 +85,72 @@ class ServerProxy(object):
         os.close(rw)
         os.close(rr)
 
-    def send(self, msg):
-        try:
+    def post(self, task, request_id, priority=NormalPriority):
+        '''
+        Send a task without waiting for its result, which `receive` returns
+        tagged with `request_id`.
+        '''
+        from .server import Request
+        self._write(Request(request_id, task, priority))
+
+    def cancel(self, request_id):
+        '''
+        Ask the worker to skip a posted task if it hasn't started yet. The
+        result of a skipped task is a `Cancelled` error.
+        '''
+        from .server import Cancel
+        self._write(Cancel(request_id))
+
+    def _write(self, msg):
+        with self._write_lock:
             pickle.dump(msg, self.fout)
             self.fout.flush()
-            res = pickle.load(self.fin)
+
+    def receive(self):
+        '''
+        Return the next `Result` sent by the worker.
+        '''
+        return pickle.load(self.fin)
+
+    def _check_terminated(self, exc):
+        '''
+        Raise `UnexpectedWorkerTerminationError` if `exc` was caused by the
+        worker process terminating.
+        '''
+        if isinstance(exc, EOFError):
+            # the worker closed the pipe; give it a moment to exit
+            try:
+                self.proc.wait(timeout=1)
+            except subprocess.TimeoutExpired:
+                pass
+        if not self.is_running:
+            retcode = self.proc.returncode
+            logging.error('Worker process terminated unexpectedly. Return code: %r.', retcode)
+            raise UnexpectedWorkerTerminationError('Return code: {}'.format(retcode), retcode) from exc
+
+    def send(self, msg):
+        '''
+        Run a task and return its result.
+
+        This must not be combined with `post`, since it discards the results
+        of any other requests.
+        '''
+        request_id = self._next_id
+        self._next_id += 1
+        try:
+            self.post(msg, request_id)
         except (Exception) as exc:
-            if not self.is_running:
-                retcode = self.proc.returncode
-                logging.error('Worker process terminated unexpectedly. Return code: %r.', retcode)
-                raise UnexpectedWorkerTerminationError('Return code: {}'.format(retcode), retcode) from exc
-            else:
-                raise
+            self._check_terminated(exc)
+            raise
 
-        if res.error is not None:
-            raise RemoteError('Failed to execute task on server.') from res.error
-        else:
-            return res.result
+        while True:
+            try:
+                res = self.receive()
+            except (Exception) as exc:
+                self._check_terminated(exc)
+                raise
+            if res.request_id == request_id:
+                return _unwrap(res)
 
     def interrupt(self):
         import signal
@@ -103,17 +163,27 @@ class ServerProxy(object):
     def is_running(self):
         return self.proc.poll() is None
 
+    def close(self):
+        for f in (self.fout, self.fin):
+            try:
+                f.close()
+            except OSError:
+                # e.g., flushing tasks posted after the worker exited
+                pass
+
     def shutdown(self):
         if self.is_running:
             from .server import ShutdownMessage
             try:
                 return self.send(ShutdownMessage())
             finally:
-                self.fout.close()
-                self.fin.close()
+                self.close()
 
     def restart(self):
-        self.shutdown()
+        if self.is_running:
+            self.shutdown()
+        else:
+            self.close()
         self.start()
 
     def __enter__(self):
@@ -125,10 +195,42 @@ class ServerProxy(object):
         return False
 
 
+def _unwrap(res):
+    from .server import Cancelled
+    if isinstance(res.error, Cancelled):
+        raise concurrent.futures.CancelledError()
+    elif res.error is not None:
+        raise RemoteError('Failed to execute task on server.') from res.error
+    else:
+        return res.result
+
+
 class _ServerProxyThread:
+    '''
+    Runs tasks in a worker process, restarting it if it crashes.
+
+    Tasks are posted as soon as they are submitted, each tagged with a
+    request ID, and a separate thread reads the results and completes the
+    matching futures, so any number of tasks may be in flight at once.
+    '''
+
+    MaxRestarts = 4
+
     def __init__(self):
         self._sp = None
         self._interrupted = False
+        self._stopping = False
+        self._lock = threading.Lock()
+        self._next_id = 0
+        self._error_count = 0
+
+        # request ID -> (future, transform) for the tasks that have been
+        # posted to the worker
+        self._pending = {}
+
+        # key -> request ID of the last task submitted with that key
+        self._keys = {}
+
     def interrupt(self):
         if self._sp is not None:
             self._interrupted = True
@@ -139,68 +241,152 @@ class _ServerProxyThread:
             self._interrupted = True
             self._sp.kill()
 
-    def run(self, q, startup_message=None):
+    def _start(self, sp, q, startup_message):
+        reader = threading.Thread(target=self._read, args=(sp, q))
+        reader.daemon = True
+        reader.start()
         if startup_message is not None:
-            extra_messages = [(True, startup_message, None, None)]
-        else:
-            extra_messages = []
+            self._post(sp, startup_message, None, None, None)
+
+    def _post(self, sp, task, future, transform, key, priority=NormalPriority):
+        with self._lock:
+            request_id = self._next_id
+            self._next_id += 1
+            self._pending[request_id] = future, transform
+            if key is not None:
+                superseded = self._keys.get(key)
+                self._keys[key] = request_id
+            else:
+                superseded = None
+
+        if superseded is not None:
+            entry = self._pending.get(superseded)
+            if entry is not None and entry[0] is not None:
+                entry[0].cancel()
 
-        error_count = 0
         try:
-            with ServerProxy() as sp:
-                self._sp = sp
+            sp.post(task, request_id, priority)
+        except OSError:
+            pass # the worker has crashed, which the reader will handle
 
-                while True:
-                    if extra_messages:
-                        m = extra_messages.pop()
+        return request_id
+
+    def _read(self, sp, q):
+        try:
+            while True:
+                res = sp.receive()
+                with self._lock:
+                    future, transform = self._pending.pop(res.request_id, (None, None))
+                self._error_count = 0
+                if future is not None and future.set_running_or_notify_cancel():
+                    try:
+                        result = _unwrap(res)
+                        if transform is not None:
+                            result = transform(result)
+                    except BaseException as exc:
+                        future.set_exception(exc)
                     else:
-                        m = q.get()
-                    keep_running, task, future, transform = m
-                    if not keep_running:
+                        future.set_result(result)
+        except Exception as exc:
+            if self._stopping or self._interrupted:
+                error = None
+            else:
+                try:
+                    sp._check_terminated(exc)
+                except UnexpectedWorkerTerminationError as termination:
+                    error = termination
+                else:
+                    logging.exception('Failed to read from worker process.')
+                    error = UnexpectedWorkerTerminationError()
+
+        pending = self._take_pending()
+
+        if not (self._stopping or self._interrupted):
+            # before failing the futures, so that tasks submitted in response
+            # go to the restarted worker
+            q.put(('crashed', sp))
+
+        self._fail(pending, error)
+
+    def _take_pending(self):
+        with self._lock:
+            pending = list(self._pending.values())
+            self._pending.clear()
+            self._keys.clear()
+        return pending
+
+    @staticmethod
+    def _fail(pending, error=None):
+        for future, _ in pending:
+            if future is not None and future.set_running_or_notify_cancel():
+                future.set_exception(error or UnexpectedWorkerTerminationError())
+
+    def run(self, q, startup_message=None):
+        try:
+            sp = ServerProxy()
+            sp.start()
+            self._sp = sp
+            self._start(sp, q, startup_message)
+
+            while True:
+                m = q.get()
+                kind = m[0]
+                if kind == 'stop':
+                    self._shutdown(sp)
+                    return
+                elif kind == 'submit':
+                    _, task, future, transform, key, priority = m
+                    if not future.cancelled():
+                        request_id = self._post(sp, task, future, transform, key, priority)
+                        future.add_done_callback(
+                            functools.partial(self._on_done, q, request_id))
+                elif kind == 'cancel':
+                    with self._lock:
+                        posted = m[1] in self._pending
+                    if posted:
+                        try:
+                            sp.cancel(m[1])
+                        except OSError:
+                            pass
+                elif kind == 'crashed' and m[1] is sp:
+                    # Tasks posted between the reader exiting and now went to
+                    # the dead worker, so they will never get a result.
+                    self._fail(self._take_pending())
+                    if self._error_count >= self.MaxRestarts:
+                        logging.error('Too many external process crashes. Will not restart.')
                         return
-                    try:
-                        if future is None or future.set_running_or_notify_cancel():
-                            result = sp.send(task)
-                        else:
-                            continue
-                    except RemoteError as exc:
-                        if future is not None:
-                            future.set_exception(exc)
-                    except UnexpectedWorkerTerminationError as exc:
-                        if self._interrupted:
-                            return
-                        if future is not None:
-                            future.set_exception(exc)
-                        if error_count >= 4:
-                            logging.error('Too many external process crashes. Will not restart.')
-                            return
-                        else:
-                            logging.error('External process crash. Restarting.')
-                        error_count += 1
-                        sp.restart()
-        #                 extra_messages.append((keep_running, task, future, transform))
-                        if startup_message is not None:
-                            extra_messages.append((True, startup_message, None, None))
                     else:
-                        error_count = 0
-                        if future is not None:
-                            if transform is not None:
-                                try:
-                                    result = transform(result)
-                                except Exception as exc:
-                                    future.set_exception(exc)
-                                else:
-                                    future.set_result(result)
-                            else:
-                                future.set_result(result)
+                        logging.error('External process crash. Restarting.')
+                    self._error_count += 1
+                    sp.restart()
+                    self._start(sp, q, startup_message)
         finally:
             try:
                 while True:
-                    _, _, future, _ = q.get_nowait()
-                    if future is not None:
-                        future.set_exception(UnexpectedWorkerTerminationError())
+                    m = q.get_nowait()
+                    if m[0] == 'submit' and m[2].set_running_or_notify_cancel():
+                        m[2].set_exception(UnexpectedWorkerTerminationError())
             except queue.Empty:
                 pass
+
+    @staticmethod
+    def _on_done(q, request_id, future):
+        if future.cancelled():
+            q.put(('cancel', request_id))
+
+    def _shutdown(self, sp):
+        from .server import ShutdownMessage
+        self._stopping = True
+        if sp.is_running:
+            future = concurrent.futures.Future()
+            self._post(sp, ShutdownMessage(), future, None, None)
+            try:
+                future.result()
+            except Exception:
+                pass
+        sp.close()
+
+
 class AsyncServerProxy(object):
     running_instances = set()
     def __init__(self, startup_message=None):
@@ -211,7 +397,7 @@ class AsyncServerProxy(object):
     @property
     def is_running(self):
         return self.thread.is_alive()
-        
+
     @classmethod
     def shutdown_all(cls):
         for p in list(cls.running_instances):
@@ -219,11 +405,11 @@ class AsyncServerProxy(object):
 
     def start(self):
         self.thread.start()
-        self.running_instances.add(self)        
+        self.running_instances.add(self)
 
     def shutdown(self):
         if self.is_running:
-            self.q.put((False, None, None, None))
+            self.q.put(('stop',))
 
             def shutdown_thread():
                 self.thread.join(timeout=1)
@@ -251,15 +437,29 @@ class AsyncServerProxy(object):
         if not self.thread.is_alive():
             self.start()
         return self
-        
+
     def __exit__(self, *args):
         self.shutdown()
-        
-    def submit(self, task, transform=None):
+
+    def submit(self, task, transform=None, *, key=None, priority=NormalPriority):
+        '''
+        Run the task in the worker process, returning a future for its
+        result (passed through `transform`, if given).
+
+        Tasks are run in the order in which they are submitted, but don't
+        wait for the results of earlier tasks to be sent. Cancelling the
+        future skips the task if the worker hasn't started it yet, and
+        submitting a task with the same `key` as an earlier task cancels the
+        earlier one (e.g., a completion request superseded by another).
+
+        A waiting task with a lower `priority` (e.g., `PrefetchPriority`)
+        runs only once no task with a higher priority is waiting. A task that
+        has started isn't interrupted.
+        '''
         future = concurrent.futures.Future()
-        self.q.put((True, task, future, transform))
+        self.q.put(('submit', task, future, transform, key, priority))
         return future
-        
+
 if __name__ == "__main__":
     sp = ServerProxy()
 
@@ -0,0 +1,258 @@
+'''
+Copies of buffers kept up to date in worker processes.
+
+Tasks that need the unsaved text of a buffer (e.g., to complete code in
+it) would otherwise send the whole text with every request. A
+`BufferMirror` records the edits made to a buffer instead, and tasks carry a
+`TextDelta` holding the edits since the last version that the worker is
+known to have, which the worker applies to its copy.
+
+Edits stay recorded until a result shows that the worker has applied them,
+so a task that is cancelled before it runs doesn't lose any. If the
+worker's copy can't be brought up to date (e.g., because the worker was
+restarted), the task fails with `MirrorOutOfDate`, and `submit_mirrored`
+sends it again with the whole text.
+'''
+
+import concurrent.futures
+import functools
+import itertools
+import threading
+
+from .client import RemoteError
+from ..notification_queue import run_in_main_thread
+
+
+class MirrorOutOfDate(Exception):
+    pass
+
+
+class TextDelta(object):
+    '''
+    The text of version `version` of a document, as either the whole `text`
+    or the `edits` since `base_version`, each a tuple
+    ``(version, index, remove, insert)`` replacing `remove` characters at
+    `index` with `insert`.
+    '''
+
+    def __init__(self, doc, version, *, base_version=None, edits=(), text=None):
+        self.doc = doc
+        self.version = version
+        self.base_version = base_version
+        self.edits = edits
+        self.text = text
+
+    def resolve(self, worker):
+        '''
+        Return the text, updating the copy kept by the worker.
+
+        This runs in the worker process.
+        '''
+        mirrors = worker.__dict__.setdefault('mirrors', {})
+        if self.text is not None:
+            mirrors[self.doc] = self.version, self.text
+            return self.text
+
+        version, text = mirrors.get(self.doc, (None, None))
+        if version is None or not self.base_version <= version <= self.version:
+            raise MirrorOutOfDate(self.doc, version, self.base_version)
+
+        text = _apply_edits(text, [edit[1:] for edit in self.edits if edit[0] > version])
+        mirrors[self.doc] = self.version, text
+        return text
+
+
+def _apply_edits(text, edits):
+    '''
+    Apply the edits ``(index, remove, insert)`` to the text in order.
+
+    Only the part of the text between the first and last edited positions
+    is copied for each edit, so that edits close to each other (e.g., typing)
+    cost little regardless of the length of the text.
+    '''
+    if not edits:
+        return text
+
+    # The text is text[:lo] + middle + text[hi:].
+    lo = hi = edits[0][0]
+    middle = ''
+    for index, remove, insert in edits:
+        if index < lo:
+            middle = text[index:lo] + middle
+            lo = index
+        end = index + remove - lo
+        if end > len(middle):
+            extra = end - len(middle)
+            middle += text[hi:hi + extra]
+            hi += extra
+        start = index - lo
+        middle = middle[:start] + insert + middle[end:]
+
+    return text[:lo] + middle + text[hi:]
+
+
+def resolve_text(worker, unsaved):
+    '''
+    Return the text for `unsaved`, which is either a string or a
+    `TextDelta`.
+    '''
+    if isinstance(unsaved, TextDelta):
+        return unsaved.resolve(worker)
+    return unsaved
+
+
+class ForgetMirror(object):
+    '''
+    Drop a worker's copy of a document.
+    '''
+    def __init__(self, doc):
+        self.doc = doc
+
+    def __call__(self, worker):
+        getattr(worker, 'mirrors', {}).pop(self.doc, None)
+
+
+class BufferMirror(object):
+    '''
+    Records the edits made to a buffer, to send them to workers as
+    `TextDelta` objects.
+
+    `delta` must be called from the thread that modifies the buffer;
+    `acknowledge` and `reset` may be called from any thread.
+    '''
+
+    # If more edits than this haven't been acknowledged, the whole text is
+    # sent instead.
+    MaxEdits = 1000
+
+    _docs = itertools.count()
+
+    def __init__(self, buff):
+        self.buff = buff
+        self.doc = next(self._docs)
+
+        self._lock = threading.Lock()
+        # the version the worker is known to have, if any
+        self._base = None
+        # (version, index, remove, insert) for the edits made since then
+        self._edits = []
+        # the version of the buffer after the last recorded edit
+        self._version = buff.version
+
+        buff.text_modified.connect(self._on_text_modified)
+
+    def _on_text_modified(self, mod):
+        buff = self.buff
+        edit = buff.version, buff.calculate_index(mod.pos), len(mod.remove), mod.insert
+        with self._lock:
+            if buff.version != self._version + 1 or len(self._edits) >= self.MaxEdits:
+                # The buffer changed without an edit being recorded (e.g., all
+                # of its lines were replaced), or too much has changed.
+                self._base = None
+                self._edits.clear()
+            self._edits.append(edit)
+            self._version = buff.version
+
+    def delta(self):
+        '''
+        Return a `TextDelta` for the current text.
+        '''
+        version = self.buff.version
+        with self._lock:
+            if version != self._version:
+                self._base = None
+                self._edits.clear()
+                self._version = version
+
+            if self._base is None:
+                return TextDelta(self.doc, version, text=self.buff.text)
+            return TextDelta(self.doc, version, base_version=self._base,
+                             edits=tuple(self._edits))
+
+    def acknowledge(self, version):
+        '''
+        Note that the worker has applied the edits up to `version`.
+        '''
+        with self._lock:
+            if self._base is not None and version <= self._base:
+                return
+            self._base = version
+            edits = self._edits
+            i = 0
+            while i < len(edits) and edits[i][0] <= version:
+                i += 1
+            del edits[:i]
+
+    def reset(self):
+        '''
+        Send the whole text with the next delta.
+        '''
+        with self._lock:
+            self._base = None
+
+    def dispose(self):
+        self.buff.text_modified.disconnect(self._on_text_modified)
+
+
+def submit_mirrored(proxy, mirror, make_task, transform=None, *, key=None):
+    '''
+    Submit ``make_task(delta)``, where `delta` is the `mirror`'s `TextDelta`,
+    to the proxy, returning a future for the result like
+    `AsyncServerProxy.submit`.
+
+    If the worker's copy of the text is out of date, the task is made again
+    with the whole text (on the main thread) and resubmitted.
+    '''
+    result = concurrent.futures.Future()
+    current = []
+
+    def submit(delta):
+        future = proxy.submit(make_task(delta), key=key)
+        current[:] = [future]
+        future.add_done_callback(functools.partial(done, delta))
+
+    def resubmit():
+        if not result.cancelled():
+            mirror.reset()
+            submit(mirror.delta())
+
+    def done(delta, future):
+        if result.cancelled():
+            return
+        elif future.cancelled():
+            result.cancel()
+            return
+
+        try:
+            value = future.result()
+        except RemoteError as exc:
+            if isinstance(exc.__cause__, MirrorOutOfDate) and delta.text is None:
+                run_in_main_thread(resubmit)
+                return
+            error = exc
+        except Exception as exc:
+            error = exc
+        else:
+            mirror.acknowledge(delta.version)
+            error = None
+            if transform is not None:
+                try:
+                    value = transform(value)
+                except Exception as exc:
+                    error = exc
+
+        if not result.set_running_or_notify_cancel():
+            return
+        if error is not None:
+            result.set_exception(error)
+        else:
+            result.set_result(value)
+
+    def cancelled(future):
+        if future.cancelled():
+            for f in current:
+                f.cancel()
+
+    result.add_done_callback(cancelled)
+    submit(mirror.delta())
+    return result
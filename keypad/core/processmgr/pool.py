@@ -0,0 +1,292 @@
+'''
+Worker processes shared by many clients.
+
+A `WorkerPool` runs tasks for the clients of one kind of worker (e.g., the
+code models of every open C++ file with the same configuration) on a
+bounded number of `AsyncServerProxy` workers. Each client leases a share of
+the pool with an affinity, such as its file name, and the tasks for an
+affinity always go to the same worker, so the state the worker keeps for
+it (e.g., a parsed translation unit) stays warm.
+'''
+
+import itertools
+import logging
+import os
+import threading
+import time
+
+from .client import AsyncServerProxy, NormalPriority
+
+
+def default_max_workers():
+    return max(1, min(4, (os.cpu_count() or 1) // 2))
+
+
+class WorkerLease(object):
+    '''
+    A client's share of a `WorkerPool`, with the interface of
+    `AsyncServerProxy`.
+
+    The `affinity` may be changed (e.g., when the client learns its file
+    name), in which case later tasks go to the worker for the new affinity.
+    '''
+
+    _ids = itertools.count()
+
+    def __init__(self, pool, affinity):
+        self._pool = pool
+        self._id = next(self._ids)
+        self._affinity = affinity
+
+    @property
+    def affinity(self):
+        return self._affinity
+
+    @affinity.setter
+    def affinity(self, affinity):
+        if affinity != self._affinity:
+            self._pool._move(self, affinity)
+
+    def submit(self, task, transform=None, *, key=None, priority=NormalPriority, affinity=None):
+        '''
+        Run the task on the worker assigned to this lease's affinity. Keys
+        only supersede tasks submitted through the same lease.
+
+        If another `affinity` is given (e.g., to prepare a worker for a
+        file that will be opened later), the task runs on the worker
+        assigned to that affinity, which is this lease's worker if it has
+        none yet.
+        '''
+        if key is not None:
+            key = self._id, key
+        return self._pool._worker_for(self, affinity).submit(
+            task, transform, key=key, priority=priority)
+
+    def release(self):
+        '''
+        Give up the lease. The worker is shut down once no lease has used it
+        for `WorkerPool.IdleTimeout` seconds.
+        '''
+        self._pool._release(self)
+
+    def shutdown(self):
+        self.release()
+
+
+class _Worker(object):
+    __slots__ = 'proxy', 'idle_since'
+
+    def __init__(self, startup_message):
+        self.proxy = AsyncServerProxy(startup_message)
+        # Idle workers must not keep the application from exiting; the
+        # worker process exits when its pipe is closed.
+        self.proxy.thread.daemon = True
+        self.proxy.start()
+        self.idle_since = None
+
+
+class WorkerPool(object):
+    '''
+    Runs tasks for many clients on at most `max_workers` worker processes
+    (default: `default_max_workers()`), each started with
+    `startup_message`.
+
+    A worker is assigned to a lease when its first task is submitted. A new
+    affinity is assigned a new worker while there are fewer than
+    `max_workers`, and otherwise the worker with the fewest leases. The
+    assignment is kept until the worker is shut down, so a client that
+    releases its lease and takes another for the same affinity returns to
+    the same worker. A worker that crashes too often to be restarted is
+    replaced.
+    '''
+
+    IdleTimeout = 120
+
+    def __init__(self, startup_message=None, max_workers=None):
+        self.startup_message = startup_message
+        self.max_workers = max_workers or default_max_workers()
+
+        self._lock = threading.Lock()
+        self._workers = []
+        self._affinities = {} # affinity -> _Worker
+        self._leases = set()
+
+    def lease(self, affinity=None):
+        '''
+        Return a `WorkerLease` for the given affinity. Leases without an
+        affinity each get their own worker assignment, which moves to the
+        affinity given to them later if that has no worker yet.
+        '''
+        lease = WorkerLease(self, affinity)
+        with self._lock:
+            self._leases.add(lease)
+        return lease
+
+    @property
+    def worker_count(self):
+        with self._lock:
+            return len(self._workers)
+
+    def shutdown(self):
+        with self._lock:
+            workers = self._workers
+            self._workers = []
+            self._affinities.clear()
+        for worker in workers:
+            worker.proxy.shutdown()
+
+    @staticmethod
+    def _key(lease):
+        if lease.affinity is None:
+            return 'lease', lease._id
+        return lease.affinity
+
+    def _lease_count(self, worker):
+        return sum(1 for lease in self._leases
+                   if self._affinities.get(self._key(lease)) is worker)
+
+    def _assign(self, affinity):
+        worker = self._affinities.get(affinity)
+        if worker is not None and worker.proxy.is_running:
+            return worker
+
+        dead = [w for w in self._workers if not w.proxy.is_running]
+        if dead:
+            logging.error('Replacing %d failed worker processes.', len(dead))
+            self._remove(dead)
+
+        if len(self._workers) < self.max_workers:
+            worker = _Worker(self.startup_message)
+            self._workers.append(worker)
+        else:
+            worker = min(self._workers, key=self._lease_count)
+
+        self._affinities[affinity] = worker
+        return worker
+
+    def _remove(self, workers):
+        self._workers = [w for w in self._workers if w not in workers]
+        self._affinities = {a: w for (a, w) in self._affinities.items()
+                            if w not in workers}
+
+    def _worker_for(self, lease, affinity=None):
+        with self._lock:
+            worker = self._assign(self._key(lease))
+            worker.idle_since = None
+            if affinity is not None:
+                assigned = self._affinities.get(affinity)
+                if assigned is not None and assigned.proxy.is_running:
+                    worker = assigned
+                else:
+                    self._affinities[affinity] = worker
+            return worker.proxy
+
+    def _move(self, lease, affinity):
+        with self._lock:
+            old_key, had_affinity = self._key(lease), lease.affinity is not None
+            lease._affinity = affinity
+            if lease not in self._leases:
+                return
+
+            if not had_affinity:
+                # Nothing else uses the lease's own assignment, so its
+                # worker can take the new affinity.
+                worker = self._affinities.pop(old_key, None)
+                if worker is not None and worker.proxy.is_running:
+                    self._affinities.setdefault(affinity, worker)
+            else:
+                worker = self._affinities.get(old_key)
+            if not self._became_idle(worker):
+                return
+
+        self._schedule_reap()
+
+    def _release(self, lease):
+        with self._lock:
+            if lease not in self._leases:
+                return
+            self._leases.discard(lease)
+            key = self._key(lease)
+            if lease.affinity is None:
+                worker = self._affinities.pop(key, None)
+            else:
+                worker = self._affinities.get(key)
+            if not self._became_idle(worker):
+                return
+
+        self._schedule_reap()
+
+    def _became_idle(self, worker):
+        '''
+        Mark the worker idle if no lease uses it any more, returning whether
+        it was.
+        '''
+        if worker is None or self._lease_count(worker):
+            return False
+        worker.idle_since = time.monotonic()
+        return True
+
+    def _schedule_reap(self):
+        timer = threading.Timer(self.IdleTimeout, self._reap)
+        timer.daemon = True
+        timer.start()
+
+    def _reap(self):
+        '''
+        Shut down the workers that have been idle for `IdleTimeout` seconds.
+        '''
+        deadline = time.monotonic() - self.IdleTimeout
+        with self._lock:
+            idle = [w for w in self._workers
+                    if w.idle_since is not None and w.idle_since <= deadline
+                    and not self._lease_count(w)]
+            self._remove(idle)
+
+        for worker in idle:
+            worker.proxy.shutdown()
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+def worker_pool(key, startup_message=None):
+    '''
+    Return the pool shared by the clients that use the given key (e.g., a
+    language and a `settings_key`), creating it with `startup_message` if
+    there is none.
+    '''
+    with _pools_lock:
+        try:
+            return _pools[key]
+        except KeyError:
+            pool = _pools[key] = WorkerPool(startup_message)
+            return pool
+
+
+def _freeze(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(map(_freeze, value))
+    elif isinstance(value, dict):
+        return tuple(sorted((k, _freeze(v)) for (k, v) in value.items()))
+    else:
+        return value
+
+
+def settings_key(settings):
+    '''
+    Return a hashable value that is equal for `Settings` objects of the same
+    type with the same values.
+    '''
+    return (type(settings).__name__,) + tuple(
+        (name, _freeze(getattr(settings, name))) for name in sorted(settings._fields_))
+
+
+def settings_snapshot(settings):
+    '''
+    Return a copy of `Settings` with its current values that doesn't follow
+    later changes, e.g., to start workers with.
+    '''
+    result = type(settings)()
+    for name in settings._fields_:
+        setattr(result, name, getattr(settings, name))
+    return result
@@ -1,57 +1,123 @@
-
+import itertools
 import os
 import pickle
 import subprocess
 import logging
+import queue
+import threading
 import types
 
 class Result(object):
-    def __init__(self, result, error):
+    def __init__(self, result, error, request_id=None):
         self.result = result
         self.error = error
+        self.request_id = request_id
+
+
+class Request(object):
+    '''
+    A task tagged with an ID, which the result sent back for it carries.
+
+    Waiting tasks with a higher priority run first, and tasks with the same
+    priority run in the order they were sent.
+    '''
+    def __init__(self, request_id, task, priority=0):
+        self.request_id = request_id
+        self.task = task
+        self.priority = priority
+
+
+class Cancel(object):
+    '''
+    Skip the request with the given ID if it hasn't started yet.
+    '''
+    def __init__(self, request_id):
+        self.request_id = request_id
+
+
+class Cancelled(Exception):
+    pass
+
 
-        
 class ShutdownMessage(object):
     pass
-    
 
 
-    
+
+def _read_requests(fin, requests, cancelled):
+    # Reads ahead of the task being run, so that cancellations are seen
+    # before the tasks they refer to start, and so that the waiting task with
+    # the highest priority can be run next.
+    order = itertools.count()
+    try:
+        while True:
+            msg = pickle.load(fin)
+            if isinstance(msg, Cancel):
+                cancelled.add(msg.request_id)
+            else:
+                requests.put((-msg.priority, next(order), msg))
+    except (EOFError, OSError, pickle.UnpicklingError):
+        # the client has gone away, so there's no point running the rest
+        requests.put((float('-inf'), next(order), None))
+
+
 def serve(fd_r, fd_w):
-    ns = types.SimpleNamespace()    
+    ns = types.SimpleNamespace()
+    requests = queue.PriorityQueue()
+    cancelled = set()
+
     with open(fd_r, 'rb') as fin, open(fd_w, 'wb') as fout:
+        reader = threading.Thread(target=_read_requests, args=(fin, requests, cancelled))
+        reader.daemon = True
+        reader.start()
+
         while True:
-            msg = pickle.load(fin)
-            
-            if isinstance(msg, ShutdownMessage):
-                pickle.dump(Result(result=None, error=None), fout)
+            _, _, req = requests.get()
+            if req is None:
+                return
+
+            if isinstance(req.task, ShutdownMessage):
+                pickle.dump(Result(result=None, error=None, request_id=req.request_id), fout)
                 fout.flush()
                 return
-            
+
+            if req.request_id in cancelled:
+                cancelled.discard(req.request_id)
+                pickle.dump(Result(result=None, error=Cancelled(), request_id=req.request_id), fout)
+                fout.flush()
+                continue
+
             try:
-                res = msg(ns)
+                res = req.task(ns)
             except (Exception, GeneratorExit) as exc:
                 logging.exception('Translating error')
-                pickle.dump(Result(result=None, error=exc), fout)
+                pickle.dump(Result(result=None, error=exc, request_id=req.request_id), fout)
             else:
-                pickle.dump(Result(result=res, error=None), fout)
+                pickle.dump(Result(result=res, error=None, request_id=req.request_id), fout)
 
             finally:
+                cancelled.discard(req.request_id)
                 fout.flush()
-                
-                
-            
+
+
+
 import platform
 
 def main():
     import sys
     fd_r = int(sys.argv[1])
     fd_w = int(sys.argv[2])
-    
+
     if platform.system() == 'Windows':
         import msvcrt
         fd_r = msvcrt.open_osfhandle(fd_r, 0)
         fd_w = msvcrt.open_osfhandle(fd_w, 0)
-    
+
     serve(fd_r, fd_w)
-    
\ No newline at end of file
+
+if __name__ == '__main__':
+    import sys
+    # remove empty curent directory entry from path
+    sys.path = [entry for entry in list(sys.path) if entry]
+    from .server import main
+    main()
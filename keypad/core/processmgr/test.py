@@ -1,6 +1,13 @@
 
+import concurrent.futures
+import random
+import time
 import unittest
-from .client import AsyncServerProxy, UnexpectedWorkerTerminationError
+from .client import AsyncServerProxy, UnexpectedWorkerTerminationError, IdlePriority
+from .pool import WorkerPool
+from .mirror import BufferMirror, ForgetMirror, submit_mirrored, _apply_edits
+from ..notification_queue import process_events
+from ...buffers import Buffer
 import logging
 from . import testfunc
 
@@ -22,8 +29,172 @@ class TestAsyncServerProxyRestart(unittest.TestCase):
         except UnexpectedWorkerTerminationError:
             pass
         assert self.runner.submit(testfunc.TestServerInitialized()).result()
+
+    def test_that_tasks_posted_during_crash_complete(self):
+        futures = [self.runner.submit(testfunc.CrashServer())]
+        futures += [self.runner.submit(testfunc.Echo(i)) for i in range(2000)]
+        _, not_done = concurrent.futures.wait(futures, timeout=10)
+        assert not not_done
+        assert self.runner.submit(testfunc.TestServerInitialized()).result()
     
     
+class TestAsyncServerProxyPipelining(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = AsyncServerProxy()
+        self.runner.start()
+
+    def tearDown(self):
+        self.runner.shutdown()
+
+    def test_that_results_match_requests(self):
+        futures = [self.runner.submit(testfunc.Echo(i)) for i in range(100)]
+        assert [f.result() for f in futures] == list(range(100))
+
+    def test_that_cancelled_tasks_are_skipped(self):
+        busy = self.runner.submit(testfunc.Echo('busy', delay=0.2))
+        cancelled = self.runner.submit(testfunc.Echo('cancelled'))
+        assert cancelled.cancel()
+        assert busy.result() == 'busy'
+        assert self.runner.submit(testfunc.Echo('next')).result() == 'next'
+
+    def test_that_superseded_tasks_are_cancelled(self):
+        self.runner.submit(testfunc.Echo('busy', delay=0.2))
+        futures = [self.runner.submit(testfunc.Echo(i), key='complete') for i in range(10)]
+        assert futures[-1].result() == 9
+        assert all(f.cancelled() for f in futures[:-1])
+
+    def test_that_higher_priority_tasks_go_first(self):
+        self.runner.submit(testfunc.Echo('busy', delay=0.2))
+        finished = []
+        background = [self.runner.submit(testfunc.Echo(i), priority=IdlePriority) for i in range(5)]
+        urgent = self.runner.submit(testfunc.Echo('urgent'))
+        for f in background + [urgent]:
+            f.add_done_callback(finished.append)
+        assert urgent.result() == 'urgent'
+        assert [f.result() for f in background] == list(range(5))
+        assert finished[0] is urgent
+
+class TestWorkerPool(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = WorkerPool(testfunc.InitServer(), max_workers=2)
+        self.pool.IdleTimeout = 0.1
+
+    def tearDown(self):
+        self.pool.shutdown()
+
+    def test_that_workers_are_bounded_and_affinities_kept(self):
+        leases = [self.pool.lease(name) for name in 'abcab']
+        pids = [lease.submit(testfunc.GetPid()).result() for lease in leases]
+        assert self.pool.worker_count == 2
+        assert pids[0] != pids[1]
+        assert pids[3:] == pids[:2]
+        assert all(lease.submit(testfunc.TestServerInitialized()).result() for lease in leases)
+
+    def test_that_keys_are_per_lease(self):
+        first, second = self.pool.lease('a'), self.pool.lease('a')
+        f1 = first.submit(testfunc.Echo(1, delay=0.1), key='complete')
+        f2 = second.submit(testfunc.Echo(2), key='complete')
+        assert (f1.result(), f2.result()) == (1, 2)
+
+    def test_that_tasks_can_prepare_other_affinities(self):
+        lease = self.pool.lease('a')
+        pid = lease.submit(testfunc.GetPid(), affinity='b').result()
+        assert self.pool.lease('b').submit(testfunc.GetPid()).result() == pid
+        assert self.pool.worker_count == 1
+
+    def test_that_idle_workers_are_reaped(self):
+        lease = self.pool.lease('a')
+        lease.submit(testfunc.GetPid()).result()
+        lease.release()
+        time.sleep(0.5)
+        assert self.pool.worker_count == 0
+
+    def test_that_leases_keep_their_worker_when_given_an_affinity(self):
+        lease = self.pool.lease()
+        pid = lease.submit(testfunc.GetPid()).result()
+        lease.affinity = 'a'
+        assert lease.submit(testfunc.GetPid()).result() == pid
+        assert self.pool.worker_count == 1
+        lease.release()
+        time.sleep(0.5)
+        assert self.pool.worker_count == 0
+
+    def test_that_workers_left_by_a_lease_are_reaped(self):
+        first, second = self.pool.lease('a'), self.pool.lease('b')
+        pid = first.submit(testfunc.GetPid()).result()
+        assert second.submit(testfunc.GetPid()).result() != pid
+        first.affinity = 'b'
+        time.sleep(0.5)
+        assert self.pool.worker_count == 1
+        assert first.submit(testfunc.GetPid()).result() != pid
+
+
+class TestBufferMirror(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = AsyncServerProxy()
+        self.runner.start()
+        self.buff = Buffer()
+        self.buff.insert((0, 0), 'hello\nworld\n')
+        self.mirror = BufferMirror(self.buff)
+        self.sent = []
+
+    def tearDown(self):
+        self.mirror.dispose()
+        self.runner.shutdown()
+
+    def mirrored_text(self, delta):
+        self.sent.append(delta)
+        return testfunc.MirroredText(delta)
+
+    def submit(self):
+        future = submit_mirrored(self.runner, self.mirror, self.mirrored_text)
+        deadline = time.monotonic() + 10
+        while not future.done() and time.monotonic() < deadline:
+            process_events()
+            time.sleep(0.01)
+        return future.result()
+
+    def test_that_only_edits_are_sent(self):
+        assert self.submit() == self.buff.text
+        self.buff.insert((1, 0), 'big ')
+        self.buff.remove((0, 0), 1)
+        assert self.submit() == self.buff.text
+        assert self.sent[0].text is not None
+        assert self.sent[1].text is None and len(self.sent[1].edits) == 2
+
+    def test_that_cancelled_tasks_keep_their_edits(self):
+        self.submit()
+        self.runner.submit(testfunc.Echo('busy', delay=0.2))
+        self.buff.insert((0, 0), 'one ')
+        future = submit_mirrored(self.runner, self.mirror, self.mirrored_text)
+        assert future.cancel()
+        self.buff.insert((0, 0), 'two ')
+        assert self.submit() == self.buff.text
+        assert self.sent[-1].text is None
+
+    def test_that_lost_copies_are_resent(self):
+        self.submit()
+        self.runner.submit(ForgetMirror(self.mirror.doc)).result()
+        self.buff.insert((0, 0), 'again ')
+        assert self.submit() == self.buff.text
+        assert self.sent[-2].text is None and self.sent[-1].text is not None
+
+    def test_that_edits_are_applied_in_order(self):
+        prng = random.Random(0)
+        for _ in range(200):
+            text = expected = ''.join(prng.choice('ab\n') for _ in range(prng.randrange(20)))
+            edits = []
+            for _ in range(prng.randrange(1, 10)):
+                index = prng.randrange(len(expected) + 1)
+                remove = prng.randrange(len(expected) - index + 1)
+                insert = ''.join(prng.choice('xy') for _ in range(prng.randrange(3)))
+                edits.append((index, remove, insert))
+                expected = expected[:index] + insert + expected[index + remove:]
+            assert _apply_edits(text, edits) == expected
+
 
 def test_that_fourth_error_is_fatal():
     try:
@@ -15,7 +15,30 @@ class TestServerInitialized(object):
     def __call__(self, worker):
         return getattr(worker, 'initialized', False)
 
+class Echo(object):
+    def __init__(self, value, delay=0):
+        self.value = value
+        self.delay = delay
 
+    def __call__(self, worker):
+        if self.delay:
+            time.sleep(self.delay)
+        return self.value
+
+
+
+class MirroredText(object):
+    def __init__(self, text):
+        self.text = text
+
+    def __call__(self, worker):
+        from .mirror import resolve_text
+        return resolve_text(worker, self.text)
+
+
+class GetPid(object):
+    def __call__(self, worker):
+        return os.getpid()
 
 
 def say_hello(s):
@@ -5,7 +5,7 @@ Lexer support library.
 from .syntaxlib import (Any, Lexer, AnyLexer, RegexLexer, 
                         RegionLexer, NothingLexer, TokenizerEvent,
                         UnionTokenizer, AbstractTokenizer,
-                        regex, region, keyword)
+                        intern_state, regex, region, keyword)
 
 from .syntax import SyntaxHighlighter, lazy
 
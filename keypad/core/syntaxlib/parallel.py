@@ -0,0 +1,314 @@
+'''
+Speculative, multi-process highlighting for files that have just been opened.
+
+The lines after the first chunk are split into chunks that are highlighted
+in worker processes as if each began in the tokenizer's initial state. Each
+worker is sent the highlighter once, when it starts, and sends back the
+runs of lexical categories of each line rather than the lines themselves.
+The results are applied to the lines that haven't been highlighted yet, and
+the first line of each chunk is marked as modified, so that the highlighter
+checks the guess: it highlights the line again from the real state and
+continues only as long as the resulting states differ from the speculative
+ones.
+
+States and token stacks refer to lexers, which can't be sent between
+processes without being copied, so they are encoded as indices into a
+deterministic traversal of the lexer graph. Lexers created while
+tokenizing (e.g., the end of a raw string) can't be encoded; highlighting
+results are not applied from such a line onwards.
+'''
+
+import atexit
+import collections
+import logging
+import multiprocessing
+import os
+import pickle
+import time
+from concurrent import futures
+
+from ..attributed_string import AttributedString
+from .syntaxlib import Lexer, intern_state
+
+
+_disabled = False
+
+# the worker pools of the most recently used kinds of highlighters, by type
+# and name
+_pools = collections.OrderedDict()
+MaxPools = 2
+
+# Drop the pools while the modules they use are still there.
+atexit.register(_pools.clear)
+
+
+def _roots(tokenizer):
+    if hasattr(tokenizer, 'start_lexer'):
+        yield tokenizer.start_lexer
+    elif hasattr(tokenizer, '_tokenizers'):
+        for t in tokenizer._tokenizers:
+            yield from _roots(t)
+    else:
+        raise TypeError('cannot index the lexers of {!r}'.format(tokenizer))
+
+
+class _LexerIndex(object):
+    '''
+    Numbers the lexers reachable from a tokenizer in the same order in every
+    process.
+    '''
+    def __init__(self, tokenizer):
+        self.lexers = []
+        self.indices = {}
+
+        stack = list(reversed(list(_roots(tokenizer))))
+        while stack:
+            lexer = stack.pop()
+            if not isinstance(lexer, Lexer) or id(lexer) in self.indices:
+                continue
+            self.indices[id(lexer)] = len(self.lexers)
+            self.lexers.append(lexer)
+
+            children = list(lexer.contains)
+            children.append(getattr(lexer, 'guard', None))
+            children.append(getattr(lexer, 'exit', None))
+            stack.extend(reversed(children))
+
+    def encode(self, value):
+        '''
+        Encode a state or token stack, returning None if it refers to a lexer
+        that isn't in the index.
+        '''
+        if isinstance(value, Lexer):
+            return self.indices.get(id(value))
+        elif isinstance(value, int):
+            return value
+        else:
+            result = tuple(map(self.encode, value))
+            return None if None in result else result
+
+    def decode_state(self, code):
+        if isinstance(code, int):
+            return self.lexers[code]
+        else:
+            return intern_state(tuple(map(self.decode_state, code)))
+
+    def decode_token_stack(self, code):
+        return tuple((self.lexers[index], start) for index, start in code)
+
+
+# the highlighter of a worker process, and the index of its lexers
+_highlighter = None
+_index = None
+
+def _init_worker(payload):
+    global _highlighter, _index
+    _highlighter = pickle.loads(payload)
+    _index = _LexerIndex(_highlighter._tokenizer)
+
+
+def _lexcat_runs(line, base_lexcat):
+    '''
+    Return ``(start, end, lexcat)`` for each run of the line whose lexical
+    category isn't `base_lexcat`.
+    '''
+    runs = []
+    start = 0
+    lexcat = base_lexcat
+    for chunk, deltas in line.iterchunks():
+        lexcat = deltas.get('lexcat', lexcat)
+        end = start + len(chunk)
+        if lexcat != base_lexcat:
+            runs.append((start, end, lexcat))
+        start = end
+    return tuple(runs)
+
+
+def _highlight_chunk(texts):
+    '''
+    Highlight the lines starting from the initial state, returning a list of
+    ``(runs, end_state, token_stack)`` for each line, where `runs` is given
+    by `_lexcat_runs`. The states and token stacks are encoded by
+    `_LexerIndex`.
+
+    This runs in a worker process started by `_worker_pool`.
+    '''
+    highlighter = _highlighter
+    base_lexcat = highlighter._base_attrs.get('lexcat')
+    highlighter._tokenizer.reset()
+    state = highlighter._tokenizer.save()
+    token_stack = []
+
+    results = []
+    for text in texts:
+        line = AttributedString(text)
+        state, token_stack = highlighter._highlight_line(line, state, token_stack)
+        results.append((_lexcat_runs(line, base_lexcat),
+                        _index.encode(state), _index.encode(token_stack)))
+
+    return results
+
+
+def _worker_pool(highlighter):
+    '''
+    Return a process pool whose workers have a copy of the highlighter, or
+    of another one of the same type and name. The workers are fresh
+    interpreters rather than forks of the GUI process.
+    '''
+    key = type(highlighter), highlighter._name
+    try:
+        _pools.move_to_end(key)
+        return _pools[key]
+    except KeyError:
+        pass
+
+    while len(_pools) >= MaxPools:
+        _, pool = _pools.popitem(last=False)
+        pool.shutdown(wait=False)
+
+    pool = _pools[key] = futures.ProcessPoolExecutor(
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=_init_worker,
+        initargs=(pickle.dumps(highlighter),)
+    )
+    return pool
+
+
+class ColdOpen(object):
+    '''
+    Highlights the lines of a buffer from `first_line` onwards in worker
+    processes, in chunks of `chunk_lines` lines.
+
+    The buffer may be modified while the workers run, as long as `modified`
+    is called for each modification; the results for lines that have changed
+    are dropped.
+    '''
+
+    def __init__(self, highlighter, buff, first_line, chunk_lines):
+        self._highlighter = highlighter
+        self._index = _LexerIndex(highlighter._tokenizer)
+        self._decoded = {}
+        self._chunks = []
+
+        tokenizer = highlighter._tokenizer
+        tokenizer.reset()
+        self._initial_state = self._index.encode(tokenizer.save())
+
+        executor = _worker_pool(highlighter)
+        lines = buff.lines
+        for start in range(first_line, len(lines), chunk_lines):
+            texts = [line.text for line in lines[start:start + chunk_lines]]
+            future = executor.submit(_highlight_chunk, texts)
+            # [start line, future, number of results applied, number usable]
+            self._chunks.append([start, future, 0, len(texts)])
+
+    @property
+    def done(self):
+        return not self._chunks
+
+    def cancel(self):
+        for chunk in self._chunks:
+            chunk[1].cancel()
+        self._chunks.clear()
+
+    def modified(self, y, removed, delta):
+        '''
+        Adjust for a modification of the buffer starting on line `y`, which
+        removed `removed` lines and changed the line count by `delta`.
+        '''
+        for chunk in self._chunks:
+            start, _, applied, usable = chunk
+            if y >= start + usable:
+                continue
+            elif y >= start:
+                usable = y - start
+            elif y + removed >= start:
+                usable = 0
+            else:
+                chunk[0] = start + delta
+                continue
+            chunk[3] = max(applied, usable)
+
+    def apply(self, lines, pending, deadline):
+        '''
+        Apply the results that have arrived to the lines that haven't been
+        highlighted yet, until the deadline passes.
+        '''
+        hl = self._highlighter
+
+        while self._chunks and time.time() < deadline:
+            chunk = self._chunks[0]
+            start, future, applied, usable = chunk
+            if applied < usable and not future.done():
+                return
+
+            try:
+                results = future.result() if applied < usable else ()
+            except Exception:
+                logging.exception('Parallel highlighting failed; continuing serially.')
+                disable()
+                self.cancel()
+                return
+
+            checked = False
+            for line in lines[start + applied:start + usable]:
+                if time.time() >= deadline:
+                    break
+
+                y = start + applied
+                runs, end_state, token_stack = results[applied]
+                applied += 1
+
+                if line.caches.get(hl._start_state_key) is not None:
+                    checked = False
+                    continue # already highlighted
+
+                if end_state is None or token_stack is None:
+                    # can't be decoded; leave the rest for the highlighter
+                    pending.add(y)
+                    applied = usable
+                    break
+
+                line.set_attributes(0, None, **hl._base_attrs)
+                for run_start, run_end, lexcat in runs:
+                    line.set_attributes(run_start, run_end, lexcat=lexcat)
+
+                if applied == 1:
+                    start_state = self._initial_state
+                else:
+                    start_state = results[applied - 2][1]
+
+                line.caches[hl._token_stack_key] = self._decode(token_stack, self._index.decode_token_stack)
+                line.caches[hl._start_state_key] = self._decode(start_state, self._index.decode_state)
+                line.caches[hl._end_state_key] = self._decode(end_state, self._index.decode_state)
+
+                if not checked:
+                    # make the highlighter check this guess
+                    pending.add(y)
+                    checked = True
+
+            chunk[2] = applied
+            if applied >= usable:
+                del self._chunks[0]
+
+    def _decode(self, code, decode):
+        # Most lines share a few states, so decode each only once.
+        key = decode, code
+        try:
+            return self._decoded[key]
+        except KeyError:
+            value = self._decoded[key] = decode(code)
+            return value
+
+
+def can_highlight_in_parallel():
+    return not _disabled and (os.cpu_count() or 1) > 1
+
+
+def disable():
+    '''
+    Stop highlighting in parallel, e.g., because the worker processes can't
+    be started or a highlighter can't be sent to them.
+    '''
+    global _disabled
+    _disabled = True
@@ -1,9 +1,143 @@
+import bisect
 import logging
+import time
+import weakref
 
 from .syntaxlib import AbstractTokenizer, Tokenizer, TokenizerEvent
-from keypad.util import time_limited
+
+
+class _PendingLines(object):
+    '''
+    The sorted indices of the lines of a buffer that have changed since a
+    particular highlighter last saw them.
+
+    Instances are shared by all highlighters with the same name, since most
+    callers create a new `SyntaxHighlighter` for every pass.
+    '''
+
+    _instances = weakref.WeakKeyDictionary()
+
+    # the lines to highlight first for each buffer, as (start, stop)
+    priorities = weakref.WeakKeyDictionary()
+
+    # The lines of read-only buffers are discarded from memory and lose their
+    # highlighting (see `keypad.buffers.MappedLines`), so the state at the
+    # start of every `checkpoint_interval`th line is kept, to highlight them
+    # again from. The interval doubles whenever there would be more than
+    # MaxCheckpoints of them.
+    CheckpointInterval = 128
+    MaxCheckpoints = 1 << 14
+
+    def __init__(self, buff):
+        self.lines = [0]
+        self.cold_open = None
+        self.checkpoints = {} # line -> (state, token stack)
+        self.checkpoint_interval = self.CheckpointInterval
+        # (line, state, token stack) from which to continue highlighting
+        # discarded lines again, if the time ran out
+        self.rehighlight = None
+        buff.text_modified.connect(self._on_text_modified)
+        buff.lines_added_or_removed.connect(self._on_lines_added_or_removed)
+
+    @classmethod
+    def for_buffer(cls, buff, name):
+        by_name = cls._instances.setdefault(buff, {})
+        pending = by_name.get(name)
+        if pending is None:
+            pending = by_name[name] = cls(buff)
+        return pending
+
+    @classmethod
+    def for_all_names(cls, buff):
+        return cls._instances.get(buff, {}).values()
+
+    def add(self, y):
+        i = bisect.bisect_left(self.lines, y)
+        if i == len(self.lines) or self.lines[i] != y:
+            self.lines.insert(i, y)
+
+    def discard(self, y):
+        i = bisect.bisect_left(self.lines, y)
+        if i < len(self.lines) and self.lines[i] == y:
+            del self.lines[i]
+            return True
+        return False
+
+    def next_line(self, priority):
+        '''
+        Return the next line to highlight, preferring those in the range
+        `priority`.
+        '''
+        if priority is not None:
+            start, stop = priority
+            i = bisect.bisect_left(self.lines, start)
+            if i < len(self.lines) and self.lines[i] < stop:
+                return self.lines[i]
+        return self.lines[0]
+
+    def checkpoint(self, y, state, token_stack):
+        if y % self.checkpoint_interval:
+            return
+
+        self.checkpoints[y] = state, tuple(token_stack)
+        if len(self.checkpoints) > self.MaxCheckpoints:
+            self.checkpoint_interval *= 2
+            self.checkpoints = {k: v for (k, v) in self.checkpoints.items()
+                                if k % self.checkpoint_interval == 0}
+
+    def checkpoint_before(self, y):
+        '''
+        Return ``(line, state, token stack)`` for the last checkpoint at or
+        before line `y`, or None.
+        '''
+        interval = self.checkpoint_interval
+        k = y - y % interval
+        while k >= 0:
+            checkpoint = self.checkpoints.get(k)
+            if checkpoint is not None:
+                state, token_stack = checkpoint
+                return k, state, list(token_stack)
+            k -= interval
+        return None
+
+    def _on_text_modified(self, mod):
+        y = mod.pos[0]
+        removed = mod.remove.count('\n')
+        delta = mod.insert.count('\n') - removed
+
+        if self.cold_open is not None:
+            self.cold_open.modified(y, removed, delta)
+
+        if delta:
+            # Lines after the modification move; lines that were removed
+            # collapse onto the modified line.
+            self.lines = sorted({k if k <= y else max(y, k + delta)
+                                 for k in self.lines})
+        self.add(y)
+
+    def _on_lines_added_or_removed(self, index, count):
+        # Needed when all of the lines are replaced at once, which doesn't
+        # cause text_modified to be emitted.
+        self.add(index)
+        if index == 0:
+            self.checkpoints.clear()
+            self.rehighlight = None
+            if self.cold_open is not None:
+                self.cold_open.cancel()
+
+
 class SyntaxHighlighter(object):
 
+    # the longest time, in milliseconds, that one call to highlight_buffer()
+    # may take
+    TimeLimit = 100
+
+    # When at least this many lines have yet to be highlighted, highlight
+    # them in worker processes in chunks of ParallelChunkLines lines. (See
+    # keypad.core.syntaxlib.parallel.)
+    ParallelLineThreshold = 50000
+    ParallelChunkLines = 5000
+
     def __init__(self, name, lexer, base_attrs, *, lexcat_override=None):
         if isinstance(lexer, AbstractTokenizer):
             self._tokenizer = lexer
@@ -18,82 +152,281 @@ class SyntaxHighlighter(object):
         self._base_attrs = base_attrs
         self._lexcat_override = lexcat_override
 
+    @staticmethod
+    def prioritize_lines(buff, start, stop):
+        '''
+        Make subsequent passes over the buffer highlight the modified lines
+        in ``range(start, stop)``, usually the visible ones, before any
+        others.
+        '''
+        _PendingLines.priorities[buff] = start, stop
+
+    @staticmethod
+    def first_pending_line(buff):
+        '''
+        Return the index of the first line of the buffer that has yet to be
+        highlighted by some highlighter, or None if all are up to date.
+        '''
+        count = len(buff.lines)
+        lines = [pending.lines[0] for pending in _PendingLines.for_all_names(buff)
+                 if pending.lines and pending.lines[0] < count]
+        lines += [pending.rehighlight[0] for pending in _PendingLines.for_all_names(buff)
+                  if pending.rehighlight is not None]
+        return min(lines, default=None)
+
+    def _resume_point(self, lines, y, pending):
+        '''
+        Find the line at or before `y` from which highlighting can be resumed,
+        returning the line index and the tokenizer state and token stack at
+        its start.
+        '''
+        checkpoints = pending.checkpoints
+        while y > 0:
+            checkpoint = checkpoints.get(y)
+            if checkpoint is not None:
+                state, token_stack = checkpoint
+                return y, state, list(token_stack)
+            caches = lines[y - 1].caches
+            state = caches.get(self._end_state_key)
+            if state is not None:
+                return y, state, list(caches[self._token_stack_key])
+            y -= 1
 
-    def highlight_buffer(self, buff):
-        lexcat_override = self._lexcat_override
         self._tokenizer.reset()
-        state = self._tokenizer.save()
-        token_stack = []
+        return 0, self._tokenizer.save(), []
+
+    def highlight_buffer(self, buff, time_limit_ms=None):
+        '''
+        Highlight the lines of the buffer that have changed since the last
+        pass.
+
+        Highlighting starts at the first line modified since then (or at the
+        first one in the range given to `prioritize_lines`), and skips to the
+        next modified line as soon as it reaches a line whose cached start
+        state is unchanged, since the highlighting from there on is still
+        valid. If `time_limit_ms` (by default, `TimeLimit`) is exceeded, the
+        next call resumes where this one stopped. (See `first_pending_line`.)
+
+        If many lines have yet to be highlighted, most of them are highlighted
+        speculatively in worker processes, and the results are applied by
+        later passes as they arrive. (See `ParallelLineThreshold`.)
+
+        Lines in the range given to `prioritize_lines` that were highlighted
+        but have since been discarded from memory (in a read-only buffer) are
+        highlighted again from the nearest checkpoint before them.
+        '''
+        lines = buff.lines
+        pending = _PendingLines.for_buffer(buff, self._name)
+        priority = _PendingLines.priorities.get(buff)
+        if time_limit_ms is None:
+            time_limit_ms = self.TimeLimit
+        deadline = time.time() + time_limit_ms / 1000.0
+
+        if buff.read_only:
+            if not self._highlight_discarded(lines, pending, priority, deadline):
+                return
+
+        if pending.cold_open is None and not buff.read_only:
+            self._start_cold_open(buff, pending)
+        if pending.cold_open is not None:
+            pending.cold_open.apply(lines, pending, deadline)
+            if pending.cold_open.done:
+                pending.cold_open = None
+
+        read_only = buff.read_only
+        while pending.lines:
+            if pending.lines[-1] >= len(lines):
+                del pending.lines[bisect.bisect_left(pending.lines, len(lines)):]
+                continue
+
+            y, state, token_stack = self._resume_point(lines, pending.next_line(priority),
+                                                       pending)
+
+            while y < len(lines):
+                line = lines[y]
+
+                # States are interned, so they can usually be compared by
+                # identity. Equal states stop being the same object when the
+                # table of interned states is cleared, so fall back to
+                # equality rather than highlighting the rest of the buffer.
+                modified = pending.discard(y)
+                if not modified:
+                    cached = line.caches.get(self._start_state_key)
+                    if cached is state or (cached is not None and cached == state):
+                        break
+
+                if read_only:
+                    pending.checkpoint(y, state, token_stack)
+                state, token_stack = self._highlight_line(line, state, token_stack)
+                y += 1
+
+                if time.time() >= deadline:
+                    if y < len(lines):
+                        pending.add(y)
+                    return
+
+    def _highlight_discarded(self, lines, pending, priority, deadline):
+        '''
+        Highlight the lines in the range `priority` that were highlighted
+        before but have lost their highlighting since, as the lines of
+        read-only buffers do when they are discarded from memory. Return False
+        if the time limit was reached.
+        '''
+        if priority is None:
+            pending.rehighlight = None
+            return True
+
+        # Lines are only highlighted in order in read-only buffers, so the
+        # ones before the first pending line have been highlighted.
+        start, stop = priority
+        stop = min(stop, len(lines), pending.lines[0] if pending.lines else len(lines))
+
+        for y in range(max(0, start), stop):
+            if self._start_state_key in lines[y].caches:
+                continue
+
+            k, state, token_stack = self._rehighlight_point(lines, y, pending)
+            while k <= y:
+                state, token_stack = self._highlight_line(lines[k], state, token_stack)
+                k += 1
+                if time.time() >= deadline:
+                    pending.rehighlight = (k, state, token_stack) if k < stop else None
+                    return False
+
+        pending.rehighlight = None
+        return True
+
+    def _rehighlight_point(self, lines, y, pending):
+        '''
+        Find the line from which to highlight line `y` again, returning the
+        line index and the tokenizer state and token stack at its start.
+        '''
+        if y > 0:
+            # the previous line is usually still in memory
+            caches = lines[y - 1].caches
+            state = caches.get(self._end_state_key)
+            if state is not None:
+                return y, state, list(caches[self._token_stack_key])
+
+        point = pending.checkpoint_before(y)
+        if point is None:
+            self._tokenizer.reset()
+            point = 0, self._tokenizer.save(), []
+
+        resumed = pending.rehighlight
+        if resumed is not None and point[0] <= resumed[0] <= y:
+            k, state, token_stack = resumed
+            return k, state, list(token_stack)
+        return point
+
+    def _unhighlighted_tail(self, lines, start):
+        '''
+        Find the first line at or after `start` from which no line has been
+        highlighted, assuming that the highlighted lines come first.
+        '''
+        lo, hi = start, len(lines)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if lines[mid].caches.get(self._start_state_key) is None:
+                hi = mid
+            else:
+                lo = mid + 1
+        return lo
+
+    def _start_cold_open(self, buff, pending):
+        '''
+        Start highlighting the lines that won't be reached soon in worker
+        processes, if there are enough of them. The first chunk after the
+        first modified line is left to this process.
+        '''
+        from . import parallel
+
+        lines = buff.lines
+        if not pending.lines or pending.lines[0] >= len(lines):
+            return
+
+        first = max(pending.lines[0] + self.ParallelChunkLines,
+                    self._unhighlighted_tail(lines, pending.lines[0]))
+        if (len(lines) - first < self.ParallelLineThreshold
+                or not parallel.can_highlight_in_parallel()):
+            return
+
+        try:
+            pending.cold_open = parallel.ColdOpen(self, buff, first,
+                                                  self.ParallelChunkLines)
+        except Exception:
+            logging.exception('Could not start parallel highlighting.')
+            parallel.disable()
+
+    def _highlight_line(self, line, state, token_stack):
+        '''
+        Highlight one line, given the tokenizer state and the token stack at
+        its start. Return the state and token stack at its end.
+        '''
+        lexcat_override = self._lexcat_override
         sentinel = object()
 
-        # TODO: start on modified line
-        for i, line in time_limited(enumerate(buff.lines), ms=100):
-            line_start_state = line.caches.get(self._start_state_key) 
-
-            if line_start_state != state:
-                # reset line attributes
-                line.set_attributes(0, None, **self._base_attrs)
-                self._tokenizer.restore(state)
-
-
-                attr_ranges = []
-
-                # Handle tokens that end on this line
-                for ty, lexer, pos in self._tokenizer.tokenize(line, 0, len(line)):
-                    if ty == TokenizerEvent.token_start:
-                        token_stack.append((lexer, pos))
-                    else:
-                        start_lexer = None
-                        # Find the token to pop by going through the token
-                        # stack until a match is found.
-                        for i, (start_lexer, start) in enumerate(reversed(token_stack)):
-                            if start_lexer is lexer:
-                                attr_ranges.append((start, pos, lexer.attrs))
-                                del token_stack[-(i+1)]
-                                break
-                        else:
-                            logging.warning('Expected %r, which was not in the token stack.', lexer)
-
-                # Handle tokens that go past the end of the line
-                next_line_token_stack = []
-
-                for lexer, start in token_stack:
-                    line.set_attributes(start, None, **lexer.attrs)
-                    next_line_token_stack.append((lexer, 0))
-
-                for start, end, attrs in reversed(attr_ranges):
-                    line.set_attributes(start, end, **attrs)
-
-                # Apply overriden lexcats.
-                if lexcat_override:
-                    overrides = []
-                    i = 0
-                    start = None
-                    value = None
-
-                    for chunk, deltas in line.iterchunks():
-                        lc = deltas.get(lexcat_override, sentinel)
-                        if lc is not sentinel:
-                            if start is not None:
-                                overrides.append((start, i, value))
-                                start = None
-                            if lc is not None:
-                                start = i
-                                value = lc
-                        i += len(chunk)
-
-                    for start, end, value in overrides:
-                        line.set_attributes(start, end, lexcat=value)
-
-                token_stack = next_line_token_stack
-
-                line.caches[self._token_stack_key] = tuple(token_stack)
-                line.caches[self._start_state_key] = state
-                state = self._tokenizer.save()
-                line.caches[self._end_state_key] = state
+        # reset line attributes
+        line.set_attributes(0, None, **self._base_attrs)
+        self._tokenizer.restore(state)
+
+        attr_ranges = []
+
+        # Handle tokens that end on this line
+        for ty, lexer, pos in self._tokenizer.tokenize(line, 0, len(line)):
+            if ty == TokenizerEvent.token_start:
+                token_stack.append((lexer, pos))
             else:
-                state = line.caches[self._end_state_key]
-                token_stack = list(line.caches[self._token_stack_key])
+                start_lexer = None
+                # Find the token to pop by going through the token
+                # stack until a match is found.
+                for i, (start_lexer, start) in enumerate(reversed(token_stack)):
+                    if start_lexer is lexer:
+                        attr_ranges.append((start, pos, lexer.attrs))
+                        del token_stack[-(i+1)]
+                        break
+                else:
+                    logging.warning('Expected %r, which was not in the token stack.', lexer)
+
+        # Handle tokens that go past the end of the line
+        next_line_token_stack = []
+
+        for lexer, start in token_stack:
+            line.set_attributes(start, None, **lexer.attrs)
+            next_line_token_stack.append((lexer, 0))
+
+        for start, end, attrs in reversed(attr_ranges):
+            line.set_attributes(start, end, **attrs)
+
+        # Apply overriden lexcats.
+        if lexcat_override:
+            overrides = []
+            i = 0
+            start = None
+            value = None
+
+            for chunk, deltas in line.iterchunks():
+                lc = deltas.get(lexcat_override, sentinel)
+                if lc is not sentinel:
+                    if start is not None:
+                        overrides.append((start, i, value))
+                        start = None
+                    if lc is not None:
+                        start = i
+                        value = lc
+                i += len(chunk)
+
+            for start, end, value in overrides:
+                line.set_attributes(start, end, lexcat=value)
+
+        token_stack = next_line_token_stack
+
+        line.caches[self._token_stack_key] = tuple(token_stack)
+        line.caches[self._start_state_key] = state
+        state = self._tokenizer.save()
+        line.caches[self._end_state_key] = state
+
+        return state, list(token_stack)
 
 
 
@@ -148,7 +481,7 @@ def kaleidoscope_lexer():
 
 #@autoconnect(BufferController.buffer_needs_highlight,
 #             lambda tags: tags.get('syntax') == 'kal')
-def kaleidoscope_syntax(bufctl):
+def kaleidoscope_syntax(bufctl, time_limit_ms=None):
     hl = SyntaxHighlighter('keypad.plugins.semantics.syntax.kal', kaleidoscope_lexer(), dict(lexcat=None))
-    hl.highlight_buffer(bufctl.buffer)
+    hl.highlight_buffer(bufctl.buffer, time_limit_ms)
 
@@ -45,6 +45,10 @@ import heapq
 
 class Lexer(metaclass=abc.ABCMeta):
     atomic = False
+
+    # the _Scanner for this lexer, built by the tokenizer when needed
+    _scanner = None
+
     def __init__(self, attrs=None):
         self.attrs = attrs or {}
         self.contains = ()
@@ -67,6 +71,12 @@ class Lexer(metaclass=abc.ABCMeta):
     def __repr__(self):
         return 'Lexer({!r})'.format(self.attrs)
 
+    def __getstate__(self):
+        # The scanner is only a cache, and is rebuilt on demand.
+        state = self.__dict__.copy()
+        state.pop('_scanner', None)
+        return state
+
     def enter(self):
         '''
         If this lexer matches, put the resulting lexer on the stack. By default
@@ -125,6 +135,140 @@ class RegionLexer(Lexer):
         return self.exit.guard_match(string, start, stop)
 
 
+def _guard_regex(lexer):
+    '''
+    Return the regular expression used by the lexer's guard, or None if its
+    guard isn't a plain regular expression.
+    '''
+    guard_match = type(lexer).guard_match
+    if guard_match is RegionLexer.guard_match:
+        return _guard_regex(lexer.guard)
+    elif guard_match is RegexLexer.guard_match:
+        return lexer.regex
+    else:
+        return None
+
+_ScopedFlags = (re.IGNORECASE, 'i'), (re.MULTILINE, 'm'), (re.DOTALL, 's'), (re.ASCII, 'a')
+
+def _alternative(name, rgx):
+    '''
+    Return the regular expression as a named group that can be combined
+    with others, or None if that isn't possible.
+    '''
+    pattern = rgx.pattern
+    if (not isinstance(pattern, str)
+            or rgx.groupindex                       # may use a 'body' group
+            or rgx.flags & re.VERBOSE
+            or re.search(r'\\[1-9]|\(\?P=|\(\?\(', pattern)): # backreferences
+        return None
+
+    flags = ''.join(letter for flag, letter in _ScopedFlags if rgx.flags & flag)
+    if flags:
+        pattern = '(?' + flags + ':' + pattern + ')'
+
+    alternative = '(?P<' + name + '>' + pattern + ')'
+    try:
+        re.compile(alternative)
+    except re.error:
+        return None
+    return alternative
+
+
+class _Scanner(object):
+    '''
+    Finds the first exit or contained token of a lexer.
+
+    The guards of the contained lexers that are plain regular expressions,
+    along with the exit if it is one, are combined into one alternation, so
+    that they can be found with a single search instead of one search per
+    lexer. Any other lexers are searched individually.
+    '''
+
+    def __init__(self, lexer):
+        self.contains = lexer.contains
+        self.exit = getattr(lexer, 'exit', None)
+
+        alternatives = []
+        self._groups = {}
+        self._others = []
+
+        # The original order decides ties: the last contained lexer wins,
+        # and the exit loses to all of them. Alternations prefer the first
+        # alternative, so they are combined in reverse.
+        for index, contained in reversed(list(enumerate(self.contains))):
+            rgx = _guard_regex(contained)
+            name = '_{}'.format(index)
+            alternative = None if rgx is None else _alternative(name, rgx)
+            if alternative is None:
+                self._others.append((index, contained.guard_match, contained))
+            else:
+                alternatives.append(alternative)
+                self._groups[name] = index, contained
+
+        exit_rgx = None
+        if type(lexer).exit_match is RegionLexer.exit_match:
+            exit_rgx = _guard_regex(lexer.exit)
+        exit_alternative = None if exit_rgx is None else _alternative('exit', exit_rgx)
+        if exit_alternative is None:
+            self._others.append((-1, lexer.exit_match, None))
+        else:
+            alternatives.append(exit_alternative)
+            self._groups['exit'] = -1, None
+
+        self._regex = re.compile('|'.join(alternatives)) if alternatives else None
+
+    def is_current(self, lexer):
+        return (self.contains is lexer.contains and
+                self.exit is getattr(lexer, 'exit', None))
+
+    def first_match(self, string, start, stop):
+        '''
+        Return a tuple ``(start, stop, lexer)`` for the first token, where
+        `lexer` is None for the exit, or None if there are no more tokens.
+        '''
+        best = None
+        if self._regex is not None:
+            match = self._regex.search(string.text, start, stop)
+            if match is not None:
+                index, lexer = self._groups[match.lastgroup]
+                best = match.start(), -index, match.end(), lexer
+
+        for index, guard_match, lexer in self._others:
+            result = guard_match(string, start, stop)
+            if result:
+                candidate = result[0], -index, result[1], lexer
+                if best is None or candidate[:2] < best[:2]:
+                    best = candidate
+
+        if best is None:
+            return None
+
+        first_start, _, first_stop, lexer = best
+        return first_start, first_stop, lexer
+
+
+# The interned tokenizer states. The table is cleared when it grows too large,
+# since some lexers (e.g., for raw strings) create new lexers as they go.
+_states = {}
+_MaxStates = 4096
+
+def intern_state(state):
+    '''
+    Return the canonical instance of the given tokenizer state, which must
+    be hashable. Equal states returned by this function are usually the same
+    object, so that they can be compared by identity first; they may not be
+    after the table is cleared, so a failed identity check must be followed
+    by an equality check.
+    '''
+    try:
+        return _states[state]
+    except KeyError:
+        if len(_states) >= _MaxStates:
+            _states.clear()
+        _states[state] = state
+        return state
+
+
 class TokenizerEvent(enum.Enum):
     token_start = 0
     token_end = 1
@@ -136,7 +280,10 @@ class AbstractTokenizer(metaclass=abc.ABCMeta):
 
     @abc.abstractmethod
     def save(self):
-        pass
+        '''
+        Return the current state as an immutable, interned object. (See
+        `intern_state`.)
+        '''
 
     @abc.abstractmethod
     def restore(self, state):
@@ -163,32 +310,27 @@ class Tokenizer(AbstractTokenizer):
         self.lexer_stack = [self.start_lexer]
 
     def save(self):
-        return list(self.lexer_stack)
+        return intern_state(tuple(self.lexer_stack))
 
     def restore(self, stack):
         self.lexer_stack = list(stack)
 
     def tokenize(self, string, start, stop):
-        pop = object()
-
         lexer_stack = self.lexer_stack
 
         while lexer_stack and start <= stop:
-            # find the expected end of the lexer (if it isn't occluded by a contained expression)
-            exit_match = lexer_stack[-1].exit_match(string, start, stop)
-            if exit_match:
-                exit_start, exit_stop = exit_match
-                first_guard = exit_start, exit_stop, pop
-            else:
-                first_guard = None
+            lexer = lexer_stack[-1]
 
-            # find the first contained expression
-            for lexer in lexer_stack[-1].contains:
-                lresult = lexer.guard_match(string, start, stop)
-                # this contained expression starts before all others seen before
-                if lresult and (not first_guard or first_guard[0] >= lresult[0]):
-                    lstart, lstop = lresult
-                    first_guard = lstart, lstop, lexer
+            if lexer.contains:
+                scanner = lexer._scanner
+                if scanner is None or not scanner.is_current(lexer):
+                    scanner = lexer._scanner = _Scanner(lexer)
+                first_guard = scanner.first_match(string, start, stop)
+            else:
+                # only the exit can match
+                first_guard = lexer.exit_match(string, start, stop)
+                if first_guard:
+                    first_guard = first_guard[0], first_guard[1], None
 
             # no more tokens begin or end this line
             if not first_guard:
@@ -196,8 +338,8 @@ class Tokenizer(AbstractTokenizer):
             else:
                 fg_start, fg_stop, fg_lexer = first_guard
 
-                # check for the sentinel `pop` indicating that the lexer is done
-                if fg_lexer is pop:
+                # None indicates that the lexer is done
+                if fg_lexer is None:
                     yield TokenizerEvent.token_end, lexer_stack[-1], fg_stop
                     lexer_stack.pop()
                 else:
@@ -215,7 +357,7 @@ class UnionTokenizer(AbstractTokenizer):
             t.reset()
 
     def save(self):
-        return [t.save() for t in self._tokenizers]
+        return intern_state(tuple(t.save() for t in self._tokenizers))
 
     def restore(self, state):
         assert len(state) == len(self._tokenizers)
@@ -123,6 +123,26 @@ class GeneralSettings(Settings):
 
     brace_match_timeout_ms = Field(int, 50)
 
+    background_load_threshold = Field(int, 8 << 20,
+                                      docs='Files larger than this number of bytes are loaded '
+                                           'in the background. The beginning of the file is '
+                                           'shown immediately, and the rest is appended while '
+                                           'the editor is idle.')
+
+    large_file_threshold = Field(int, 256 << 20,
+                                 docs='Files larger than this number of bytes are opened as '
+                                      'read-only, memory-mapped views. Only the lines that are '
+                                      'displayed or highlighted are kept in memory.')
+
+    large_file_line_cache = Field(int, 10000,
+                                  docs='The number of lines of a large file to keep in memory.')
+
+    background_highlight_slice_ms = Field(int, 20,
+                                          docs='Syntax highlighting that doesn\'t finish while '
+                                               'the view is being updated continues while the '
+                                               'editor is idle, in slices of at most this many '
+                                               'milliseconds.')
+
 class CallTipSettings(Settings):
     _ns_ = 'call_tip'
 
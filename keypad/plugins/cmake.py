@@ -6,7 +6,7 @@ from keypad.api import *
 from keypad.core.attributed_string import AttributedString
 from keypad.abstract.code import IndentRetainingCodeModel, Indent, AbstractCompletionResults
 from keypad.core.executors import future_wrap
-from keypad.core.fuzzy import FuzzyMatcher
+from keypad.core.fuzzy import FuzzySearch
 
 from keypad.core.syntaxlib import (regex, region, keyword,
                                  lazy, SyntaxHighlighter)
@@ -238,14 +238,14 @@ class CMakeCodeModel(IndentRetainingCodeModel):
 
         return CMakeCompletionResults(pos, compls + filename_compls + self.__builtins)
 
-    def highlight(self):
+    def highlight(self, time_limit_ms=None):
         highlighter = SyntaxHighlighter(
             'keypad.plugins.cmake',
             lexer(),
             dict(lexcat=None)
         )
 
-        highlighter.highlight_buffer(self.buffer)
+        highlighter.highlight_buffer(self.buffer, time_limit_ms)
 
 class CMakeCompletionResults(AbstractCompletionResults):
 
@@ -253,6 +253,7 @@ class CMakeCompletionResults(AbstractCompletionResults):
         super().__init__(token_start)
 
         self.results = results
+        self._search = FuzzySearch(results, lambda item: item[0].text)
         self.filter()        
 
     @future_wrap
@@ -285,8 +286,7 @@ class CMakeCompletionResults(AbstractCompletionResults):
         Filter the completion results using the given text.
         '''
 
-        self._filtered = FuzzyMatcher(text).filter(self.results, lambda item: item[0].text)
-        self._filtered.sort(lambda item: len(item[0].text))
+        self._filtered = self._search.filter(text)
 
 
     def dispose(self):
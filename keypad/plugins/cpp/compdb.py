@@ -0,0 +1,230 @@
+'''
+Per-file compiler flags from ``compile_commands.json``.
+
+A compilation database lists the command used to compile each source file
+of a project. These files are often tens of MB, so a `CompilationDatabase`
+isn't read until the first lookup, and the flags for each file are only
+worked out when they are asked for.
+'''
+
+import json
+import logging
+import os
+import shlex
+import threading
+
+from keypad.util.path import search_upwards
+
+HeaderSuffixes = frozenset('.h .hh .H .hpp .h++ .hxx .inl'.split())
+
+# Options whose argument is a path, which is made absolute, since the
+# commands are run from the directory of each entry.
+_path_options = ('-I', '-isystem', '-iquote', '-idirafter', '-include',
+                 '-imacros', '-isysroot', '-F', '--sysroot')
+
+# Options that only concern the output of the compiler, with the number of
+# arguments that follow them.
+_output_options = {'-c': 0, '-o': 1, '-MD': 0, '-MMD': 0, '-M': 0, '-MM': 0,
+                   '-MF': 1, '-MT': 1, '-MQ': 1, '-MP': 0}
+
+
+def _absolute(directory, path):
+    return os.path.normpath(os.path.join(directory, path))
+
+
+def entry_flags(entry):
+    '''
+    Return the flags for libclang from an entry of a compilation database:
+    its arguments without the compiler, the file being compiled and the
+    options that only concern the output.
+    '''
+    directory = entry.get('directory', '')
+    if 'arguments' in entry:
+        args = list(entry['arguments'])
+    else:
+        args = shlex.split(entry.get('command', ''))
+
+    source = _absolute(directory, entry['file'])
+    flags = []
+    i = 1
+    while i < len(args):
+        arg = args[i]
+        i += 1
+        if arg in _output_options:
+            i += _output_options[arg]
+        elif arg.startswith('-o') or _absolute(directory, arg) == source:
+            pass
+        elif arg in _path_options and i < len(args):
+            flags += [arg, _absolute(directory, args[i])]
+            i += 1
+        else:
+            flags.append(_absolute_option(directory, arg))
+    return tuple(flags)
+
+
+def _absolute_option(directory, arg):
+    for option in _path_options:
+        if option.startswith('--'):
+            option += '='
+        if arg.startswith(option) and len(arg) > len(option):
+            return option + _absolute(directory, arg[len(option):])
+    return arg
+
+
+def _header_flags(flags, source):
+    '''
+    Return the flags to parse a header with, given those of a source file.
+    '''
+    language = 'c-header' if os.path.splitext(source)[1] == '.c' else 'c++-header'
+    return flags + ('-x', language)
+
+
+class CompilationDatabase(object):
+    '''
+    The ``compile_commands.json`` at the given path.
+    '''
+
+    def __init__(self, path):
+        self.path = str(path)
+        self._lock = threading.Lock()
+        self._entries = None # absolute path -> entry
+        self._mtime = None
+        self._flags = {} # absolute path -> flags
+        self._by_directory = None # directory -> sorted absolute paths
+
+    def _load(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except OSError:
+            mtime = None
+
+        if self._entries is not None and mtime == self._mtime:
+            return
+
+        entries = {}
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                commands = json.load(f)
+        except (OSError, ValueError):
+            logging.exception('Failed to read %s', self.path)
+            commands = []
+
+        for entry in commands:
+            try:
+                entries[_absolute(entry.get('directory', ''), entry['file'])] = entry
+            except (KeyError, TypeError, AttributeError):
+                continue
+
+        self._entries = entries
+        self._mtime = mtime
+        self._flags = {}
+        self._by_directory = None
+
+    def flags_for(self, filename):
+        '''
+        Return the flags for the file, or None if neither it nor any file
+        near it is in the database.
+
+        A file that isn't in the database (usually a header) gets the flags
+        of the nearest source file: one with the same name in the same
+        directory, or else the first in the directory whose path has the
+        most in common with the file's.
+        '''
+        filename = os.path.normpath(os.path.abspath(str(filename)))
+        with self._lock:
+            self._load()
+            try:
+                return self._flags[filename]
+            except KeyError:
+                pass
+
+            entry = self._entries.get(filename)
+            if entry is not None:
+                flags = entry_flags(entry)
+            else:
+                source = self._nearest_source(filename)
+                if source is None:
+                    flags = None
+                else:
+                    flags = entry_flags(self._entries[source])
+                    if os.path.splitext(filename)[1] in HeaderSuffixes:
+                        flags = _header_flags(flags, source)
+
+            self._flags[filename] = flags
+            return flags
+
+    def sources_near(self, filename):
+        '''
+        Return the source files in the database other than the file, those
+        in its directory first and then those in the directories whose paths
+        have the most in common with its directory.
+        '''
+        filename = os.path.normpath(os.path.abspath(str(filename)))
+        directory = os.path.dirname(filename)
+        with self._lock:
+            self._load()
+            by_directory = self._directories()
+            directories = sorted(by_directory,
+                                 key=lambda d: (d != directory,
+                                                -len(os.path.commonprefix([d, directory])),
+                                                d))
+            return [source for d in directories for source in by_directory[d]
+                    if source != filename]
+
+    def _directories(self):
+        if self._by_directory is None:
+            by_directory = {}
+            for source in self._entries:
+                by_directory.setdefault(os.path.dirname(source), []).append(source)
+            for sources in by_directory.values():
+                sources.sort()
+            self._by_directory = by_directory
+        return self._by_directory
+
+    def _nearest_source(self, filename):
+        by_directory = self._directories()
+        directory, name = os.path.split(filename)
+        stem = os.path.splitext(name)[0]
+
+        sources = by_directory.get(directory)
+        if sources is None:
+            if not by_directory:
+                return None
+            nearest = max(sorted(by_directory),
+                          key=lambda d: len(os.path.commonprefix([d, directory])))
+            sources = by_directory[nearest]
+
+        for source in sources:
+            if os.path.splitext(os.path.basename(source))[0] == stem:
+                return source
+        return sources[0]
+
+
+_databases = {} # path -> CompilationDatabase
+_database_paths = {} # directory -> path
+_databases_lock = threading.Lock()
+
+def find_compilation_database(filename):
+    '''
+    Return the `CompilationDatabase` for the ``compile_commands.json`` in the
+    file's directory or the nearest directory above it, or None if there
+    is none.
+
+    Only databases that were found are remembered, so one that is generated
+    after a file was opened is picked up the next time it's looked for.
+    '''
+    directory = os.path.dirname(os.path.abspath(str(filename)))
+    with _databases_lock:
+        path = _database_paths.get(directory)
+        if path is None or not os.path.exists(path):
+            found = next(search_upwards(directory, 'compile_commands.json'), None)
+            if found is None:
+                _database_paths.pop(directory, None)
+                return None
+            path = _database_paths[directory] = str(found)
+
+        try:
+            return _databases[path]
+        except KeyError:
+            db = _databases[path] = CompilationDatabase(path)
+            return db
@@ -2,6 +2,9 @@
 
 from keypad.core.nconfig import Settings, Field
 from pathlib import Path
+import os.path
+
+from .compdb import find_compilation_database
 
 class CXXConfig(Settings):
     _ns_ = 'cxx'
@@ -12,5 +15,42 @@ class CXXConfig(Settings):
     
     clang_flags        = Field(tuple, [], safe=True)
     clang_header_flags = Field(tuple, ['-x', 'c++-header'], safe=True)
-    
-    
\ No newline at end of file
+
+    completion_rows    = Field(int, 200, safe=True,
+                               docs='The most completions sent from the worker process at a time. '
+                                    'The rest are sent as the text typed narrows them down.')
+
+    max_translation_units   = Field(int, 8, safe=True,
+                                    docs='The most parsed files each worker process keeps in memory.')
+    translation_unit_memory = Field(int, 2048, safe=True,
+                                    docs='The memory (in MB) that the parsed files of a worker process '
+                                         'may use together before it drops the least recently used.')
+
+    compile_commands   = Field(bool, True, safe=True,
+                               docs='Whether to take the flags for each file from the nearest '
+                                    'compile_commands.json, if there is one.')
+
+    parse_ahead = Field(bool, True, safe=True,
+                        docs='Whether to parse files in the background when they are opened, '
+                             'and other files in the same directory or the same '
+                             'compile_commands.json when the worker is idle.')
+
+    preamble_cache      = Field(Path, os.path.expanduser('~/.keypad/cache/cxx-preambles'),
+                                docs='The directory where the precompiled #include lines of '
+                                     'files are kept between sessions, or None not to keep them.')
+    preamble_cache_size = Field(int, 1024, safe=True,
+                                docs='The size (in MB) of the preamble cache.')
+
+    def flags_for(self, filename, header=False):
+        '''
+        Return the flags to parse the file with: those from the compilation
+        database for it, or else `clang_header_flags` for headers and
+        `clang_flags` for other files.
+        '''
+        if self.compile_commands:
+            db = find_compilation_database(filename)
+            if db is not None:
+                flags = db.flags_for(filename)
+                if flags is not None:
+                    return flags
+        return self.clang_header_flags if header else self.clang_flags
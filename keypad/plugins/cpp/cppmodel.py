@@ -1,13 +1,19 @@
 
+import os
+import pathlib
+import logging
 import string
-from concurrent.futures import Future
+from concurrent.futures import Future, CancelledError
 
 from keypad.api import interactive
 from keypad.abstract.code import IndentRetainingCodeModel, AbstractCompletionResults
 from keypad.core.syntaxlib import SyntaxHighlighter
-from keypad.core.processmgr.client import AsyncServerProxy, RemoteError
-from keypad.core.fuzzy import FuzzyMatcher, Filter
+from keypad.core.processmgr.client import RemoteError, PrefetchPriority, IdlePriority
+from keypad.core.processmgr.pool import worker_pool, settings_key, settings_snapshot
+from keypad.core.processmgr.mirror import BufferMirror, ForgetMirror, submit_mirrored
+from keypad.core.fuzzy import FuzzyMatcher
 from keypad.core.conftree import ConfTree
+from keypad.core.notification_queue import in_main_thread
 from keypad.core.executors import SynchronousExecutor
 from keypad.buffers import Cursor
 
@@ -17,17 +23,31 @@ from .modelworker import (InitWorkerTask,
                           FindRelatedTask, 
                           GetDocsTask, 
                           GetDiagnosticsTask,
-                          GetCallTipTask)
+                          GetCallTipTask,
+                          PrefetchTask,
+                          FilterCompletionsTask)
+from .compdb import find_compilation_database
 from .config import CXXConfig        
+
+SourceSuffixes = frozenset('.c .cc .C .cpp .c++ .cxx'.split())
+
 class CXXCompletionResults(AbstractCompletionResults):
-    def __init__(self, token_start, runner, results):
+    def __init__(self, token_start, runner, page, limit=None, recomplete=None):
         '''
         token_start - the (line, col) position at which the token being completed starts
+        page        - a CompletionPage for the text typed so far
+        recomplete  - a function of a prefix that requests a new CompletionPage,
+                      used if the worker no longer keeps the results
         '''
         super().__init__(token_start)
         self._runner = runner
-        self._results = results        
-        self.filter()
+        self._recomplete = recomplete
+        self._limit = limit
+        self._page = page
+        self._pattern = page.prefix
+        self._rows = page.rows
+        self._indices = page.indices
+        self._pending = None
         
     def doc_async(self, index):
         '''
@@ -35,7 +55,7 @@ class CXXCompletionResults(AbstractCompletionResults):
         AttributedString.        
         '''
         
-        return self._runner.submit(GetDocsTask(self._filt.indices[index]))
+        return self._runner.submit(GetDocsTask(self._indices[index], self._page.generation))
 
     @property
     def rows(self):
@@ -44,26 +64,72 @@ class CXXCompletionResults(AbstractCompletionResults):
         each column for each row in the completion results.
         '''
         
-        return self._filt.rows
+        return self._rows
         
     def text(self, index):
         '''
         Return the text that should be inserted for the given completion.
         '''
-        return self._filt.rows[index][0].text
+        return self._rows[index][0].text
 
     def filter(self, text=''):
         '''
         Filter the completion results using the given text.
+
+        The worker keeps all of the results and sends only the best of them,
+        so unless those include every match, the rows that have been sent are
+        filtered at once and the worker is asked for the rest, which replace
+        them when they arrive (emitting `rows_changed`).
         '''
-        
-        fm = FuzzyMatcher(text)
-        self._filt = fm.filter(self._results, lambda item: item[0].text)
-        # sort exact matches first
-        self._filt.sort(lambda item: 0 if item[0].text.startswith(text) else 1)
+        if text == self._pattern:
+            return
+        self._pattern = text
+
+        page = self._page
+        filt = FuzzyMatcher(text).filter(page.rows, lambda row: row[0].text)
+        self._rows = filt.rows
+        self._indices = [page.indices[i] for i in filt.indices]
+
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
+
+        if not (page.complete and text.startswith(page.prefix)):
+            self._pending = self._runner.submit(
+                FilterCompletionsTask(page.generation, text, self._limit),
+                key='completion-filter'
+            )
+            self._pending.add_done_callback(in_main_thread(self._filtered))
+
+    def _filtered(self, future):
+        try:
+            page = future.result()
+        except CancelledError:
+            return
+        except Exception:
+            logging.exception('filtering completions')
+            return
+
+        if page is None:
+            # The worker dropped the results (e.g., with the translation
+            # unit), so complete again.
+            if self._recomplete is not None:
+                self._pending = self._recomplete(self._pattern)
+                self._pending.add_done_callback(in_main_thread(self._filtered))
+            return
+
+        if page.prefix != self._pattern:
+            return
+
+        self._page = page
+        self._rows = page.rows
+        self._indices = page.indices
+        self.rows_changed()
         
     def dispose(self):
-        pass
+        if self._pending is not None:
+            self._pending.cancel()
+            self._pending = None
         
 
 class CXXCodeModel(IndentRetainingCodeModel):
@@ -72,19 +138,79 @@ class CXXCodeModel(IndentRetainingCodeModel):
     line_comment = '//'
     
     def __init__(self, *args, **kw):
+        self._path = None
+        self._prefetches = []
         super().__init__(*args, **kw)
         self.cxx_config = CXXConfig.from_config(self.conf)
         self.cxx_config.value_changed.connect(self._update_configuration)
+        self._mirror = BufferMirror(self.buffer)
         
         try:
-            self.prox = AsyncServerProxy(InitWorkerTask(self.cxx_config))
-            self.prox.start()
-#             self.prox.submit().result()
+            self.prox = self._lease_worker()
         except RemoteError as exc:
-            self.prox.shutdown()
+            self.prox.release()
             cause = exc.__cause__ or exc
             interactive.run('show_error', cause)
 
+    @property
+    def path(self):
+        return self._path
+
+    @path.setter
+    def path(self, path):
+        changed = path != self._path
+        self._path = path
+        if changed and path is not None and hasattr(self, 'prox'):
+            self._prefetch()
+
+    def _prefetch(self):
+        '''
+        Parse the file in the background, and then the files next to it once
+        the worker is idle. Requests made in the meantime go first.
+        '''
+        for future in self._prefetches:
+            future.cancel()
+        self._prefetches = []
+
+        if not self.cxx_config.parse_ahead:
+            return
+
+        self._update_affinity()
+        path = pathlib.Path(str(self.path))
+        futures = [self.prox.submit(PrefetchTask(path), priority=PrefetchPriority)]
+        for neighbour in self._prefetch_candidates(path):
+            futures.append(self.prox.submit(PrefetchTask(neighbour),
+                                            priority=IdlePriority,
+                                            affinity=str(neighbour)))
+        self._prefetches = futures
+
+    def _prefetch_candidates(self, path):
+        '''
+        Return the source files next to the given file, followed by the
+        nearest other sources in its compilation database, as many as the
+        worker will keep parsed.
+        '''
+        count = max(0, self.cxx_config.max_translation_units - 1)
+        try:
+            names = sorted(entry.name for entry in os.scandir(str(path.parent))
+                           if entry.is_file())
+        except OSError:
+            names = []
+
+        candidates = [path.parent / name for name in names
+                      if name != path.name and os.path.splitext(name)[1] in SourceSuffixes]
+
+        db = find_compilation_database(path) if self.cxx_config.compile_commands else None
+        if db is not None and len(candidates) < count:
+            seen = {os.path.normpath(os.path.abspath(str(c))) for c in candidates}
+            for source in db.sources_near(path):
+                if len(candidates) >= count:
+                    break
+                if source not in seen and os.path.isfile(source):
+                    candidates.append(pathlib.Path(source))
+
+        return candidates[:count]
+
 
     
     def submit_task(self, task, transform=None):
@@ -101,10 +227,40 @@ class CXXCodeModel(IndentRetainingCodeModel):
         pickleable.
         '''
         
+        return self._submit(task, transform)
+
+    def _lease_worker(self):
+        # Files with the same configuration share a pool of workers.
+        config = settings_snapshot(self.cxx_config)
+        pool = worker_pool(('cpp', settings_key(config)), InitWorkerTask(config))
+        return pool.lease()
+
+    def _update_affinity(self):
+        if self.path is not None:
+            # keep the file's translation unit in one worker
+            self.prox.affinity = str(self.path)
+
+    def _submit(self, task, transform=None):
+        self._update_affinity()
         return self.prox.submit(task, transform)
 
+    def _submit_with_text(self, make_task, transform=None, *, key=None):
+        '''
+        Submit ``make_task(unsaved_files)``, sending only the edits to the
+        buffer that the worker hasn't seen.
+        '''
+        self._update_affinity()
+        path = str(self.path)
+        return submit_mirrored(self.prox, self._mirror,
+                               lambda text: make_task([(path, text)]),
+                               transform, key=key)
+
     def _update_configuration(self, k, v):
-        self.submit_task(InitWorkerTask(self.cxx_config))
+        self.prox.release()
+        self.prox = self._lease_worker()
+        self._mirror.reset() # the new worker has no copy of the text
+        if self.path is not None:
+            self._prefetch()
         
 
     def _find_token_start(self, pos):
@@ -127,14 +283,24 @@ class CXXCodeModel(IndentRetainingCodeModel):
         Raise NotImplementedError if not implemented.
         '''
         tstart = self._find_token_start(pos)
-        return self.prox.submit(
-            CompletionTask(
-                self.path,
-                tstart,
-                [(str(self.path), self.buffer.text)]
-            ),
-            transform=lambda r: CXXCompletionResults(tstart, self.prox, r)
-        )
+        prefix = self.buffer.span_text(tstart, end_pos=pos)
+        limit = self.cxx_config.completion_rows
+
+        def complete(prefix, transform=None):
+            return self._submit_with_text(
+                lambda unsaved: CompletionTask(
+                    self.path,
+                    tstart,
+                    unsaved,
+                    prefix=prefix,
+                    limit=limit
+                ),
+                transform=transform,
+                key='completions'
+            )
+
+        return complete(prefix, lambda page: CXXCompletionResults(tstart, self.prox, page,
+                                                                  limit, complete))
     
     def find_related_async(self, pos, types):
         '''
@@ -145,17 +311,17 @@ class CXXCodeModel(IndentRetainingCodeModel):
         :rtype: concurrent.futures.Future of list of RelatedName
         '''
         
-        return self.prox.submit(
-            FindRelatedTask(
+        return self._submit_with_text(
+            lambda unsaved: FindRelatedTask(
                 types,
                 self.path,
                 pos,
-                [(str(self.path), self.buffer.text)]
+                unsaved
             )
         )
 
     
-    def highlight(self):
+    def highlight(self, time_limit_ms=None):
         '''
         Rehighlight the buffer.        
         
@@ -172,7 +338,7 @@ class CXXCodeModel(IndentRetainingCodeModel):
             dict(lexcat=None)
         )
         
-        highlighter.highlight_buffer(self.buffer)
+        highlighter.highlight_buffer(self.buffer, time_limit_ms)
     
     
     @property
@@ -180,11 +346,11 @@ class CXXCodeModel(IndentRetainingCodeModel):
         return True
         
     def diagnostics_async(self):
-        return self.prox.submit(
-            GetDiagnosticsTask(
+        return self._submit_with_text(
+            lambda unsaved: GetDiagnosticsTask(
                 self.path,
                 None,
-                [(str(self.path), self.buffer.text)]
+                unsaved
             )
         )
         
@@ -214,11 +380,11 @@ class CXXCodeModel(IndentRetainingCodeModel):
         start = self._find_token_start(c.pos)
         text = Cursor(self.buffer).move(start).text_to(c)
 
-        return self.prox.submit(GetCallTipTask(
+        return self._submit_with_text(lambda unsaved: GetCallTipTask(
             text,
             self.path,
             start,
-            [(str(self.path), self.buffer.text)]
+            unsaved
         ))
     
     def dispose(self):
@@ -226,5 +392,9 @@ class CXXCodeModel(IndentRetainingCodeModel):
         Release system resources held by the model.
         '''
         
-        self.prox.shutdown()
+        for future in self._prefetches:
+            future.cancel()
+        self.prox.submit(ForgetMirror(self._mirror.doc))
+        self._mirror.dispose()
+        self.prox.release()
         
@@ -3,6 +3,12 @@ from keypad.core import AttributedString
 from keypad.abstract.code import RelatedName, Diagnostic, AbstractCallTip
 from clang import cindex
 from .config import CXXConfig
+from .preamble import PreambleCache, split_preamble
+from keypad.core.processmgr.mirror import resolve_text
+from keypad.core.fuzzy import FuzzySearch
+import collections
+import ctypes
+import itertools
 import textwrap
 import logging
 import os
@@ -87,8 +93,83 @@ def _might_be_header(filename):
     _, ext = os.path.splitext(filename)
     
     return not ext or ext.lower() in (b'.h', b'.hpp', b'.hh')
+
+
+class _ResourceUsageEntry(ctypes.Structure):
+    _fields_ = [('kind', ctypes.c_int), ('amount', ctypes.c_ulong)]
+
+class _ResourceUsage(ctypes.Structure):
+    _fields_ = [('data', ctypes.c_void_p),
+                ('numEntries', ctypes.c_uint),
+                ('entries', ctypes.POINTER(_ResourceUsageEntry))]
+
+_resource_usage_functions = []
+
+def _unit_memory(tu):
+    '''
+    Return the memory used by the translation unit in bytes, as reported by
+    libclang, or None if it isn't known.
+
+    (The memory of the process as a whole is no measure of this, since it
+    rarely shrinks when a unit is dropped.)
+    '''
+    if not _resource_usage_functions:
+        try:
+            get = cindex.conf.lib.clang_getCXTUResourceUsage
+            dispose = cindex.conf.lib.clang_disposeCXTUResourceUsage
+        except AttributeError:
+            _resource_usage_functions.append(None)
+        else:
+            get.argtypes = [cindex.TranslationUnit]
+            get.restype = _ResourceUsage
+            dispose.argtypes = [_ResourceUsage]
+            dispose.restype = None
+            _resource_usage_functions.append((get, dispose))
+
+    functions = _resource_usage_functions[0]
+    if functions is None:
+        return None
+
+    get, dispose = functions
+    usage = get(tu)
+    try:
+        return sum(usage.entries[i].amount for i in range(usage.numEntries))
+    finally:
+        dispose(usage)
     
 
+class CompletionPage(object):
+    '''
+    The best `rows` of the completion results that match `prefix`, with
+    their `indices` in the results and the `total` number of matches.
+    `generation` identifies the results, which are kept in the worker.
+    '''
+
+    def __init__(self, generation, prefix, rows, indices, total):
+        self.generation = generation
+        self.prefix = prefix
+        self.rows = rows
+        self.indices = indices
+        self.total = total
+
+    @property
+    def complete(self):
+        return len(self.rows) == self.total
+
+
+class _KeptCompletions(object):
+    '''
+    The results of a completion request, kept for filtering.
+    '''
+
+    def __init__(self, generation, results, items):
+        self.generation = generation
+        self.results = results
+        # (typed text, kind name) for each result
+        self.items = items
+        self.search = FuzzySearch(items, key=lambda item: item[0])
+
+
 class Engine:
     def __init__(self, config):
         faulthandler.enable()
@@ -96,32 +177,85 @@ class Engine:
         self.config = config
 
         self.index = cindex.Index.create()
-        self._translation_units = {}
 
-    def completions(self, filename, pos, unsaved):
+        self._completion_generations = itertools.count(1)
+        # filename -> _KeptCompletions for the last completion request in
+        # the file, so that requests in other files (and call tips) don't
+        # replace the results that an open list is filtering
+        self._completions = {}
+        # filename -> (TranslationUnit, precompiled preamble or None), least
+        # recently used first
+        self._translation_units = collections.OrderedDict()
+        # filename -> memory used by its translation unit, in bytes
+        self._unit_memory = {}
+
+        if config.preamble_cache is not None:
+            self.preambles = PreambleCache(self.index, config.preamble_cache,
+                                           config.preamble_cache_size)
+        else:
+            self.preambles = None
+
+    def completions(self, filename, pos, unsaved, prefix='', limit=None):
+        '''
+        Return a `CompletionPage` with the best `limit` completions at the
+        position that match the prefix.
+
+        The results are kept (until the next completion request in the same
+        file), so that `filter_completions` can match them against a longer
+        prefix without completing again.
+        '''
+        cr = self.code_complete(filename, pos, unsaved)
+        kept = _KeptCompletions(next(self._completion_generations), cr,
+                                [(self.typed_text(item.string), item.kind.name)
+                                 for item in cr.results])
+        self._completions[filename] = kept
+        return self.filter_completions(kept.generation, prefix, limit)
+
+    def code_complete(self, filename, pos, unsaved):
+        '''
+        Return libclang's completion results at the position, without
+        keeping them.
+        '''
         tu = self.unit(filename, unsaved, reparse=False)
 
         line, col = pos
 
-        cr = tu.codeComplete(
+        return tu.codeComplete(
             str(filename).encode(), 
             line+1, col+1, 
             unsaved_files=self.encode_unsaved(unsaved),
             include_brief_comments=True
         )
-        
-        self.last_completion_results = cr
-        
-        results = []
-        
-        for item in cr.results:
-            results.append((AttributedString(self.typed_text(item.string)), 
-                                             _kind_names.get(item.kind.name, _empty)))
-        
-        return results
+
+    def _kept_completions(self, generation):
+        for kept in self._completions.values():
+            if kept.generation == generation:
+                return kept
+        return None
+
+    def filter_completions(self, generation, prefix, limit=None):
+        '''
+        Return a `CompletionPage` for the completion results of the given
+        generation, or None if they are no longer kept.
+        '''
+        kept = self._kept_completions(generation)
+        if kept is None:
+            return None
+
+        items = kept.items
+        matches = kept.search.ranked(prefix)
+
+        indices = matches if limit is None else matches[:limit]
+        rows = [(AttributedString(items[i][0]), _kind_names.get(items[i][1], _empty))
+                for i in indices]
+        return CompletionPage(generation, prefix, rows, indices, len(matches))
     
-    def completion_docs(self, index):
-        cr = self.last_completion_results.results[index]
+    def completion_docs(self, index, generation):
+        kept = self._kept_completions(generation)
+        if kept is None:
+            return []
+
+        cr = kept.results.results[index]
         assert isinstance(cr, cindex.CodeCompletionResult)
         
         synopsis = format_synopsis(' '.join(chunk.spelling for chunk in cr.string))
@@ -140,28 +274,95 @@ class Engine:
         possibly_header = _might_be_header(filename)
         
         unsaved = self.encode_unsaved(unsaved)
-        if filename not in self._translation_units:
-            try:
-                res = self.index.parse(
-                    tobytes(str(filename)),
-                    args=self.config.clang_header_flags if possibly_header else self.config.clang_flags,
-                    unsaved_files=unsaved,
-                    options=ClangHeaderOptions if possibly_header else ClangOptions
-                )
-                reparse = True
-            except AssertionError:
-                logging.exception('assertion failure in cindex')
-                raise cindex.TranslationUnitLoadError
-            else:
-                self._translation_units[filename] = res
+        res, preamble = self._translation_units.get(filename, (None, None))
+        text = dict(unsaved).get(tobytes(str(filename)), b'')
+        if preamble is not None and split_preamble(text) != preamble:
+            # The unit includes a precompiled preamble that no longer matches
+            # the file's #include lines.
+            res = None
+
+        if res is None:
+            res, preamble = self._parse(filename, unsaved, possibly_header)
+            reparse = True
+            self._translation_units[filename] = res, preamble
         else:
-            res = self._translation_units[filename]
+            self._translation_units.move_to_end(filename)
 
         if reparse:
             res.reparse(unsaved, options=ClangHeaderOptions if possibly_header else ClangOptions)    
+            self._unit_memory[filename] = _unit_memory(res) or 0
+            self._evict()
         self.tu = res
         return res
         
+    def prefetch(self, filename, unsaved=()):
+        '''
+        Parse the file ahead of the first request for it, unless that would
+        drop a unit that has already been parsed.
+        '''
+        if filename in self._translation_units:
+            return False
+        if len(self._translation_units) >= self.config.max_translation_units:
+            return False
+        if sum(self._unit_memory.values()) >= self.config.translation_unit_memory * 2 ** 20:
+            return False
+
+        self.unit(filename, unsaved, reparse=False)
+        return True
+
+    def _parse(self, filename, unsaved, possibly_header):
+        args = list(self.config.flags_for(filename, header=possibly_header))
+        options = ClangHeaderOptions if possibly_header else ClangOptions
+
+        pch_args = []
+        text = dict(unsaved).get(tobytes(str(filename)))
+        if self.preambles is not None and text is not None:
+            pch_args = self.preambles.args_for(filename, args, text)
+
+        try:
+            res = self.index.parse(
+                tobytes(str(filename)),
+                args=args + pch_args,
+                unsaved_files=unsaved,
+                options=options
+            )
+            if self.preambles is not None and self.preambles.is_stale(res, pch_args):
+                self.preambles.discard(pch_args)
+                pch_args = []
+                res = self.index.parse(
+                    tobytes(str(filename)),
+                    args=args,
+                    unsaved_files=unsaved,
+                    options=options
+                )
+        except AssertionError:
+            logging.exception('assertion failure in cindex')
+            raise cindex.TranslationUnitLoadError
+
+        return res, split_preamble(text) if pch_args else None
+
+    def _evict(self):
+        '''
+        Drop the least recently used translation units while there are more
+        than `max_translation_units` or they use more than
+        `translation_unit_memory` together, always keeping the latest.
+        '''
+        units = self._translation_units
+        memory = self._unit_memory
+        while len(units) > max(1, self.config.max_translation_units):
+            self._drop_oldest_unit()
+
+        limit = self.config.translation_unit_memory * 2 ** 20
+        while len(units) > 1 and limit > 0 and sum(memory.values()) > limit:
+            filename = self._drop_oldest_unit()
+            logging.info('Dropping translation unit for %s to save memory', filename)
+
+    def _drop_oldest_unit(self):
+        filename, _ = self._translation_units.popitem(last=False)
+        self._unit_memory.pop(filename, None)
+        self._completions.pop(filename, None)
+        return filename
+
     @staticmethod
     def typed_text(cstring):
         '''
@@ -218,6 +419,8 @@ class AbstractCodeTask(object):
 
     def __call__(self, worker):
         engine = worker.engine
+        self.unsaved_files = [(name, resolve_text(worker, text))
+                              for (name, text) in self.unsaved_files]
         return self.process(engine)
 
 
@@ -304,17 +507,51 @@ class FindRelatedTask(AbstractCodeTask):
         return results
 
 class CompletionTask(AbstractCodeTask):
+    def __init__(self, *args, prefix='', limit=None, **kw):
+        super().__init__(*args, **kw)
+        self.prefix = prefix
+        self.limit = limit
+
     def process(self, engine):
         assert isinstance(engine, Engine)
-        return engine.completions(self.filename, self.pos, self.unsaved_files)
+        return engine.completions(self.filename, self.pos, self.unsaved_files,
+                                  self.prefix, self.limit)
+
+class FilterCompletionsTask(object):
+    def __init__(self, generation, prefix, limit=None):
+        self.generation = generation
+        self.prefix = prefix
+        self.limit = limit
+
+    def __call__(self, worker):
+        engine = worker.engine
+        assert isinstance(engine, Engine)
+        return engine.filter_completions(self.generation, self.prefix, self.limit)
         
+class PrefetchTask(object):
+    '''
+    Parse a file (as saved) so that the first request for it doesn't have
+    to. Submit this with a low priority.
+    '''
+    def __init__(self, filename):
+        self.filename = str(filename)
+
+    def __call__(self, worker):
+        engine = worker.engine
+        assert isinstance(engine, Engine)
+        try:
+            return engine.prefetch(self.filename)
+        except cindex.TranslationUnitLoadError:
+            return False
+
 class GetDocsTask(object):
-    def __init__(self, index):
+    def __init__(self, index, generation):
         self.index = index
+        self.generation = generation
     def __call__(self, worker):
         engine = worker.engine
         assert isinstance(engine, Engine)
-        return engine.completion_docs(self.index)
+        return engine.completion_docs(self.index, self.generation)
         
 severity_map = {
     cindex.Diagnostic.Note: Diagnostic.Severity.note,
@@ -339,9 +576,9 @@ class GetCallTipTask(AbstractCodeTask):
     def process(self, engine):
         assert isinstance(engine, Engine)
         
-        engine.completions(self.filename, self.pos, self.unsaved_files)
+        results = engine.code_complete(self.filename, self.pos, self.unsaved_files)
         
-        for compl in engine.last_completion_results.results:
+        for compl in results.results:
 
 #             print(compl)
 
@@ -0,0 +1,253 @@
+'''
+Precompiled preambles kept on disk.
+
+The #include lines at the top of a file (its "preamble") are usually what
+takes longest to parse. libclang keeps a precompiled preamble in memory for
+each translation unit, but a new worker process starts from scratch. The
+`PreambleCache` saves the preamble of each file as a precompiled header
+keyed by the compiler flags and a hash of the preamble's text, so that the
+first parse after a restart includes the precompiled header instead of
+parsing the headers again.
+'''
+
+import hashlib
+import logging
+import os
+import re
+import tempfile
+
+from clang import cindex
+
+_directive = re.compile(rb'\s*#\s*(\w*)')
+
+def split_preamble(text):
+    '''
+    Return the part of the text up to the end of the last #include line at
+    the top of the file, which only blank lines, comments and preprocessor
+    directives precede. #include lines inside an #if that isn't closed before
+    them are left out.
+    '''
+    end = 0
+    depth = 0
+    in_comment = False
+    continued = False
+    pos = 0
+
+    for line in text.splitlines(keepends=True):
+        pos += len(line)
+        stripped = line.strip()
+
+        if continued:
+            continued = stripped.endswith(b'\\')
+            continue
+
+        if in_comment:
+            if b'*/' not in stripped:
+                continue
+            in_comment = False
+            stripped = stripped.split(b'*/', 1)[1].strip()
+
+        if not stripped or stripped.startswith(b'//'):
+            continue
+
+        if stripped.startswith(b'/*'):
+            if b'*/' not in stripped:
+                in_comment = True
+                continue
+            if stripped.endswith(b'*/'):
+                continue
+            break
+
+        m = _directive.match(stripped)
+        if m is None:
+            break
+
+        directive = m.group(1)
+        continued = stripped.endswith(b'\\')
+        if directive.startswith(b'if'):
+            depth += 1
+        elif directive == b'endif':
+            depth -= 1
+            if depth < 0:
+                break
+        elif directive in (b'include', b'import') and depth == 0:
+            end = pos
+
+    return text[:end]
+
+
+def header_language(filename, args):
+    '''
+    Return the ``-x`` language to compile the preamble of the file with.
+    '''
+    args = list(args)
+    language = None
+    for i, arg in enumerate(args[:-1]):
+        if arg == '-x':
+            language = args[i + 1]
+    if language is None:
+        _, ext = os.path.splitext(str(filename))
+        language = {'.c': 'c', '.m': 'objective-c', '.mm': 'objective-c++'}.get(ext.lower(), 'c++')
+    if language.endswith('-header'):
+        return language
+    return language + '-header'
+
+
+class PreambleCache(object):
+    '''
+    Precompiled preambles in the given directory, which holds at most
+    `max_size` MB of them (with the headers they were built from). The least
+    recently used are deleted first.
+
+    A preamble is only precompiled once it has been saved, so that editing
+    the #include lines doesn't build one for every intermediate state.
+    '''
+
+    # The most preambles remembered as having failed to precompile (as empty
+    # .pch files), so that they aren't built again every time.
+    MaxFailures = 64
+
+    def __init__(self, index, directory, max_size):
+        self.index = index
+        self.directory = str(directory)
+        self.max_size = max_size * 2 ** 20
+
+    def _key(self, filename, args, preamble):
+        h = hashlib.sha1()
+        h.update(repr((os.path.dirname(str(filename)), tuple(args))).encode())
+        h.update(preamble)
+        return h.hexdigest()
+
+    def args_for(self, filename, args, text):
+        '''
+        Return the flags that include the precompiled preamble of the
+        file (with the given text as bytes), building it if needed, or an
+        empty list if there is none.
+        '''
+        preamble = split_preamble(text)
+        if not preamble:
+            return []
+
+        base = os.path.join(self.directory, self._key(filename, args, preamble))
+        pch = base + '.pch'
+        try:
+            if os.path.exists(pch):
+                os.utime(pch)
+            elif preamble != self._saved_preamble(filename):
+                # still being edited
+                return []
+            else:
+                self._build(filename, args, preamble, base)
+            if not os.path.getsize(pch):
+                return []
+        except (OSError, cindex.TranslationUnitLoadError, cindex.TranslationUnitSaveError):
+            logging.exception('Failed to precompile the preamble of %s', filename)
+            return []
+
+        return ['-include-pch', pch]
+
+    def _saved_preamble(self, filename):
+        try:
+            with open(str(filename), 'rb') as f:
+                return split_preamble(f.read())
+        except OSError:
+            return None
+
+    def _build(self, filename, args, preamble, base):
+        os.makedirs(self.directory, exist_ok=True)
+
+        # The precompiled header refers to the header it was built from, so
+        # that has to stay on disk too. Includes relative to the original
+        # file are found with -iquote.
+        header = base + '.h'
+        with open(header, 'wb') as f:
+            f.write(preamble)
+
+        tu = self.index.parse(
+            header.encode(),
+            args=list(args) + ['-x', header_language(filename, args),
+                               '-iquote', os.path.dirname(str(filename))],
+            options=cindex.TranslationUnit.PARSE_INCOMPLETE
+        )
+
+        if any(d.severity >= cindex.Diagnostic.Error for d in tu.diagnostics):
+            # Don't try again until the preamble changes.
+            logging.info('Not precompiling the preamble of %s, which has errors', filename)
+            open(base + '.pch', 'wb').close()
+            os.remove(header)
+            self._prune()
+            return
+
+        fd, tmp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        os.close(fd)
+        try:
+            tu.save(tmp)
+            os.replace(tmp, base + '.pch')
+        finally:
+            if os.path.exists(tmp):
+                os.remove(tmp)
+
+        self._prune()
+
+    def is_stale(self, tu, args):
+        '''
+        Determine whether the translation unit couldn't use the precompiled
+        preamble in its args, e.g., because a header changed since it was
+        built.
+        '''
+        if not args:
+            return False
+        for d in tu.diagnostics:
+            spelling = d.spelling
+            if isinstance(spelling, bytes):
+                spelling = spelling.decode(errors='replace')
+            if d.severity >= cindex.Diagnostic.Fatal and 'precompiled' in spelling:
+                return True
+        return False
+
+    def discard(self, args):
+        '''
+        Delete the precompiled preamble in the args from `args_for`.
+        '''
+        if args:
+            self._remove(args[-1][:-len('.pch')])
+
+    def _remove(self, base):
+        for path in (base + '.pch', base + '.h'):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def _prune(self):
+        # base name -> [last use, size of the .pch and .h files, .pch size]
+        entries = {}
+        for name in os.listdir(self.directory):
+            base, ext = os.path.splitext(name)
+            if ext not in ('.pch', '.h'):
+                continue
+            try:
+                st = os.stat(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                continue
+            entry = entries.setdefault(base, [0, 0, None])
+            entry[1] += st.st_size
+            if ext == '.pch':
+                entry[0] = st.st_mtime
+                entry[2] = st.st_size
+
+        # (a .h file without a .pch file, left by a failed build, goes first)
+        built = sorted((mtime, size, base) for (base, (mtime, size, pch_size))
+                       in entries.items() if pch_size != 0)
+        failed = sorted((mtime, base) for (base, (mtime, _, pch_size))
+                        in entries.items() if pch_size == 0)
+
+        for _, base in failed[:max(0, len(failed) - self.MaxFailures)]:
+            self._remove(os.path.join(self.directory, base))
+
+        total = sum(size for (_, size, _) in built)
+        for _, size, base in built:
+            if total <= self.max_size:
+                break
+            self._remove(os.path.join(self.directory, base))
+            total -= size
@@ -0,0 +1,490 @@
+'''
+Searching every file under a directory.
+
+The files are read with mmap and searched in worker processes, a batch of
+files per task. Files that look binary, directories named ``.git``, and
+paths excluded by ``.gitignore`` files are skipped. Files that are open in an
+editor are searched from their buffers instead (a few at a time, between
+events), so unsaved changes are included; read-only views of large files are
+searched on disk like the others. Results are appended to a new editor as
+they arrive, until it is closed.
+'''
+
+import functools
+import mmap
+import os
+import pathlib
+import re
+import time
+
+from keypad.api import interactive, app, AbstractWindow, BufferController
+from keypad.control.interactive import run as run_interactive
+from keypad.core import errors
+from keypad.core.executors import process_pool
+from keypad.core.notification_queue import run_in_main_thread
+
+
+# the number of files searched by each task sent to a worker
+FilesPerTask = 64
+
+# the longest time, in milliseconds, spent finding files in each step
+WalkSliceMs = 20
+
+# a file is considered binary if its first BinaryCheckBytes bytes contain
+# a null byte
+BinaryCheckBytes = 8192
+
+# the most matching lines reported for one file
+MaxLinesPerFile = 1000
+
+
+def _glob_to_regex(glob):
+    '''
+    Translate a .gitignore pattern into a regex matching paths relative to
+    the directory containing the .gitignore file.
+
+    >>> bool(re.fullmatch(_glob_to_regex('**/build/*.o'), 'src/build/a.o'))
+    True
+    >>> bool(re.fullmatch(_glob_to_regex('*.o'), 'src/a.o'))
+    False
+    '''
+    result = []
+    i = 0
+    while i < len(glob):
+        if glob.startswith('**/', i):
+            result.append('(?:.*/)?')
+            i += 3
+        elif glob.startswith('**', i):
+            result.append('.*')
+            i += 2
+        elif glob[i] == '*':
+            result.append('[^/]*')
+            i += 1
+        elif glob[i] == '?':
+            result.append('[^/]')
+            i += 1
+        elif glob[i] == '[' and ']' in glob[i+2:]:
+            end = glob.index(']', i + 2)
+            body = glob[i+1:end]
+            if body.startswith('!'):
+                body = '^' + body[1:]
+            result.append('[' + body.replace('\\', '\\\\') + ']')
+            i = end + 1
+        elif glob[i] == '\\' and i + 1 < len(glob):
+            result.append(re.escape(glob[i+1]))
+            i += 2
+        else:
+            result.append(re.escape(glob[i]))
+            i += 1
+    return ''.join(result)
+
+
+class IgnoreRules(object):
+    '''
+    The patterns of a .gitignore file in the directory `base`.
+
+    Later patterns take precedence over earlier ones, and patterns beginning
+    with ``!`` re-include paths excluded by earlier ones. A pattern ending
+    with ``/`` matches only directories. A pattern containing a ``/`` other
+    than at its end is matched against the whole path relative to `base`;
+    other patterns are matched against the last component of the path.
+
+    >>> rules = IgnoreRules('/src', ['*.o', '!keep.o', 'build/', '/doc/*.html'])
+    >>> rules.match('/src/a/b.o', False), rules.match('/src/a/keep.o', False)
+    (True, False)
+    >>> rules.match('/src/a/build', True), rules.match('/src/a/build', False)
+    (True, None)
+    >>> rules.match('/src/doc/x.html', False), rules.match('/src/a/doc/x.html', False)
+    (True, None)
+    '''
+
+    def __init__(self, base, lines):
+        self.base = str(base)
+        self._rules = []
+
+        for line in lines:
+            line = line.rstrip('\n\r')
+            if not line.endswith('\\ '):
+                line = line.rstrip(' ')
+            if not line or line.startswith('#'):
+                continue
+
+            negate = line.startswith('!')
+            if negate:
+                line = line[1:]
+            dir_only = line.endswith('/')
+            line = line.rstrip('/')
+            anchored = '/' in line
+            line = line.lstrip('/')
+            if not line:
+                continue
+
+            self._rules.append((re.compile(_glob_to_regex(line)),
+                                negate, dir_only, anchored))
+
+    @classmethod
+    def from_directory(cls, directory):
+        '''
+        Return the rules of the .gitignore file in the directory, or None if
+        there isn't one.
+        '''
+        try:
+            with open(os.path.join(directory, '.gitignore'),
+                      encoding='utf-8', errors='replace') as f:
+                return cls(directory, f.readlines())
+        except OSError:
+            return None
+
+    def match(self, path, is_dir):
+        '''
+        Return True if the path is ignored, False if it is explicitly not
+        ignored, or None if no pattern matches it.
+        '''
+        relpath = os.path.relpath(path, self.base).replace(os.sep, '/')
+        name = relpath.rpartition('/')[2]
+
+        result = None
+        for rgx, negate, dir_only, anchored in self._rules:
+            if dir_only and not is_dir:
+                continue
+            if rgx.fullmatch(relpath if anchored else name):
+                result = not negate
+        return result
+
+
+def walk_files(root):
+    '''
+    Yield the path of every regular file under `root` that is not in a
+    directory named ``.git`` or excluded by a .gitignore file.
+    '''
+    def walk(directory, rules):
+        local = IgnoreRules.from_directory(directory)
+        if local is not None:
+            rules = rules + [local]
+
+        try:
+            with os.scandir(directory) as it:
+                entries = sorted(it, key=lambda entry: entry.name)
+        except OSError:
+            return
+
+        for entry in entries:
+            if entry.name == '.git':
+                continue
+
+            try:
+                is_dir = entry.is_dir(follow_symlinks=False)
+                is_file = not is_dir and entry.is_file()
+            except OSError:
+                continue
+
+            ignored = None
+            for r in rules:
+                decision = r.match(entry.path, is_dir)
+                if decision is not None:
+                    ignored = decision
+            if ignored:
+                continue
+
+            if is_dir:
+                yield from walk(entry.path, rules)
+            elif is_file:
+                yield entry.path
+
+    yield from walk(str(root), [])
+
+
+_non_ascii = re.compile(rb'[^\x00-\x7f]')
+
+def grep_text(rgx, data):
+    '''
+    Return a list of ``(line, column, text)`` for each line of `data` (a
+    string or a bytes-like object of ASCII text) that contains a match of
+    the compiled pattern, where `line` and `column` locate the first match
+    on the line and `text` is the text of the line.
+    '''
+    if isinstance(data, str):
+        newline = '\n'
+        decode = str
+        count = data.count
+    else:
+        newline = b'\n'
+        decode = functools.partial(str, encoding='ascii')
+        # (mmap objects have no count method)
+        count = lambda sub, start, end: data[start:end].count(sub)
+
+    results = []
+    line = 0
+    counted = 0
+    line_end = -1
+
+    for match in rgx.finditer(data):
+        start = match.start()
+        if start <= line_end:
+            continue # already reported this line
+
+        line += count(newline, counted, start)
+        counted = start
+        line_start = data.rfind(newline, 0, start) + 1
+        line_end = data.find(newline, start)
+        if line_end < 0:
+            line_end = len(data)
+
+        text = decode(data[line_start:line_end]).rstrip('\r')
+        results.append((line, start - line_start, text))
+        if len(results) >= MaxLinesPerFile:
+            break
+
+    return results
+
+
+def _grep_file(rgx, brgx, path):
+    with open(path, 'rb') as f:
+        if os.fstat(f.fileno()).st_size == 0:
+            return []
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            if b'\0' in data[:BinaryCheckBytes]:
+                return []
+
+            # Plain ASCII files can be searched without being decoded.
+            if brgx is not None and _non_ascii.search(data) is None:
+                return grep_text(brgx, data)
+            else:
+                return grep_text(rgx, data[:].decode('utf-8', 'replace'))
+
+
+def _grep_files(pattern, flags, paths):
+    '''
+    Search the files, returning ``(path, matches)`` for each file that
+    contains a match, where `matches` is as returned by `grep_text`.
+
+    This runs in a worker process.
+    '''
+    rgx = re.compile(pattern, flags)
+    try:
+        # Equivalent to rgx on ASCII text.
+        brgx = re.compile(pattern.encode('ascii'), flags & ~re.UNICODE | re.ASCII)
+    except (UnicodeEncodeError, re.error):
+        brgx = None
+
+    results = []
+    for path in paths:
+        try:
+            matches = _grep_file(rgx, brgx, path)
+        except (OSError, ValueError):
+            continue
+        if matches:
+            results.append((path, matches))
+    return results
+
+
+def project_root(path):
+    '''
+    Return the nearest directory containing `path` that is the root of a
+    version control repository, or the directory containing `path` if there
+    is none.
+    '''
+    path = pathlib.Path(path).absolute()
+    directory = path if path.is_dir() else path.parent
+    for candidate in [directory] + list(directory.parents):
+        if any((candidate / name).exists() for name in ('.git', '.hg', '.svn')):
+            return candidate
+    return directory
+
+
+class GrepJob(object):
+    '''
+    Searches the files under `root` for `pattern`, appending the results to
+    the buffer of `bufctl` as they arrive. The search stops when `bufctl` is
+    disposed of.
+    '''
+
+    def __init__(self, bufctl, pattern, root):
+        self.bufctl = bufctl
+        self.pattern = pattern
+        # normalized, so that the paths found match those of open editors
+        self.root = pathlib.Path(os.path.abspath(str(root)))
+        self.file_count = 0
+        self.line_count = 0
+
+        self._rgx = re.compile(pattern, re.MULTILINE)
+        self._files = walk_files(self.root)
+        self._batch = []
+        self._running = set()
+        self._walking = True
+        self._cancelled = False
+        self._open = {}
+
+        for editor in app().editors:
+            if editor.path is None or editor.buffer_controller is bufctl:
+                continue
+            buff = editor.buffer_controller.buffer
+            if not buff.read_only:
+                self._open[os.path.abspath(str(editor.path))] = buff
+
+        bufctl.disposed.connect(self.cancel)
+        self._append('Searching {} for {!r}.\n'.format(self.root, pattern))
+
+    @property
+    def done(self):
+        return not self._walking and not self._running
+
+    def start(self):
+        self._walk()
+
+    def cancel(self):
+        '''
+        Stop searching, dropping the results that haven't arrived yet.
+        '''
+        self._cancelled = True
+        self._walking = False
+        self._batch = []
+        for future in self._running:
+            future.cancel()
+        self._running.clear()
+
+    def _walk(self):
+        if self._cancelled:
+            return
+
+        deadline = time.time() + WalkSliceMs / 1000.0
+        for path in self._files:
+            buff = self._open.get(path)
+            if buff is not None:
+                # Open files are searched here, from their buffers.
+                self._report([(path, self._grep_buffer(buff))])
+            else:
+                self._batch.append(path)
+                if len(self._batch) >= FilesPerTask:
+                    self._submit()
+            if time.time() >= deadline:
+                app().timer(0, self._walk)
+                return
+
+        self._submit()
+        self._walking = False
+        self._finish_if_done()
+
+    def _grep_buffer(self, buff):
+        text = buff.text # cached by the buffer
+        if '\0' in text[:BinaryCheckBytes]:
+            return []
+        return grep_text(self._rgx, text)
+
+    def _submit(self):
+        if not self._batch:
+            return
+
+        future = process_pool().submit(_grep_files, self._rgx.pattern,
+                                        self._rgx.flags, self._batch)
+        self._batch = []
+        self._running.add(future)
+        future.add_done_callback(
+            lambda future: run_in_main_thread(functools.partial(self._on_done, future))
+        )
+
+    def _on_done(self, future):
+        if self._cancelled:
+            return
+        self._running.discard(future)
+        try:
+            self._report(future.result())
+        except Exception as exc:
+            self._append('Search failed: {}\n'.format(exc))
+        self._finish_if_done()
+
+    def _report(self, results):
+        lines = []
+        for path, matches in results:
+            if not matches:
+                continue
+            relpath = os.path.relpath(path, str(self.root))
+            self.file_count += 1
+            for y, x, text in matches:
+                lines.append('{}:{}:{}: {}\n'.format(relpath, y + 1, x + 1, text))
+        self.line_count += len(lines)
+        self._append(''.join(lines))
+
+    def _finish_if_done(self):
+        if self.done:
+            self._append('{} matching lines in {} files.\n'.format(self.line_count,
+                                                                 self.file_count))
+
+    def _append(self, text):
+        if not text or self._cancelled:
+            return
+        buff = self.bufctl.buffer
+        with self.bufctl.history.ignoring():
+            buff.insert(buff.end_pos, text)
+        self.bufctl.refresh_view()
+
+
+def _grep(win, root, pattern):
+    if not pattern:
+        raise errors.UserError('Expected a pattern.')
+    try:
+        re.compile(pattern)
+    except re.error as exc:
+        raise errors.UserError('Invalid pattern: {}'.format(exc))
+
+    editor = app().new_editor()
+    win.add_editor(editor)
+    bufctl = editor.buffer_controller
+
+    job = GrepJob(bufctl, pattern, root)
+    bufctl.add_tags(grep_job=job)
+    job.start()
+
+
+@interactive('grep')
+def grep(win: AbstractWindow, *pattern):
+    '''
+    : grep <pattern>...
+
+    Search the files in the project containing the active file (or in the
+    working directory) for the given regex, showing the matching lines in a
+    new editor. Use "grep_goto" on a result to open it.
+    '''
+    active = win.active_editor
+    if active is not None and active.path is not None:
+        root = project_root(active.path)
+    else:
+        root = pathlib.Path.cwd()
+    _grep(win, root, ' '.join(pattern))
+
+
+@interactive('grep_in')
+def grep_in(win: AbstractWindow, root: 'Path', *pattern):
+    '''
+    : grep_in <directory> <pattern>...
+
+    Search the files under the directory for the given regex.
+    '''
+    root = pathlib.Path(os.path.expanduser(str(root))).absolute()
+    if not root.is_dir():
+        raise errors.UserError('Not a directory: {}'.format(root))
+    _grep(win, root, ' '.join(pattern))
+
+
+_result_line = re.compile(r'^(.*?):(\d+):(\d+): ')
+
+@interactive('grep_goto')
+def grep_goto(bufctl: BufferController):
+    '''
+    : grep_goto
+
+    Open the file at the location given by the current line of the results
+    of "grep".
+    '''
+    job = bufctl.tags.get('grep_job')
+    if job is None:
+        raise errors.UserError('Not a grep results buffer.')
+
+    y = bufctl.canonical_cursor.pos[0]
+    match = _result_line.match(bufctl.buffer.lines[y].text)
+    if match is None:
+        raise errors.UserError('Not a result.')
+
+    path, line, col = match.groups()
+    run_interactive('edit', str(job.root / path), int(line) - 1, int(col) - 1)
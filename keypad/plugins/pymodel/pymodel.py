@@ -16,7 +16,10 @@ from keypad.abstract.code import (AbstractCodeModel,
 from keypad.buffers import Cursor
 from . import syntax, settings
 from keypad.core.processmgr.client import AsyncServerProxy
+from keypad.core.processmgr.pool import worker_pool, settings_key, settings_snapshot
+from keypad.core.processmgr.mirror import BufferMirror, ForgetMirror, resolve_text, submit_mirrored
 from keypad.core import AttributedString
+from keypad.core.fuzzy import FuzzySearch
 from keypad.util import dump_object
 from keypad.abstract.rewriting import ReplaceFileRewrite
 
@@ -31,6 +34,7 @@ class PythonCompletionResults(AbstractCompletionResults):
         self._filt_rows = self._rows
         self._filt_indices = list(range(len(self._rows)))
         self._runner = runner
+        self._search = FuzzySearch(self._rows, key=lambda row: row[0].text)
 
     @property
     def rows(self):
@@ -40,18 +44,9 @@ class PythonCompletionResults(AbstractCompletionResults):
         return self.rows[index][0].text
 
     def filter(self, pattern):
-        self._filt_rows = []
-        rgx = re.compile('.*?' + '.*?'.join(map(re.escape, pattern.lower())))
-
-        filt_rows = []
-        for i, row in enumerate(self._rows):
-            if rgx.match(row[0].text.lower()):
-                filt_rows.append((i, row))
-
-        filt_rows.sort(key=lambda key: len(key[1][0]))
-
-        self._filt_rows = [r[1] for r in filt_rows]
-        self._filt_indices = [r[0] for r in filt_rows]
+        filt = self._search.filter(pattern)
+        self._filt_rows = filt.rows
+        self._filt_indices = filt.indices
 
     def doc_async(self, index):
         real_index = self._filt_indices[index]
@@ -61,7 +56,11 @@ class PythonCompletionResults(AbstractCompletionResults):
         pass # TODO
 
 class WorkerStart(object):
+    def __init__(self, settings):
+        self.settings = settings
+
     def __call__(self, worker):
+        self.settings.apply_settings()
         worker.refs = [
             Cursor, syntax, AsyncServerProxy,
             AttributedString,
@@ -81,17 +80,11 @@ class WorkerTask(object):
 
     def __call__(self, worker):
         line, col = self.pos
+        self.unsaved = resolve_text(worker, self.unsaved)
         script = jedi.Script(self.unsaved, line+1, col, self.filename)
         self.worker = worker
         return self.process(script)
 
-class UpdateSettings:
-    def __init__(self, settings):
-        self.settings = settings
-
-    def __call__(self, worker):
-        self.settings.apply_settings()
-
 class Complete(WorkerTask):
     def process(self, script):
         compls = script.completions()
@@ -213,8 +206,8 @@ class PythonCodeModel(IndentRetainingCodeModel):
             syntax.pylexer(), 
             dict(lexcat=None)
         )
-        self.runner = AsyncServerProxy(WorkerStart())
-        self.runner.start()
+        self.runner = None
+        self._mirror = BufferMirror(self.buffer)
         self.disposed = False
         self.__settings = settings.PythonCompletionSettings.from_config(self.conf)
         self.__settings.value_changed.connect(self.__reload_config)
@@ -222,20 +215,29 @@ class PythonCodeModel(IndentRetainingCodeModel):
         self.__reload_config()
 
     def __reload_config(self, *args):
-        self.runner.submit(UpdateSettings(self.__settings))
+        # Buffers with the same settings share a pool of workers.
+        if self.runner is not None:
+            self.runner.release()
+        config = settings_snapshot(self.__settings)
+        self.runner = worker_pool(('python', settings_key(config)), WorkerStart(config)).lease()
+        self._mirror.reset() # the new worker has no copy of the text
+
 
+    def _submit(self, make_task, transform=None, *, key=None):
+        # Send only the edits that the worker hasn't seen.
+        return submit_mirrored(self.runner, self._mirror, make_task, transform, key=key)
 
     def call_tip_async(self, pos):
-        return self.runner.submit(
-            GetCallTip(
+        return self._submit(
+            lambda text: GetCallTip(
                 str(self.path) if self.path else None,
                 pos, 
-                self.buffer.text
+                text
             )
         )
 
-    def highlight(self):
-        self.highlighter.highlight_buffer(self.buffer)
+    def highlight(self, time_limit_ms=None):
+        self.highlighter.highlight_buffer(self.buffer, time_limit_ms)
 
     def _transform_results(self, tok_start, results):
         return PythonCompletionResults(tok_start, results, self.runner)
@@ -256,23 +258,24 @@ class PythonCodeModel(IndentRetainingCodeModel):
 
     def completions_async(self, pos):
         tok_start = self._find_token_start(pos)
-        return self.runner.submit(
-            Complete(
+        return self._submit(
+            lambda text: Complete(
                 str(self.path) if self.path else None,
                 tok_start,
-                self.buffer.text
+                text
             ),
-            transform=lambda res: self._transform_results(tok_start, res)
+            transform=lambda res: self._transform_results(tok_start, res),
+            key='completions'
         )
 
     def find_related_async(self, pos, types):
         tok_start = self._find_token_start(pos)
-        return self.runner.submit(
-            FindRelated(
+        return self._submit(
+            lambda text: FindRelated(
                 types,
                 str(self.path) if self.path else None,
                 tok_start,
-                self.buffer.text
+                text
             ),
         )
 
@@ -282,14 +285,16 @@ class PythonCodeModel(IndentRetainingCodeModel):
 
     def rename(self, pos, name):
         tok_start = self._find_token_start(pos)
-        return self.runner.submit(Rename(name,
-                                         str(self.path) if self.path else None,
-                                         tok_start,
-                                         self.buffer.text))
+        return self._submit(lambda text: Rename(name,
+                                                str(self.path) if self.path else None,
+                                                tok_start,
+                                                text))
 
     def dispose(self):
         try:
-            self.runner.shutdown()
+            self.runner.submit(ForgetMirror(self._mirror.doc))
+            self._mirror.dispose()
+            self.runner.release()
         finally:
             self.disposed = True
 
@@ -162,9 +162,9 @@ def pylexer():
 
 @autoconnect(BufferController.buffer_needs_highlight,
              lambda tags: tags.get('syntax') == 'python')
-def python_syntax_highlighting(controller):
+def python_syntax_highlighting(controller, time_limit_ms=None):
     highlighter = SyntaxHighlighter('keypad.plugins.pycomplete.syntax', pylexer(), dict(lexcat=None))
-    highlighter.highlight_buffer(controller.buffer)
+    highlighter.highlight_buffer(controller.buffer, time_limit_ms)
 
 
 def main():
@@ -71,14 +71,14 @@ class RSTCodeModel(api.IndentRetainingCodeModel):
 
 
 
-    def highlight(self):
+    def highlight(self, time_limit_ms=None):
         highlighter = syntaxlib.SyntaxHighlighter(
             'keypad.plugins.rst',
             lexer().All,
             dict(lexcat=None)
         )
 
-        highlighter.highlight_buffer(self.buffer)
+        highlighter.highlight_buffer(self.buffer, time_limit_ms)
 
 
     def __filename_at(self, pos):
@@ -1,10 +1,14 @@
 
+import functools
+import itertools
 import re
-from keypad.api import interactive, autoconnect, BufferController
+import time
+from keypad.api import interactive, autoconnect, BufferController, app
 from keypad.control.interactive import run as run_interactive
 from keypad.buffers import Cursor, Span
+from keypad.buffers.buffer import Substitution
 from keypad.control.command_line_interaction import writer as cmdline_writer
-from keypad.util import time_limited
+from keypad.util.listdict import ListDict
 
 class RegexSearcher(object):
     '''
@@ -23,31 +27,38 @@ class RegexSearcher(object):
     ((1, 1), 3)
     >>> rs.search((2,0), '\\w\n\\w', backwards=True)
     ((0, 1), 3)
+    >>> rs.search((2,1), '[ce]', backwards=True)
+    ((2, 0), 1)
+    >>> rs.search((2,0), 'c', backwards=True)
+    ((1, 0), 1)
     '''
 
+    # the number of characters searched by the first step of a backwards
+    # search, or of a forward search in a read-only buffer
+    BackwardsWindow = 1 << 14
+    ForwardWindow = 1 << 16
 
+    # the number of lines of a read-only buffer searched at a time by
+    # `searchall`, and the number of lines after them that matches may extend
+    # into
+    ChunkLines = 1000
+    ContextLines = 2
 
     def __init__(self, buff):
         self.buff = buff
-        self._cached_text = None
         self.pattern = None
 
-        self.buff.text_modified.connect(self._on_buffer_change)
-
-    def _on_buffer_change(self, chg):
-        self._cached_text = None
-
     @property
     def buffer_text(self):
-        if self._cached_text is None:
-            self._cached_text = self.buff.text
+        # Buffer.text is cached by the buffer until it is next modified.
+        return self.buff.text
 
-        return self._cached_text
+    def _translate_span(self, start, end):
+        return self.buff.calculate_pos((0, 0), start), end - start
 
     def _translate_match(self, match):
         if match is not None:
-            start_pos = self.buff.calculate_pos((0, 0), match.start())
-            return start_pos, match.end() - match.start()
+            return self._translate_span(match.start(), match.end())
         else:
             return None
 
@@ -57,31 +68,325 @@ class RegexSearcher(object):
         else:
             pattern = self.pattern = re.compile(pattern, re.MULTILINE)
 
-        yield from map(self._translate_match, pattern.finditer(self.buffer_text))
-
-
-
+        if self.buff.read_only:
+            yield from self._searchall_lines(pattern)
+        else:
+            yield from map(self._translate_match, pattern.finditer(self.buffer_text))
+
+    def _searchall_lines(self, pattern):
+        # The text of a read-only buffer isn't cached, and may not fit in
+        # memory, so search it a chunk of lines at a time.
+        count = len(self.buff.lines)
+        resume = 0
+        for first in range(0, count, self.ChunkLines):
+            text, begin, end, offset = self._window_text(first, first + self.ChunkLines)
+            for match in pattern.finditer(text, max(begin, resume - offset)):
+                if match.start() >= end:
+                    break
+                resume = offset + match.end()
+                yield self._translate_span(offset + match.start(), resume)
 
     def search(self, pos, pattern=None, backwards=False):
-        index = self.buff.calculate_index(pos)
         if pattern is not None:
             pattern = re.compile(pattern)
             self.pattern = pattern
         else:
             pattern = self.pattern
 
-        if not backwards:
-            match = pattern.search(self.buffer_text, pos=index+1)
+        if backwards:
+            return self._search_backwards(pos, pattern)
+
+        if self.buff.read_only:
+            return self._search_forward_lines(pos, pattern)
+
+        index = self.buff.calculate_index(pos)
+        match = pattern.search(self.buffer_text, pos=index+1)
+        return self._translate_match(match)
+
+    def _search_forward_lines(self, pos, pattern):
+        '''
+        Find the first match of the pattern that starts after `pos` in a
+        read-only buffer.
+
+        The text after `pos` is searched in windows that grow fourfold each
+        time nothing is found, like `_search_backwards`.
+        '''
+        buff = self.buff
+        y = pos[0]
+        start = buff.calculate_index(pos) + 1
+        last_index = buff.calculate_index(buff.end_pos)
+        window = self.ForwardWindow
+
+        while True:
+            stop = buff.calculate_pos((0, 0), min(start + window, last_index))[0] + 1
+            text, _, end, offset = self._window_text(y, stop)
+            match = pattern.search(text, start - offset)
+            if match is not None and match.start() < end:
+                return self._translate_span(offset + match.start(),
+                                            offset + match.end())
+            if stop >= len(buff.lines):
+                return None
+            window *= 4
+
+    def _window_text(self, first, stop):
+        '''
+        Return ``(text, begin, end, offset)`` for the lines in ``range(first,
+        stop)`` of a read-only buffer, where matches in the lines start at or
+        after ``text[begin]`` and before ``text[end]``, and `offset` is the
+        index of ``text[0]`` in the buffer.
+
+        The text includes the newline before the lines and `ContextLines`
+        lines after them, so that anchors, lookarounds and matches that
+        continue past the last line see the same text as they would in the
+        whole buffer.
+        '''
+        buff = self.buff
+        count = len(buff.lines)
+        stop = min(stop, count)
+        texts = buff.line_texts(first, stop + self.ContextLines)
+
+        prefix = '\n' if first > 0 else ''
+        text = prefix + '\n'.join(texts)
+        if stop + self.ContextLines < count:
+            text += '\n'
+
+        begin = len(prefix)
+        if stop < count:
+            # up to and including the newline after the last line
+            end = begin + sum(map(len, texts[:stop - first])) + stop - first
+        else:
+            # including an empty match at the end of the buffer
+            end = len(text) + 1
+
+        return text, begin, end, buff.calculate_index((first, 0)) - begin
+
+    def _search_backwards(self, pos, pattern):
+        '''
+        Find the last match of the pattern that ends at or before `pos`.
+
+        The text before `pos` is searched in windows that grow fourfold each
+        time nothing is found, so the time taken depends on the distance to
+        the match rather than on the size of the buffer.
+        '''
+        literal = _literal(pattern)
+        if self.buff.read_only:
+            windows = self._line_windows(pos)
         else:
-            # TODO: make this more efficient
-            matches = list(pattern.finditer(self.buffer_text, pos=0, endpos=index))
-            if matches:
-                match = matches[-1]
+            windows = self._text_windows(pos)
+
+        for text, begin, end, offset in windows:
+            if literal is not None:
+                start = text.rfind(literal, begin, end)
+                if start >= 0:
+                    return self._translate_span(offset + start,
+                                                offset + start + len(literal))
             else:
                 match = None
+                for match in pattern.finditer(text, begin, end):
+                    pass
+                if match is not None:
+                    return self._translate_span(offset + match.start(),
+                                                offset + match.end())
+
+        return None
+
+    def _text_windows(self, pos):
+        # The text of the buffer is cached, so a window is just a range of it.
+        text = self.buffer_text
+        end = self.buff.calculate_index(pos)
+        window = self.BackwardsWindow
+
+        while True:
+            # start at the beginning of a line, so as not to split a match
+            begin = text.rfind('\n', 0, max(0, end - window)) + 1
+            yield text, begin, end, 0
+            if begin == 0:
+                return
+            window *= 4
+
+    def _line_windows(self, pos):
+        # The text of a read-only buffer isn't cached, so decode only the
+        # lines in the window.
+        buff = self.buff
+        y = pos[0]
+        index = buff.calculate_index(pos)
+        window = self.BackwardsWindow
+
+        while True:
+            first = buff.calculate_pos((0, 0), max(0, index - window))[0]
+            first_index = buff.calculate_index((first, 0))
+            body = '\n'.join(buff.line_texts(first, y + 1))[:index - first_index]
+
+            # Start with the newline before the window, if there is one, so
+            # that anchors and lookbehinds see the same text as they would in
+            # the whole buffer.
+            text = '\n' + body if first > 0 else body
+            begin = len(text) - len(body)
+            yield text, begin, len(text), first_index - begin
+            if first == 0:
+                return
+            window *= 4
+
+
+def _literal(pattern):
+    '''
+    Return the string matched by a compiled pattern if it has no special
+    characters, so that it can be found with the string methods instead.
+    '''
+    if pattern.flags & ~(re.UNICODE | re.MULTILINE):
+        return None
+    if any(c in pattern.pattern for c in '.^$*+?{}[]\\|()'):
+        return None
+    return pattern.pattern
 
-        return self._translate_match(match)
 
+def _may_match_newline(pattern):
+    '''
+    Return False if the compiled pattern certainly can't match a newline.
+    '''
+    if pattern.flags & re.DOTALL:
+        return True
+    return any(s in pattern.pattern
+               for s in ('\n', '\\n', '\\s', '\\S', '\\D', '\\W', '[^'))
+
+
+class MatchIndex(object):
+    '''
+    The matches of a regex in a buffer, kept up to date as the buffer is
+    modified.
+
+    The offsets and lengths of the matches are kept in a `ListDict`, so an
+    edit only has to shift the offsets after it (which is done lazily) and
+    scan the lines that it touched again, along with `ContextLines` lines on
+    either side if the pattern can match a newline.
+
+    Lines are scanned on demand: `scan_lines` scans a range of lines, such
+    as the visible ones, and `scan_more` continues through the rest of the
+    buffer, `ScanLines` lines at a time. Empty matches are ignored.
+    '''
+
+    ScanLines = 1000
+    ContextLines = 2
+
+    def __init__(self, buff, pattern):
+        self.buff = buff
+        self.pattern = pattern
+        self._matches = ListDict()
+        self._context = self.ContextLines if _may_match_newline(pattern) else 0
+
+        # the sorted, disjoint ranges of lines yet to be scanned, as
+        # [start, stop] lists
+        self._unscanned = [[0, len(buff.lines)]]
+
+        buff.text_modified.connect(self._on_text_modified)
+        buff.lines_added_or_removed.connect(self._on_lines_added_or_removed)
+
+    def __len__(self):
+        return len(self._matches)
+
+    @property
+    def complete(self):
+        '''
+        True if every line of the buffer has been scanned.
+        '''
+        return not self._unscanned
+
+    def scan_lines(self, start, stop):
+        '''
+        Scan the lines in ``range(start, stop)`` that haven't been scanned.
+        '''
+        for first, last in list(self._unscanned):
+            first, last = max(first, start), min(last, stop)
+            if first < last:
+                self._scan(first, last)
+
+    def scan_more(self, deadline):
+        '''
+        Scan the first lines that haven't been scanned until the deadline (as
+        given by `time.time`) passes.
+        '''
+        while self._unscanned and time.time() < deadline:
+            start, stop = self._unscanned[0]
+            self._scan(start, min(stop, start + self.ScanLines))
+
+    def matches_in_lines(self, start, stop):
+        '''
+        Yield ``(pos, length)`` for each match found so far that starts in
+        the lines in ``range(start, stop)``.
+        '''
+        buff = self.buff
+        start = max(0, start)
+        if start >= len(buff.lines):
+            return
+
+        base = buff.calculate_index((start, 0))
+        if stop < len(buff.lines):
+            end = buff.calculate_index((stop, 0))
+        else:
+            end = buff.calculate_index(buff.end_pos) + 1
+
+        matches = self._matches
+        for i in range(matches.lower_bound(base), matches.lower_bound(end)):
+            offset, length = matches.item(i)
+            yield buff.calculate_pos((start, 0), offset - base), length
+
+    def _scan(self, start, stop):
+        lines = self.buff.lines
+        stop = min(stop, len(lines))
+        if start >= stop:
+            return
+
+        # Include the context after the lines, so that matches that start in
+        # them but end after them are found.
+        offset = self.buff.calculate_index((start, 0))
+        texts = self.buff.line_texts(start, stop + self._context)
+        end = offset + sum(map(len, texts[:stop - start])) + stop - start
+        text = '\n'.join(texts)
+        if stop + self._context < len(lines):
+            text += '\n'
+
+        matches = self._matches
+        matches.erase(slice(matches.lower_bound(offset), matches.lower_bound(end)))
+        for match in self.pattern.finditer(text):
+            if match.start() >= end - offset:
+                break
+            if match.end() > match.start():
+                matches[offset + match.start()] = match.end() - match.start()
+
+        unscanned = []
+        for first, last in self._unscanned:
+            if first < start:
+                unscanned.append([first, min(last, start)])
+            if last > stop:
+                unscanned.append([max(first, stop), last])
+        self._unscanned = unscanned
+
+    def _on_text_modified(self, mod):
+        y = mod.pos[0]
+        index = self.buff.calculate_index(mod.pos)
+        inserted_lines = mod.insert.count('\n')
+        delta_lines = inserted_lines - mod.remove.count('\n')
+
+        # drop the matches in the removed text, and move the ones after it
+        matches = self._matches
+        i = matches.lower_bound(index)
+        matches.erase(slice(i, matches.lower_bound(index + len(mod.remove))))
+        matches.shift(i, len(mod.insert) - len(mod.remove))
+
+        if delta_lines:
+            for r in self._unscanned:
+                r[:] = [k if k <= y else max(y + 1, k + delta_lines) for k in r]
+            self._unscanned = [r for r in self._unscanned if r[0] < r[1]]
+
+        self._scan(max(0, y - self._context),
+                   y + inserted_lines + 1 + self._context)
+
+    def _on_lines_added_or_removed(self, index, count):
+        # All of the lines were replaced, which doesn't cause text_modified to
+        # be emitted.
+        if index == 0:
+            self._matches = ListDict()
+            self._unscanned = [[0, len(self.buff.lines)]]
 
 
 def _get_searcher(bufctl):
@@ -96,23 +401,248 @@ def _get_searcher(bufctl):
 
 from keypad.core import errors
 
+# the number of matches replaced per step of iter_substitute
+SubstituteChunkSize = 1000
+
+# the most characters between two matches that are replaced by a single
+# edit of the text around them
+SubstituteRunGap = 1 << 10
+
+# the minimum number of seconds between progress reports of a substitution
+SubstituteProgressInterval = 1
+
+
+def _minimal_edit(old, new):
+    '''
+    Return ``(start, stop, insert)`` such that replacing ``old[start:stop]``
+    with `insert` turns `old` into `new`, leaving the longest common prefix
+    and suffix in place.
+    '''
+    if old == new:
+        return 0, 0, ''
+    start = 0
+    for a, b in zip(old, new):
+        if a != b:
+            break
+        start += 1
+    end = 0
+    for a, b in zip(reversed(old[start:]), reversed(new[start:])):
+        if a != b:
+            break
+        end += 1
+    return start, len(old) - end, new[start:len(new) - end]
+
+
+# a group reference in a replacement template, or another escape, which is
+# left to the literal text around it
+_template_escape = re.compile(r'\\(?:[0-7]{3}|g<([^>]*)>|([1-9][0-9]?)|.)', re.DOTALL)
+
+def _compile_replacement(replacement):
+    '''
+    Return a function that expands the template `replacement` for a match
+    like `re.Match.expand`, which parses the template again for each match.
+    '''
+    if '\\' not in replacement:
+        return lambda match: replacement
+
+    empty = re.compile('')
+    pieces = [] # (literal text, group before it)
+    group = None
+    end = 0
+    for escape in _template_escape.finditer(replacement):
+        name, number = escape.groups()
+        if name is None and number is None:
+            continue
+        pieces.append((group, empty.sub(replacement[end:escape.start()], '')))
+        group = int(number or name) if (number or name).isdigit() else name
+        end = escape.end()
+    pieces.append((group, empty.sub(replacement[end:], '')))
+
+    def expand(match):
+        parts = []
+        for group, literal in pieces:
+            if group is not None:
+                parts.append(match.group(group) or '')
+            parts.append(literal)
+        return ''.join(parts)
+    return expand
+
+
+def _runs(edits):
+    # Group the ``(start, stop, insert)`` edits into runs that are close
+    # enough together to be made as one edit.
+    run = []
+    for edit in edits:
+        if run and edit[0] - run[-1][1] > SubstituteRunGap:
+            yield run
+            run = []
+        run.append(edit)
+    if run:
+        yield run
+
+
+def iter_substitute(buff, pattern, replacement, start=(0, 0), end=None, *, chunk_size=None):
+    '''
+    Return an iterator that replaces the matches of the compiled `pattern`
+    between `start` and `end` (default: the end of the buffer) with the
+    template `replacement`, as `re.sub` would, handling `chunk_size`
+    (default: `SubstituteChunkSize`) matches per step.
+
+    The matches of each step that are close together are replaced by a
+    single edit of the text from the first to the last of them, and the
+    history records only the parts that changed (as a
+    `keypad.buffers.buffer.Substitution`), so it doesn't hold copies of the
+    text. The matches are found in the text as it was before the first
+    edit, so the buffer must not be modified by anything else between
+    steps.
+
+    Each step yields ``(count, done, total)``, where `count` is the number of
+    matches replaced so far and `done` is the number of characters of the
+    `total` characters searched.
+    '''
+    if buff.read_only:
+        # Don't decode a large file only to fail at the first edit.
+        raise errors.ReadOnlyError('The buffer is a read-only view of a large file.')
+
+    if chunk_size is None:
+        chunk_size = SubstituteChunkSize
+
+    if start == (0, 0) and end is None:
+        text = buff.text # cached by the buffer
+    else:
+        text = buff.span_text(start, end_pos=end)
+
+    expand = _compile_replacement(replacement)
+
+    # The text between the edits is unchanged, so the position of each edit
+    # is found by counting the lines in the text since the end of the last
+    # one, which was at `text_end` in the text and is at ``(y, x)`` in the
+    # buffer.
+    text_end = 0
+    y, x = start
+
+    matches = pattern.finditer(text)
+    count = 0
+    while True:
+        edits = []
+        found = 0
+        for match in itertools.islice(matches, chunk_size):
+            found += 1
+            edit_start, edit_stop, insert = _minimal_edit(match.group(), expand(match))
+            if edit_start != edit_stop or insert:
+                edits.append((match.start() + edit_start, match.start() + edit_stop, insert))
+        count += found
+
+        for run in _runs(edits):
+            run_start = run[0][0]
+            run_stop = run[-1][1]
+
+            newlines = text.count('\n', text_end, run_start)
+            if newlines:
+                y += newlines
+                x = run_start - text.rindex('\n', text_end, run_start) - 1
+            else:
+                x += run_start - text_end
+
+            if len(run) == 1:
+                insert = run[0][2]
+                buff.replace((y, x), run_stop - run_start, insert)
+            else:
+                parts = []
+                end = run_start
+                for edit_start, edit_stop, edit_insert in run:
+                    parts += text[end:edit_start], edit_insert
+                    end = edit_stop
+                parts.append(text[end:run_stop])
+                insert = ''.join(parts)
+
+                substitution = Substitution(
+                    (y, x), run_stop - run_start,
+                    [(edit_start - run_start, text[edit_start:edit_stop], edit_insert)
+                     for (edit_start, edit_stop, edit_insert) in run])
+                if buff.history is None:
+                    buff.replace((y, x), run_stop - run_start, insert)
+                else:
+                    with buff.history.recording(substitution):
+                        buff.replace((y, x), run_stop - run_start, insert)
+
+            text_end = run_stop
+            newlines = insert.count('\n')
+            if newlines:
+                y += newlines
+                x = len(insert) - insert.rindex('\n') - 1
+            else:
+                x += len(insert)
+
+        if found < chunk_size:
+            break
+        yield count, match.end(), len(text)
+
+    yield count, len(text), len(text)
+
+
 @interactive('raw_substitute')
 def raw_substitute(bctl: BufferController, pattern, replacement):
-    with bctl.history.transaction():
-        text = bctl.selection.text or bctl.buffer.text
-        pos = bctl.selection.pos
-        newtext, changes = re.subn(pattern, replacement, text)
-        if bctl.selection.text:
-            with bctl.selection.select():
-                bctl.selection.text = newtext
-        else:
-            c = Cursor(bctl.buffer)
-            (c
-             .remove_to(c.clone().last_line().end())
-             .insert(newtext))
-            bctl.selection.pos = pos
+    '''
+    Substitute a regular expression with a replacement in the selected
+    region, if there is one, or the entire document.
 
-        return 'Made {} replacements.\n'.format(changes)
+    The first step is taken immediately, and the rest while the editor is
+    idle, writing the progress to the command line. The substitution stops
+    if the buffer is modified in the meantime, and is undone in one step.
+    '''
+    selection = bctl.selection
+    if selection.text:
+        start, end = sorted([selection.anchor_cursor.pos, selection.pos])
+    else:
+        start, end = (0, 0), None
+
+    substitution = iter_substitute(bctl.buffer, re.compile(pattern), replacement,
+                                   start, end)
+    bctl.add_tags(substitution=substitution)
+
+    buff = bctl.buffer
+    first_version = buff.version
+    version = first_version
+    count = 0
+    report_time = time.time() + SubstituteProgressInterval
+
+    def step():
+        nonlocal version, count, report_time
+
+        if bctl.tags.get('substitution') is not substitution:
+            substitution.close()
+            return # superseded
+
+        if buff.version != version:
+            substitution.close()
+            bctl.remove_tags(['substitution'])
+            cmdline_writer.write('Substitution stopped after {} replacements: '
+                                 'the buffer was modified.\n'.format(count))
+            return
+
+        # Each step adds to the changeset of the first one that changed
+        # anything, since nothing else has changed the buffer since then.
+        try:
+            with bctl.history.transaction(amend=version != first_version):
+                count, done, total = next(substitution)
+        except StopIteration:
+            bctl.remove_tags(['substitution'])
+            cmdline_writer.write('Made {} replacements.\n'.format(count))
+            return
+        except Exception:
+            bctl.remove_tags(['substitution'])
+            raise
+        version = buff.version
+
+        if time.time() >= report_time:
+            report_time = time.time() + SubstituteProgressInterval
+            cmdline_writer.write('Substituting: {:.0%} done, {} replacements...'.format(
+                done / max(total, 1), count))
+        bctl.refresh_view()
+        app().timer(0, step)
+
+    step()
 
 
 @interactive('substitute', 's')
@@ -129,7 +659,7 @@ def substitute(bctl: BufferController, *pattern):
     '''
     pattern = ' '.join(pattern)
     pattern, replacement = pattern.split('/')
-    cmdline_writer.write(raw_substitute(bctl, pattern, replacement))
+    raw_substitute(bctl, pattern, replacement)
 
 def find_impl(bufctl: BufferController, pattern, backwards=False):
     searcher = _get_searcher(bufctl)
@@ -170,19 +700,13 @@ def findprev(bufctl: BufferController, *pattern):
     pattern = ' '.join(pattern) if pattern else None
     find_impl(bufctl, pattern, backwards=True)
 
-@interactive('findall', 'fall', 'fa')
-def findall(bufctl: BufferController, *pattern, timeout_ms=300):
-    '''
-    : findall|fa[ll] [<pattern>...]
-
-    Highlight all matches of the given pattern. The highlighting will be
-    cleared upon the next edit. Omitting the pattern is the same as using the
-    previously used pattern.
-
-    '''
-    searcher = _get_searcher(bufctl)
-    pattern = ' '.join(pattern) if pattern else None
+def _show_matches(bufctl):
+    index = bufctl.tags.get('match_index')
+    if index is None:
+        return
 
+    first, last = bufctl.view.first_line, bufctl.view.last_line + 1
+    index.scan_lines(first, last)
 
     def make_span(y, x, length):
         start = Cursor(bufctl.buffer).move(y, x)
@@ -192,16 +716,48 @@ def findall(bufctl: BufferController, *pattern, timeout_ms=300):
 
         return Span(start, end)
 
-
+    # Only the visible matches are shown, since the view checks every overlay
+    # for each line that it draws.
     bufctl.view.set_overlays('search', [
-        (make_span(y, x, length),
-         'lexcat',
-         'search')
-        for ((y, x), length) 
-        in time_limited(searcher.searchall(pattern), ms=timeout_ms)
-        if length > 0
+        (make_span(y, x, length), 'lexcat', 'search')
+        for ((y, x), length) in index.matches_in_lines(first, last)
     ])
 
+
+def _scan_in_background(bufctl, index):
+    if bufctl.tags.get('match_index') is not index:
+        return # cleared or replaced
+
+    slice_ms = bufctl.general_settings.background_highlight_slice_ms
+    index.scan_more(time.time() + slice_ms / 1000.0)
+    if not index.complete:
+        app().timer(0, functools.partial(_scan_in_background, bufctl, index))
+
+
+@interactive('findall', 'fall', 'fa')
+def findall(bufctl: BufferController, *pattern, timeout_ms=300):
+    '''
+    : findall|fa[ll] [<pattern>...]
+
+    Highlight all matches of the given pattern. The highlighting is kept up
+    to date as the buffer is edited, until it is cleared by "findclear".
+    Omitting the pattern is the same as using the previously used pattern.
+
+    The visible lines are searched first. The rest of the buffer is searched
+    for up to `timeout_ms` milliseconds, and then in the background.
+    '''
+    searcher = _get_searcher(bufctl)
+    pattern = ' '.join(pattern) if pattern else searcher.pattern.pattern
+    searcher.pattern = re.compile(pattern, re.MULTILINE)
+
+    index = MatchIndex(bufctl.buffer, searcher.pattern)
+    bufctl.add_tags(match_index=index)
+    _show_matches(bufctl)
+
+    index.scan_more(time.time() + timeout_ms / 1000.0)
+    if not index.complete:
+        app().timer(0, functools.partial(_scan_in_background, bufctl, index))
+
 @interactive('findall_timeout')
 def findall_timeout(bufctl: BufferController, pattern, timeout):
     findall(bufctl, pattern, timeout_ms=timeout)
@@ -214,14 +770,15 @@ def findclear(bufctl: BufferController):
 
     Remove the highlighting from a previous use of "findall".
     '''
+    bufctl.remove_tags(['match_index'])
     try:
         bufctl.view.set_overlays('search', [])
     except KeyError:
         pass
 
 
-@autoconnect(BufferController.buffer_was_changed,
-             lambda tags: tags.get('regex_searcher'))
-def buffer_modified(bufctl, chg):
-    findclear(bufctl)
+@autoconnect(BufferController.view_refreshed,
+             lambda tags: tags.get('match_index') is not None)
+def view_refreshed(bufctl):
+    _show_matches(bufctl)
 
@@ -4,6 +4,7 @@ from keypad.abstract.completion import AbstractCompletionView
 from keypad.api import interactive
 from keypad.core.responder import Responder
 from keypad.core import notification_queue, AttributedString
+from keypad.core.fuzzy import FuzzySearch
 from keypad.buffers import Span, Cursor
 import logging
 
@@ -13,9 +14,10 @@ import textwrap
 
 import abc
 
-def make_fuzzy_pattern(pattern):
-    expr = '.*?' + '.*?'.join(map(re.escape, pattern.lower()))
-    return re.compile(expr)
+def _completion_text(completion):
+    text = completion[0]
+    return getattr(text, 'text', text)
+
 import traceback
 
 class AbstractCompleter(Responder, metaclass=abc.ABCMeta):
@@ -34,6 +36,7 @@ class AbstractCompleter(Responder, metaclass=abc.ABCMeta):
         super().__init__()
         self._start_pos = None
         self.completions = []
+        self._search = FuzzySearch([])
         cview = self.cview = buf_ctl.view.completion_view
         buf_ctl.add_tags(completer=self)
         self.buf_ctl = buf_ctl
@@ -176,33 +179,16 @@ class AbstractCompleter(Responder, metaclass=abc.ABCMeta):
 
     def show_completions(self, completions):
         self.completions = completions
+        self._search = FuzzySearch(completions, key=_completion_text)
         self.refilter_typed()
         self.buf_ctl.view.show_completions()
 
-    def _sort_completions(self, key, completions):
-        return sorted(completions, key=lambda x: len(x[1][0]))        
-
     def refilter(self, typed_text):
-        pattern = make_fuzzy_pattern(typed_text)
-        
-        # Sort the completions by length ascending, adding explicit indices to
-        # the completions so that they may be referenced later.
-
-        #sorted_pairs = sorted(
-        completions = ((i,t) for (i,t) in enumerate(self.completions)
-                       if pattern.match(t[0].lower()) is not None)
-        sorted_pairs = self._sort_completions(typed_text, completions)
-                              #key=lambda x: len(x[1][0]))
-        
-        
-        # Split off the indices and keep them as a mapping between completion
-        # view index and worker index.
-        if sorted_pairs:
-            indices, completions = zip(*sorted_pairs)
-        else:
-            indices, completions = [], []
+        # Keep the indices of the matches, best first, as a mapping between
+        # completion view index and worker index.
+        filt = self._search.filter(typed_text)
+        indices, completions = filt.indices, filt.rows
 
-        
         self._worker_indices = indices
         
         self.buf_ctl.view.completions = completions
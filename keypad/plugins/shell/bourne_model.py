@@ -8,8 +8,8 @@ from keypad.api import (Plugin,
 
 from keypad.abstract.code import IndentRetainingCodeModel, AbstractCompletionResults
 from keypad.core.syntaxlib import SyntaxHighlighter, lazy
-from keypad.core.processmgr.client import AsyncServerProxy
-from keypad.core.fuzzy import FuzzyMatcher
+from keypad.core.processmgr.pool import worker_pool
+from keypad.core.fuzzy import FuzzySearch
 from keypad.core.executors import future_wrap
 from keypad.core.attributed_string import AttributedString
 
@@ -41,6 +41,7 @@ class ShellCompletionResults(AbstractCompletionResults):
 
         super().__init__(token_start)
         self.results = [(AttributedString(x.decode()),) for x in results]
+        self._search = FuzzySearch(self.results, key=lambda x: x[0].text)
         self._prox = prox
 
     def doc_async(self, index):
@@ -72,8 +73,7 @@ class ShellCompletionResults(AbstractCompletionResults):
         '''
         Filter the completion results using the given text.
         '''
-        self._filtered = FuzzyMatcher(text).filter(self.results, key=lambda x: x[0].text)
-        self._filtered.sort(lambda item: len(item[0].text))
+        self._filtered = self._search.filter(text)
 
     def dispose(self):
         pass
@@ -97,14 +97,13 @@ class BourneCodeModel(IndentRetainingCodeModel):
 
     def __init__(self, *args, **kw):
         super().__init__(*args, **kw)
-        self._prox = AsyncServerProxy()
-        self._prox.start()
+        self._prox = worker_pool('shell').lease()
 
     def dispose(self):
-        self._prox.shutdown()
+        self._prox.release()
         super().dispose()
     
-    def highlight(self):
+    def highlight(self, time_limit_ms=None):
         '''
         Rehighlight the buffer.        
         '''
@@ -116,7 +115,7 @@ class BourneCodeModel(IndentRetainingCodeModel):
             dict(lexcat=None)
         )
         
-        highlighter.highlight_buffer(self.buffer)
+        highlighter.highlight_buffer(self.buffer, time_limit_ms)
     
     
     def completions_async(self, pos):
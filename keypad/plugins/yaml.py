@@ -12,7 +12,7 @@ from keypad.abstract.code import IndentRetainingCodeModel, AbstractCompletionRes
 from keypad.core import AttributedString
 from keypad.buffers.cursor import Cursor
 from keypad.core import nconfig, filetype
-from keypad.core.fuzzy import FuzzyMatcher
+from keypad.core.fuzzy import FuzzySearch
 from keypad.core.executors import future_wrap
 
 from keypad.core.syntaxlib import RegexLexer
@@ -98,6 +98,7 @@ class YAMLCompletionResults(AbstractCompletionResults):
 
         self.results = [x[:2] for x in results]
         self.docs = [x[2] for x in results]
+        self._search = FuzzySearch(self.results, lambda item: item[0].text)
 
             
         self.filter()        
@@ -142,8 +143,7 @@ class YAMLCompletionResults(AbstractCompletionResults):
         Filter the completion results using the given text.
         '''
         
-        self._filtered = FuzzyMatcher(text).filter(self.results, lambda item: item[0].text)
-        self._filtered.sort(lambda item: len(item[0].text))
+        self._filtered = self._search.filter(text)
 
 
     def dispose(self):
@@ -154,14 +154,14 @@ class YAMLCodeModel(IndentRetainingCodeModel):
     
     completion_triggers = []
     
-    def highlight(self):
+    def highlight(self, time_limit_ms=None):
         highlighter = SyntaxHighlighter(
             'keypad.plugins.yaml',
             yaml_lexer(),
             dict(lexcat=None)
         )
     
-        highlighter.highlight_buffer(self.buffer)
+        highlighter.highlight_buffer(self.buffer, time_limit_ms)
 
     
     @future_wrap
@@ -15,6 +15,8 @@ from .core import (ImmutableListView,
                    default,
                    bifilter)
 
+from .linetree import LineTree
+
 from .wrap import (paragraph_fill,
                    common_indent,
                    strip_indent,
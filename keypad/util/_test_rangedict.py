@@ -44,7 +44,13 @@ def random_op():
             v = d[k1-1] if k1 != 0 else None
             d[:] = lo + [v] * k2 + hi
 
-    res = random.choice([delete, set, get, splice])
+    def contract(d):
+        if hasattr(d, 'splice'):
+            d.splice(k1, k1 - k2)
+        else:
+            del d[k1:k2]
+
+    res = random.choice([delete, set, get, splice, contract])
     res.info = (k1, k2, v)
 
     return res
@@ -1,24 +1,39 @@
 
 
-from .attributes import Attributes
+from .attributes import Attributes, EmptyAttributes
 
 class AttributedString:
-    __slots__ = '_attrs', 'caches', '__weakref__', '_text'
+    # Attribute and cache storage are allocated on first use, so a string
+    # that is never highlighted or drawn costs little more than its text.
+    __slots__ = '_attrs', '_caches', '__weakref__', '_text'
     def __init__(self, text='', **attrs):
 
-        self._attrs = Attributes()
-
-        self.caches = {}
+        self._attrs = EmptyAttributes
+        self._caches = None
 
         if isinstance(text, AttributedString):
             self._text = ''
             self.append(text)
         else:
             self._text = text
-            self._attrs.set_attributes(0, len(text), **attrs)
+            self._set_attrs(0, len(text), attrs)
+
+    @property
+    def caches(self):
+        caches = self._caches
+        if caches is None:
+            caches = self._caches = {}
+        return caches
 
     def invalidate(self):
-        self.caches.clear()
+        self._caches = None
+
+    def _set_attrs(self, start, end, attrs):
+        if not attrs:
+            return
+        if self._attrs is EmptyAttributes:
+            self._attrs = Attributes()
+        self._attrs.set_attributes(start, end, **attrs)
 
     def copy(self):
         result = AttributedString(self._text)
@@ -136,7 +151,7 @@ class AttributedString:
 
         if isinstance(text, AttributedString):
             for start, end, deltas in text._attrs.iterchunks():
-                self._attrs.set_attributes(start + index, insert_end, **deltas)
+                self._set_attrs(start + index, insert_end, deltas)
 
         self.invalidate()
 
@@ -148,15 +163,26 @@ class AttributedString:
         self.insert(None, text)
 
     def iterchunks(self):
-        for start, end, deltas in self._attrs.iterchunks():
-            if start != len(self._text):
-                yield self.text[start:end], deltas
+        if self._attrs is EmptyAttributes:
+            return iter(((self._text, {}),) if self._text else ())
+
+        # The chunks are cached until the string or its attributes change,
+        # since they are requested every time the line is drawn.
+        chunks = self.caches.get('chunks')
+        if chunks is None:
+            text = self._text
+            chunks = self.caches['chunks'] = tuple(
+                (text[start:end], deltas)
+                for start, end, deltas in self._attrs.iterchunks()
+                if start != len(text)
+            )
+        return iter(chunks)
 
 
     def set_attributes(self, start=0, end=None, **attrs):
         if end is None:
             end = len(self)
-        self._attrs.set_attributes(start, end, **attrs)
+        self._set_attrs(start, end, attrs)
         self.invalidate()
 
     def attributes(self, index):
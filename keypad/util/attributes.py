@@ -1,11 +1,41 @@
 
 import collections
+import heapq
+import itertools
+import operator
 
 
 from .rangedict import RangeDict
 from .listdict import ListDict
 from .core import alphabetical_dict_repr
 
+class _EmptyAttributes(object):
+    '''
+    An immutable stand-in for an `Attributes` object with no attributes.
+
+    A single instance, `EmptyAttributes`, is shared by every string that has
+    never had attributes set, so that plain strings don't each need to
+    allocate their own dictionaries.
+    '''
+    __slots__ = ()
+
+    def items(self):
+        return ()
+
+    def splice(self, key, delta):
+        pass
+
+    def iterchunks(self):
+        yield 0, None, {}
+
+    def copy(self):
+        return self
+
+    def __repr__(self):
+        return '{}'
+
+EmptyAttributes = _EmptyAttributes()
+
 class Attributes(object):
     __slots__ = '_attrs'
 
@@ -29,12 +59,20 @@ class Attributes(object):
         return result
 
     def iterchunks(self):
+        # Merge the transitions of each attribute in order of position. This
+        # is equivalent to iterating over find_deltas(), but doesn't build
+        # an intermediate ListDict.
+        transitions = [zip(attr.keys(), itertools.repeat(attrname), attr.values())
+                       for attrname, attr in self._attrs.items()]
+
         last_key = 0
         last_attrs = {}
-        for key, attrs in self.find_deltas().items():
+        for key, attrname, value in heapq.merge(*transitions,
+                                                key=operator.itemgetter(0)):
             if last_key != key:
                 yield last_key, key, last_attrs
-            last_attrs, last_key = dict(attrs), key
+                last_attrs, last_key = {}, key
+            last_attrs[attrname] = value
 
         yield last_key, None, last_attrs
 
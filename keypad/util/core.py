@@ -20,6 +20,9 @@ class ImmutableListView(collections.Sequence):
     def __getitem__(self, i):
         return self._list[i]
 
+    def __iter__(self):
+        return iter(self._list)
+
 def singleton(cls):
     return cls()
 
@@ -0,0 +1,387 @@
+import collections.abc
+import itertools
+
+
+class _Node(object):
+    __slots__ = 'leaf', 'children', 'count', 'weight'
+
+    def __init__(self, leaf, children, weigh):
+        self.leaf = leaf
+        self.children = children
+        if leaf:
+            self.count = len(children)
+            self.weight = weigh(children)
+        else:
+            self.count = sum(child.count for child in children)
+            self.weight = sum(child.weight for child in children)
+
+    def __repr__(self):
+        return '_Node(leaf={!r}, count={!r})'.format(self.leaf, self.count)
+
+
+class LineTree(collections.abc.MutableSequence):
+    '''
+    A sequence backed by a balanced B+ tree, suitable for storing the lines of
+    a large document.
+
+    Items are kept in leaves of at most `LeafMax` items. Each branch records
+    the number of items beneath it, so positional lookup, insertion and
+    deletion take ``O(log(len(self)))`` time rather than the ``O(len(self))``
+    required by a builtin list. Inserting or deleting ``k`` contiguous items
+    costs ``O(k + log(len(self)))``.
+
+    If a `weight` function is given, each branch also records the total
+    weight of the items beneath it. This allows the prefix sums of the
+    weights to be computed and searched in ``O(log(len(self)))`` time. The
+    tree must be told when the weight of an item changes in place by calling
+    `reweigh`.
+
+    >>> lt = LineTree(range(10))
+    >>> lt[3]
+    3
+    >>> lt[2:5] = 'abc'
+    >>> list(lt)
+    [0, 1, 'a', 'b', 'c', 5, 6, 7, 8, 9]
+    >>> del lt[1:8]
+    >>> list(lt)
+    [0, 8, 9]
+    >>> lt.insert(1, 'x')
+    >>> lt[:]
+    [0, 'x', 8, 9]
+
+    >>> lt = LineTree(['ab', 'c', '', 'def'], weight=len)
+    >>> lt.total_weight
+    6
+    >>> lt.prefix_weight(3)
+    3
+    >>> lt.find_weight(3)
+    (3, 0)
+    >>> lt.find_weight(1)
+    (0, 1)
+    '''
+
+    __slots__ = '_root', '_weight'
+
+    LeafMax = 256
+    BranchMax = 64
+
+    def __init__(self, items=(), *, weight=None):
+        self._weight = weight
+        self._root = self._node(True, [])
+        self.extend(items)
+
+    # Internal tree operations
+
+    @classmethod
+    def _max(cls, node):
+        return cls.LeafMax if node.leaf else cls.BranchMax
+
+    def _weigh(self, items):
+        weight = self._weight
+        if weight is None:
+            return 0
+        else:
+            return sum(map(weight, items))
+
+    def _node(self, leaf, children):
+        return _Node(leaf, children, self._weigh)
+
+    def _split(self, node):
+        '''
+        Split the node into as many nodes as are required to keep each below
+        the maximum size, returning the list of replacements.
+        '''
+        n = len(node.children)
+        limit = self._max(node)
+        if n <= limit:
+            return [node]
+
+        pieces = -(-n // limit)
+        size = -(-n // pieces)
+
+        return [self._node(node.leaf, node.children[i:i+size])
+                for i in range(0, n, size)]
+
+    def _rebalance(self, node):
+        '''
+        Merge underfull children of the branch `node` with their neighbors.
+        '''
+        children = node.children
+        i = 0
+        while i < len(children) and len(children) > 1:
+            child = children[i]
+            if len(child.children) >= self._max(child) // 4:
+                i += 1
+                continue
+
+            lo = i if i + 1 < len(children) else i - 1
+            merged = self._node(child.leaf,
+                                children[lo].children + children[lo + 1].children)
+            children[lo:lo+2] = self._split(merged)
+            i = lo
+
+    def _insert(self, node, index, items):
+        if node.leaf:
+            node.children[index:index] = items
+            node.count = len(node.children)
+            node.weight += self._weigh(items)
+        else:
+            children = node.children
+            last = len(children) - 1
+            for i, child in enumerate(children):
+                if index <= child.count or i == last:
+                    break
+                index -= child.count
+
+            children[i:i+1] = self._insert(child, index, items)
+            node.count += len(items)
+            node.weight = sum(child.weight for child in children)
+
+        return self._split(node)
+
+    def _delete(self, node, start, stop):
+        if node.leaf:
+            del node.children[start:stop]
+            node.count = len(node.children)
+            node.weight = self._weigh(node.children)
+            return
+
+        kept = []
+        offset = 0
+        for child in node.children:
+            child_start = offset
+            offset += child.count
+
+            if offset <= start or child_start >= stop:
+                kept.append(child)
+            elif start <= child_start and offset <= stop:
+                continue
+            else:
+                self._delete(child,
+                            max(start - child_start, 0),
+                            min(stop, offset) - child_start)
+                if child.count:
+                    kept.append(child)
+
+        node.children = kept
+        node.count -= stop - start
+        node.weight = sum(child.weight for child in kept)
+        self._rebalance(node)
+
+    @classmethod
+    def _iter_from(cls, node, index):
+        if node.leaf:
+            yield from itertools.islice(node.children, index, None)
+        else:
+            for child in node.children:
+                if index >= child.count:
+                    index -= child.count
+                else:
+                    yield from cls._iter_from(child, index)
+                    index = 0
+
+    @classmethod
+    def _reversed(cls, node):
+        if node.leaf:
+            yield from reversed(node.children)
+        else:
+            for child in reversed(node.children):
+                yield from cls._reversed(child)
+
+    def _path_to(self, index):
+        count = self._root.count
+        if index < 0:
+            index += count
+        if not 0 <= index < count:
+            raise IndexError('LineTree index out of range')
+
+        node = self._root
+        path = [node]
+        while not node.leaf:
+            for child in node.children:
+                if index < child.count:
+                    node = child
+                    break
+                index -= child.count
+            path.append(node)
+
+        return path, index
+
+    def _leaf_for(self, index):
+        path, index = self._path_to(index)
+        return path[-1], index
+
+    def _slice_range(self, key):
+        start, stop, step = key.indices(self._root.count)
+        if step != 1:
+            raise ValueError('LineTree does not support extended slices')
+        return start, max(start, stop)
+
+    # Sequence interface
+
+    def __len__(self):
+        return self._root.count
+
+    def __getitem__(self, key):
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self._root.count)
+            if step == 1:
+                return list(itertools.islice(self._iter_from(self._root, start),
+                                             max(0, stop - start)))
+            else:
+                return [self[i] for i in range(start, stop, step)]
+
+        leaf, index = self._leaf_for(key)
+        return leaf.children[index]
+
+    def __setitem__(self, key, value):
+        if isinstance(key, slice):
+            start, stop = self._slice_range(key)
+            value = list(value)
+            if start != stop:
+                self._delete_range(start, stop)
+            self.insert_many(start, value)
+        else:
+            path, index = self._path_to(key)
+            path[-1].children[index] = value
+            self._reweigh_path(path)
+
+    def __delitem__(self, key):
+        if isinstance(key, slice):
+            start, stop = self._slice_range(key)
+        else:
+            self._leaf_for(key) # raises IndexError if out of range
+            if key < 0:
+                key += len(self)
+            start, stop = key, key + 1
+
+        if start != stop:
+            self._delete_range(start, stop)
+
+    def __iter__(self):
+        return self._iter_from(self._root, 0)
+
+    def __reversed__(self):
+        return self._reversed(self._root)
+
+    def __repr__(self):
+        return 'LineTree(' + repr(list(self)) + ')'
+
+    def _reweigh_path(self, path, delta=None):
+        if self._weight is None:
+            return
+
+        if delta is None:
+            leaf = path[-1]
+            delta = self._weigh(leaf.children) - leaf.weight
+        if delta:
+            for node in path:
+                node.weight += delta
+
+    def reweigh(self, index, delta=None):
+        '''
+        Update the tree after the weight of the item at `index` has changed.
+
+        If the change in weight is known, passing it as `delta` saves
+        weighing the other items in the item's leaf.
+        '''
+        self._reweigh_path(self._path_to(index)[0], delta)
+
+    @property
+    def total_weight(self):
+        return self._root.weight
+
+    def prefix_weight(self, index):
+        '''
+        Return the total weight of the items before `index`.
+        '''
+        if index >= self._root.count:
+            if index == self._root.count:
+                return self._root.weight
+            raise IndexError('LineTree index out of range')
+
+        path, index = self._path_to(index)
+        result = 0
+        for parent, child in zip(path, path[1:]):
+            for sibling in parent.children:
+                if sibling is child:
+                    break
+                result += sibling.weight
+
+        return result + self._weigh(path[-1].children[:index])
+
+    def find_weight(self, offset):
+        '''
+        Return a tuple ``(index, remainder)``, where `index` is the index of
+        the item spanning the given offset into the total weight, and
+        `remainder` is the offset from the start of that item.
+
+        Raise `IndexError` if the offset is outside of the tree.
+        '''
+        if not 0 <= offset < self._root.weight:
+            raise IndexError('LineTree weight offset out of range')
+
+        weight = self._weight
+        node = self._root
+        index = 0
+        while not node.leaf:
+            for child in node.children:
+                if offset < child.weight:
+                    node = child
+                    break
+                offset -= child.weight
+                index += child.count
+
+        for item in node.children:
+            w = weight(item)
+            if offset < w:
+                return index, offset
+            offset -= w
+            index += 1
+
+        raise AssertionError('inconsistent LineTree weights')
+
+    def iter_from(self, index):
+        '''
+        Iterate over the items starting at `index` without copying them.
+        '''
+        return self._iter_from(self._root, max(0, index))
+
+    def insert(self, index, value):
+        self.insert_many(index, [value])
+
+    def insert_many(self, index, items):
+        '''
+        Insert all of `items` before `index`.
+        '''
+        if not isinstance(items, list):
+            items = list(items)
+        if not items:
+            return
+
+        count = self._root.count
+        if index < 0:
+            index = max(0, index + count)
+        index = min(index, count)
+
+        nodes = self._insert(self._root, index, items)
+        while len(nodes) > 1:
+            nodes = self._split(self._node(False, nodes))
+        self._root = nodes[0]
+
+    def extend(self, items):
+        self.insert_many(len(self), items)
+
+    def _delete_range(self, start, stop):
+        self._delete(self._root, start, stop)
+
+        root = self._root
+        while not root.leaf and len(root.children) == 1:
+            root = root.children[0]
+        if not root.leaf and not root.children:
+            root = self._node(True, [])
+        self._root = root
+
+    def clear(self):
+        self._root = self._node(True, [])
+
@@ -6,78 +6,192 @@ import bisect
 import collections.abc
 
 class ListDict(collections.abc.MutableMapping):
-
-    __slots__ = '_keys', '_vals'
+    '''
+    A mapping that keeps its keys sorted in a list.
+
+    In addition to the mapping interface, the keys can be accessed by
+    position, and `shift` can add a constant to every key from a position
+    onwards. The shift is applied lazily: it is recorded as a pending delta
+    on a suffix of the keys, and a later shift only has to write the delta
+    back to the keys between its position and the previous one. Repeated
+    shifts at nearby positions (as when typing) therefore take time
+    proportional to the distance between them rather than to the number of
+    keys.
+
+    >>> ld = ListDict()
+    >>> ld[0], ld[5], ld[10] = 'a', 'b', 'c'
+    >>> ld.shift(1, 3)
+    >>> ld
+    ListDict({0: 'a', 8: 'b', 13: 'c'})
+    >>> ld.lower_bound(8), ld[13]
+    (1, 'c')
+    '''
+
+    __slots__ = '_keys', '_vals', '_shift_index', '_shift_delta'
 
     def __init__(self):
         super().__init__()
         self._keys = []
         self._vals = []
 
+        # _shift_delta is added to every key at or after _shift_index
+        self._shift_index = 0
+        self._shift_delta = 0
+
     def copy(self):
         result = ListDict()
         result._keys = self._keys.copy()
         result._vals = self._vals.copy()
+        result._shift_index = self._shift_index
+        result._shift_delta = self._shift_delta
 
         return result
 
+    def _move_shift(self, index):
+        '''
+        Move the start of the pending shift to `index`, writing the shift back
+        to the keys in between.
+        '''
+        split = self._shift_index
+        delta = self._shift_delta
+        keys = self._keys
+
+        if index > split:
+            keys[split:index] = map(delta.__add__, keys[split:index])
+        elif index < split:
+            keys[index:split] = map((-delta).__add__, keys[index:split])
+
+        self._shift_index = index
+
+    def _flush(self):
+        self._move_shift(len(self._keys))
+        self._shift_delta = 0
+
+    def shift(self, index, delta):
+        '''
+        Add `delta` to every key from position `index` onwards.
+
+        The caller must ensure that this does not violate the ordering of
+        the keys.
+        '''
+        if not delta or index >= len(self._keys):
+            return
+
+        if self._shift_delta:
+            self._move_shift(index)
+        else:
+            self._shift_index = index
+        self._shift_delta += delta
+
     def lower_bound(self, key):
         '''
         Return the index of the first key greater than or equal to `key`.
         '''
+        delta = self._shift_delta
+        if not delta:
+            return bisect.bisect_left(self._keys, key)
 
-        return bisect.bisect_left(self._keys, key)
+        split = self._shift_index
+        index = bisect.bisect_left(self._keys, key, 0, split)
+        if index < split:
+            return index
+        return bisect.bisect_left(self._keys, key - delta, split)
 
     def upper_bound(self, key):
         '''
         Return the index of the first key greater than `key`.
         '''
+        delta = self._shift_delta
+        if not delta:
+            return bisect.bisect_right(self._keys, key)
 
-        return bisect.bisect_right(self._keys, key)
+        split = self._shift_index
+        index = bisect.bisect_right(self._keys, key, 0, split)
+        if index < split:
+            return index
+        return bisect.bisect_right(self._keys, key - delta, split)
 
 
     def index(self, key):
         index = self.lower_bound(key)
 
-        if 0 <= index < len(self._keys) and self._keys[index] == key:
+        if 0 <= index < len(self._keys) and self.key(index) == key:
             return index
         else:
             raise KeyError(key)
 
     def erase(self, index):
+        if self._shift_delta:
+            split = self._shift_index
+            if isinstance(index, slice):
+                start, stop, step = index.indices(len(self._keys))
+                if step != 1:
+                    self._flush()
+                elif stop <= split:
+                    self._shift_index -= max(0, stop - start)
+                elif start < split:
+                    self._shift_index = start
+            else:
+                if index < 0:
+                    index += len(self._keys)
+                if index < split:
+                    self._shift_index -= 1
+
         del self._keys[index]
         del self._vals[index]
-        
+
     def items(self):
-        return zip(self._keys, self._vals)
+        return zip(self.keys(), self._vals)
 
     def keys(self):
-        yield from self._keys
+        delta = self._shift_delta
+        if delta:
+            split = self._shift_index
+            yield from self._keys[:split]
+            yield from map(delta.__add__, self._keys[split:])
+        else:
+            yield from self._keys
 
     def values(self):
         yield from self._vals
 
     def item(self, index):
-        return self._keys[index], self._vals[index]
+        if isinstance(index, slice):
+            self._flush()
+            return self._keys[index], self._vals[index]
+        return self.key(index), self._vals[index]
 
     def key(self, index):
-        return self._keys[index]
+        key = self._keys[index]
+        if self._shift_delta:
+            if index < 0:
+                index += len(self._keys)
+            if index >= self._shift_index:
+                key += self._shift_delta
+        return key
 
     def value(self, index):
         return self._vals[index]
 
     def set_key(self, index, value):
-        assert ((index == 0 or self._keys[index - 1] < value) and
-                (index + 1 >= len(self) or self._keys[index + 1] > value)), \
+        assert ((index == 0 or self.key(index - 1) < value) and
+                (index + 1 >= len(self) or self.key(index + 1) > value)), \
                'Setting this key at this index violates the dictionary\'s ordering.'
 
+        if self._shift_delta and index >= self._shift_index:
+            value -= self._shift_delta
         self._keys[index] = value
 
     def __setitem__(self, key, value):
         index = self.lower_bound(key)
-        if 0 <= index < len(self._keys) and self._keys[index] == key:
+        if 0 <= index < len(self._keys) and self.key(index) == key:
             self._vals[index] = value
         else:
+            if self._shift_delta:
+                if index < self._shift_index:
+                    self._shift_index += 1
+                else:
+                    key -= self._shift_delta
             self._keys.insert(index, key)
             self._vals.insert(index, value)
 
@@ -12,6 +12,9 @@ class RangeDict(collections.MutableMapping):
 
     Insert complexity: O(len(self)) worst-case
 
+    Splice complexity: O(log(len(self))) plus the number of keys between
+    successive splice positions
+
     Query complexity: O(log(len(self))) worst-case
 
     .. todo::
@@ -69,26 +72,26 @@ class RangeDict(collections.MutableMapping):
         self._data[lo] = value
 
     def del_interval(self, lo, hi):
-        if hi is not None:
-            self.put_interval(lo, hi, None)
-        else:
+        if hi is None:
             self.put_interval(lo, lo+1, None)
+            self._data.erase(slice(self._data.lower_bound(lo), None))
+        elif lo != hi:
+            self.put_interval(lo, hi, None)
 
-        i = self._data.lower_bound(lo)
-        ks, vs = self._data.item(slice(i, None))
-        self._data.erase(slice(i, None))
-
-        if hi is not None:
-            delta = hi - lo    
-            for k, v in zip(ks, vs):
-                nk = k - delta
-                if nk >= lo:
-                    self._data[nk] = v
+            # Now `lo` maps to None and nothing lies strictly between `lo` and
+            # `hi`. Drop `lo` and move everything from `hi` onwards down.
+            i = self._data.lower_bound(lo)
+            self._data.erase(i)
+            self._data.shift(i, lo - hi)
 
     def splice(self, key, delta):
         '''
         Alter the length of the `RangeDict` by `delta` at `key`.
 
+        Complexity: ``O(log(len(self)))`` plus the number of keys between
+        this and the previous splice, which is small when typing. (See
+        `ListDict.shift`.)
+
         >>> rd = RangeDict()
 
         >>> rd[0:3] = 1
@@ -106,11 +109,7 @@ class RangeDict(collections.MutableMapping):
         elif delta < 0:
             self.del_interval(key, key - delta)
         else:
-            lb = self._data.lower_bound(key)
-            for i in range(len(self._data)-1, lb-1, -1):
-                self._data.set_key(i, self._data.key(i) + delta)
-
-                
+            self._data.shift(self._data.lower_bound(key), delta)
 
     def get_inst(self, key):
         index = self._data.upper_bound(key) - 1
@@ -0,0 +1,163 @@
+'''
+Benchmarks for AttributedString and its attribute storage.
+
+Run with ``python -m keypad_tests.bench_attributed_string``. These are not
+collected by the test suite.
+'''
+
+import keyword
+import pathlib
+import re
+import timeit
+import tracemalloc
+
+from keypad.util.attributed_string import AttributedString
+from keypad.util.attributes import Attributes, EmptyAttributes
+from keypad.util.rangedict import RangeDict
+
+LineCount = 10 ** 5
+
+
+def make_lines():
+    return [AttributedString('line {}'.format(i)) for i in range(LineCount)]
+
+def allocate_eagerly(lines):
+    # the layout used before attribute and cache storage became lazy
+    for line in lines:
+        line._attrs = Attributes()
+        line.caches
+
+def highlight(lines):
+    for line in lines:
+        line.set_attributes(0, 4, lexcat='keyword')
+        line.set_attributes(4, None, lexcat=None)
+
+
+def bytes_per_line(*steps):
+    tracemalloc.start()
+    try:
+        lines = None
+        for step in steps:
+            lines = step() if lines is None else (step(lines) or lines)
+        size, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return size / LineCount
+
+
+def bench_memory():
+    cases = [
+        ('plain', (make_lines,)),
+        ('plain, eager storage', (make_lines, allocate_eagerly)),
+        ('highlighted', (make_lines, highlight)),
+    ]
+
+    for name, steps in cases:
+        print('{:<24} {:>8.1f} bytes/line'.format(name, bytes_per_line(*steps)))
+
+
+TokenCount = 10 ** 4
+Keystrokes = 1000
+
+def make_highlighted_line():
+    rd = RangeDict()
+    for i in range(TokenCount):
+        rd[i * 8:i * 8 + 4] = 'keyword'
+    return rd
+
+def splice_per_key(rd, key, delta):
+    # the implementation used before ListDict.shift
+    data = rd._data
+    lb = data.lower_bound(key)
+    for i in range(len(data) - 1, lb - 1, -1):
+        data.set_key(i, data.key(i) + delta)
+
+def type_in_middle(splice):
+    rd = make_highlighted_line()
+    key = TokenCount * 4
+    for i in range(Keystrokes):
+        splice(rd, key + i, 1)
+        rd[key + i:key + i + 1] = 'keyword'
+
+def bench_splice():
+    cases = [
+        ('splice', RangeDict.splice),
+        ('splice, per key', splice_per_key),
+    ]
+
+    for name, splice in cases:
+        elapsed = timeit.timeit(lambda: type_in_middle(splice), number=1)
+        print('{:<24} {:>8.1f} us/keystroke'.format(name, elapsed / Keystrokes * 1e6))
+
+
+PaintLines = 10 ** 4
+Token = re.compile(r'\w+|#.*|\t')
+Tab = re.compile(r'(\t)') # as used by the layout engine
+
+def make_highlighted_file():
+    source = pathlib.Path(__file__).read_text().splitlines()
+    lines = [AttributedString(source[i % len(source)]) for i in range(PaintLines)]
+    for line in lines:
+        for m in Token.finditer(line.text):
+            if m.group().startswith('#'):
+                line.set_attributes(m.start(), m.end(), lexcat='comment', italic=True)
+            elif keyword.iskeyword(m.group()):
+                line.set_attributes(m.start(), m.end(), lexcat='keyword', bold=True)
+            else:
+                line.set_attributes(m.start(), m.end(), lexcat='identifier')
+    return lines
+
+def iterchunks_via_deltas(line):
+    # the implementation used before the chunks were merged and cached
+    if line._attrs is EmptyAttributes:
+        yield from line.iterchunks()
+        return
+
+    last_key = 0
+    last_attrs = {}
+    for key, attrs in line._attrs.find_deltas().items():
+        if last_key != key:
+            if last_key != len(line.text):
+                yield line.text[last_key:key], last_attrs
+        last_attrs, last_key = dict(attrs), key
+    if last_key != len(line.text):
+        yield line.text[last_key:], last_attrs
+
+def paint(lines, iterchunks):
+    # the attribute handling done by TextLayoutEngine.render_line_to_device
+    for line in lines:
+        attrs = {}
+        for chunk, deltas in iterchunks(line):
+            for subchunk in Tab.split(chunk):
+                if subchunk:
+                    attrs.update(deltas)
+
+def bench_paint(*, number=5):
+    lines = make_highlighted_file()
+
+    def first_paint():
+        for line in lines:
+            line.invalidate()
+        paint(lines, AttributedString.iterchunks)
+
+    cases = [
+        ('paint, find_deltas', lambda: paint(lines, iterchunks_via_deltas)),
+        ('paint, first', first_paint),
+        ('paint, repeated', lambda: paint(lines, AttributedString.iterchunks)),
+    ]
+
+    for name, case in cases:
+        elapsed = timeit.timeit(case, number=number)
+        print('{:<24} {:>8.1f} ms/paint'.format(name, elapsed / number * 1e3))
+
+
+def main():
+    print('{} lines'.format(LineCount))
+    bench_memory()
+    print('{} tokens, {} keystrokes'.format(TokenCount, Keystrokes))
+    bench_splice()
+    print('{} highlighted lines'.format(PaintLines))
+    bench_paint()
+
+if __name__ == '__main__':
+    main()
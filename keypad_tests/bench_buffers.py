@@ -0,0 +1,78 @@
+'''
+Benchmarks for the buffer line store.
+
+Run with ``python -m keypad_tests.bench_buffers``. These are not collected by
+the test suite.
+'''
+
+import random
+import timeit
+
+from keypad.buffers import Buffer
+from keypad.util import LineTree
+
+LineCount = 10 ** 6
+
+
+def list_insert_lines(lines, y, new_lines):
+    # the technique previously used by Buffer.insert_lines
+    return lines[:y+1] + new_lines + lines[y+1:]
+
+def tree_insert_lines(lines, y, new_lines):
+    lines[y+1:y+1] = new_lines
+    return lines
+
+
+def bench_container(name, make, insert_lines, *, number=100):
+    lines = make(['line {}'.format(i) for i in range(LineCount)])
+    prng = random.Random(0)
+
+    def insert():
+        nonlocal lines
+        y = prng.randrange(len(lines))
+        lines = insert_lines(lines, y, ['a', 'b', 'c'])
+
+    def delete():
+        y = prng.randrange(len(lines) - 3)
+        del lines[y:y+3]
+
+    def index():
+        for _ in range(1000):
+            lines[prng.randrange(len(lines))]
+
+    for op in (insert, delete, index):
+        t = timeit.timeit(op, number=number)
+        print('{:<6} {:<16} {:>10.3f} ms/op'.format(name, op.__name__,
+                                                   t / number * 1000))
+
+
+def bench_buffer(*, number=20):
+    buff = Buffer.from_text('\n'.join('line {}'.format(i)
+                                      for i in range(LineCount)))
+    prng = random.Random(0)
+
+    def paste():
+        y = prng.randrange(len(buff.lines))
+        buff.insert((y, 0), 'pasted\ntext\n')
+
+    def calculate_pos():
+        buff.calculate_pos((0, 0), prng.randrange(total))
+
+    def calculate_index():
+        buff.calculate_index((prng.randrange(len(buff.lines)), 0))
+
+    for op in (paste, calculate_pos, calculate_index):
+        total = len(buff.text)
+        t = timeit.timeit(op, number=number)
+        print('{:<6} {:<16} {:>10.3f} ms/op'.format('Buffer', op.__name__,
+                                                   t / number * 1000))
+
+
+def main():
+    print('{} lines'.format(LineCount))
+    bench_container('list', list, list_insert_lines)
+    bench_container('tree', LineTree, tree_insert_lines)
+    bench_buffer()
+
+if __name__ == '__main__':
+    main()
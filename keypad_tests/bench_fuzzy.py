@@ -0,0 +1,78 @@
+'''
+Benchmarks for fuzzy matching.
+
+Run with ``python -m keypad_tests.bench_fuzzy``. These are not collected by
+the test suite.
+'''
+
+import random
+import re
+import string
+import timeit
+
+from keypad.core.fuzzy import FuzzySearch
+
+CandidateCount = 20000
+
+
+def regex_filter(items, pattern):
+    # what the completers did before: a backtracking regex for each keystroke
+    rgx = re.compile('.*?' + '.*?'.join(map(re.escape, pattern.lower())))
+    matches = [(i, item) for (i, item) in enumerate(items) if rgx.match(item.lower())]
+    matches.sort(key=lambda pair: len(pair[1]))
+    return [i for (i, _) in matches]
+
+
+def make_candidates(count):
+    prng = random.Random(0)
+    words = [''.join(prng.choice(string.ascii_lowercase) for _ in range(prng.randint(2, 8)))
+             for _ in range(500)]
+
+    def name():
+        parts = [prng.choice(words) for _ in range(prng.randint(1, 4))]
+        if prng.random() < 0.5:
+            return '_'.join(parts)
+        return parts[0] + ''.join(p.capitalize() for p in parts[1:])
+
+    return [name() for _ in range(count)]
+
+
+def bench_typing(items, typed='getvalue'):
+    # filtering once per keystroke, as a completion list does
+    prefixes = [typed[:n] for n in range(1, len(typed) + 1)]
+
+    def regex():
+        for p in prefixes:
+            regex_filter(items, p)
+
+    def search():
+        s = FuzzySearch(items)
+        for p in prefixes:
+            s.ranked(p)
+
+    for variant, run in (('regex', regex), ('fuzzy search', search)):
+        elapsed = min(timeit.repeat(run, number=1, repeat=3))
+        print('{} candidates, typing {!r}, {:<13} {:>8.1f} ms/keystroke'.format(
+            len(items), typed, variant, elapsed / len(prefixes) * 1000))
+
+
+def bench_long_candidates(*, count=20, length=60):
+    # e.g., paths in the command line completer; a near miss makes the regex
+    # backtrack over every way of matching the first characters
+    items = ['a' * length] * count
+    pattern = 'aaab'
+    for variant, run in (('regex', lambda: regex_filter(items, pattern)),
+                         ('fuzzy search', lambda: FuzzySearch(items).ranked(pattern))):
+        elapsed = min(timeit.repeat(run, number=1, repeat=3))
+        print('{} {}-char near misses, {:<13} {:>8.1f} ms'.format(
+            count, length, variant, elapsed * 1000))
+
+
+def main():
+    items = make_candidates(CandidateCount)
+    bench_typing(items)
+    bench_typing(items, typed='abc')
+    bench_long_candidates()
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+'''
+Benchmarks for running tasks in worker processes.
+
+Run with ``python -m keypad_tests.bench_processmgr``. These are not collected
+by the test suite.
+'''
+
+import time
+import timeit
+
+from keypad.core.processmgr import testfunc
+from keypad.core.processmgr.client import AsyncServerProxy
+from keypad.core.processmgr.mirror import BufferMirror, submit_mirrored
+from keypad.buffers import Buffer
+
+TaskCount = 2000
+
+
+def one_at_a_time(prox, tasks):
+    # what the request/response protocol allowed
+    return [prox.submit(task).result() for task in tasks]
+
+
+def pipelined(prox, tasks):
+    futures = [prox.submit(task) for task in tasks]
+    return [f.result() for f in futures]
+
+
+def bench_throughput(prox):
+    for payload in (0, 10 ** 5):
+        tasks = [testfunc.Echo('x' * payload) for _ in range(TaskCount // (1 + payload // 10 ** 4))]
+        for variant, run in (('one at a time', one_at_a_time), ('pipelined', pipelined)):
+            elapsed = timeit.timeit(lambda: run(prox, tasks), number=1)
+            print('{:>7} char tasks {:<14} {:>8.1f} us/task {:>8.0f} tasks/s'.format(
+                payload, variant, elapsed / len(tasks) * 1e6, len(tasks) / elapsed))
+
+
+def bench_superseded(prox, *, count=20, delay=0.01):
+    # e.g., a completion request for each keystroke, each taking `delay`
+    for key in (None, 'complete'):
+        start = time.perf_counter()
+        futures = [prox.submit(testfunc.Echo(i, delay=delay), key=key) for i in range(count)]
+        futures[-1].result()
+        elapsed = time.perf_counter() - start
+        print('last of {} requests, {:<10} {:>8.1f} ms'.format(
+            count, 'superseded' if key else 'all run', elapsed * 1000))
+        for f in futures:
+            if not f.cancelled():
+                f.result()
+
+
+def bench_unsaved_text(prox, *, lines=20000, edits=200):
+    # e.g., a completion request for each keystroke in a large file
+    buff = Buffer()
+    buff.insert((0, 0), 'int x = 0; // some code on a line\n' * lines)
+    mirror = BufferMirror(buff)
+    try:
+        variants = (
+            ('whole text', lambda: prox.submit(testfunc.MirroredText(buff.text)).result()),
+            ('edits', lambda: submit_mirrored(prox, mirror, testfunc.MirroredText).result()),
+        )
+        for variant, request in variants:
+            request()
+            start = time.perf_counter()
+            for i in range(edits):
+                buff.insert((lines // 2, 0), 'x')
+                request()
+            elapsed = time.perf_counter() - start
+            print('{} line buffer, {:<10} {:>8.2f} ms/request'.format(
+                lines, variant, elapsed / edits * 1000))
+    finally:
+        mirror.dispose()
+
+
+def main():
+    with AsyncServerProxy() as prox:
+        prox.submit(testfunc.Echo(None)).result() # start the worker
+        bench_throughput(prox)
+        bench_superseded(prox)
+        bench_unsaved_text(prox)
+
+if __name__ == '__main__':
+    main()
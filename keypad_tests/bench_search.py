@@ -0,0 +1,120 @@
+'''
+Benchmarks for searching buffers.
+
+Run with ``python -m keypad_tests.bench_search``. These are not collected by
+the test suite.
+'''
+
+import random
+import re
+import timeit
+import tracemalloc
+
+from keypad.buffers import Buffer, BufferHistory, Cursor
+from keypad.plugins.search import MatchIndex, RegexSearcher, iter_substitute
+
+LineCount = 10 ** 6
+
+
+def search_backwards_from_start(searcher, pos, pattern):
+    # the implementation used before backwards searches were windowed
+    pattern = re.compile(pattern)
+    index = searcher.buff.calculate_index(pos)
+    matches = list(pattern.finditer(searcher.buffer_text, pos=0, endpos=index))
+    return searcher._translate_match(matches[-1] if matches else None)
+
+
+def bench_search_backwards(*, number=20):
+    buff = Buffer.from_text('\n'.join('line {}'.format(i) for i in range(LineCount)))
+    searcher = RegexSearcher(buff)
+    prng = random.Random(0)
+
+    cases = [
+        ('literal', lambda y: 'line {}'.format(y - 100)),
+        ('regex', lambda y: r'\bline {}\b'.format(y - 100)),
+        ('no match', lambda y: r'\bline x\b'),
+    ]
+
+    for name, make_pattern in cases:
+        for variant, search in (('from start', search_backwards_from_start),
+                                ('windowed', RegexSearcher.search)):
+            def findprev():
+                y = prng.randrange(LineCount // 2, LineCount)
+                pattern = make_pattern(y)
+                if search is RegexSearcher.search:
+                    search(searcher, (y, 0), pattern, backwards=True)
+                else:
+                    search(searcher, (y, 0), pattern)
+
+            elapsed = timeit.timeit(findprev, number=number)
+            print('findprev {:<8} {:<10} {:>10.3f} ms'.format(
+                name, variant, elapsed / number * 1000))
+
+
+def bench_match_index(*, number=200):
+    buff = Buffer.from_text('\n'.join('line {}'.format(i) for i in range(LineCount)))
+    pattern = re.compile(r'\bline 1\d*\b', re.MULTILINE)
+    searcher = RegexSearcher(buff)
+    prng = random.Random(0)
+
+    elapsed = timeit.timeit(lambda: list(searcher.searchall(pattern.pattern)), number=1)
+    print('findall    from scratch     {:>10.3f} ms'.format(elapsed * 1000))
+
+    index = MatchIndex(buff, pattern)
+    elapsed = timeit.timeit(lambda: index.scan_lines(500000, 500050), number=1)
+    print('findall    visible lines    {:>10.3f} ms'.format(elapsed * 1000))
+    elapsed = timeit.timeit(lambda: index.scan_more(float('inf')), number=1)
+    print('findall    whole index      {:>10.3f} ms'.format(elapsed * 1000))
+
+    def type_char():
+        y = prng.randrange(LineCount)
+        buff.insert((y, 0), 'x')
+        list(index.matches_in_lines(y - 25, y + 25))
+
+    elapsed = timeit.timeit(type_char, number=number)
+    print('findall    update per edit  {:>10.3f} ms'.format(elapsed / number * 1000))
+
+
+def substitute_whole_text(buff, pattern, replacement):
+    # the implementation used before substitutions were made match by match
+    text, _ = re.subn(pattern, replacement, buff.text)
+    c = Cursor(buff)
+    c.remove_to(c.clone().last_line().end()).insert(text)
+
+
+def substitute_by_match(buff, pattern, replacement):
+    for _ in iter_substitute(buff, re.compile(pattern), replacement):
+        pass
+
+
+def bench_substitute():
+    for variant, substitute in (('whole text', substitute_whole_text),
+                                ('by match', substitute_by_match)):
+        # time without tracing, which slows allocation down
+        elapsed = {}
+        for traced in (False, True):
+            buff = Buffer.from_text('\n'.join('line {}'.format(i) for i in range(LineCount)))
+            history = BufferHistory(buff)
+            buff.text # cache the text, as a search would
+
+            if traced:
+                tracemalloc.start()
+            with history.transaction():
+                elapsed[traced] = timeit.timeit(
+                    lambda: substitute(buff, r'line (\d*)7\b', r'line \g<1>8'), number=1)
+            if traced:
+                _, peak = tracemalloc.get_traced_memory()
+                tracemalloc.stop()
+
+        print('substitute {:<10} {:>10.3f} ms {:>8.1f} MB peak'.format(
+            variant, elapsed[False] * 1000, peak / 2 ** 20))
+
+
+def main():
+    print('{} lines'.format(LineCount))
+    bench_search_backwards()
+    bench_match_index()
+    bench_substitute()
+
+if __name__ == '__main__':
+    main()
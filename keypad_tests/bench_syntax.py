@@ -0,0 +1,141 @@
+'''
+Benchmarks for the syntax highlighting library.
+
+Run with ``python -m keypad_tests.bench_syntax``. These are not collected by
+the test suite.
+'''
+
+import concurrent.futures
+import pathlib
+import time
+import timeit
+
+from keypad.buffers import Buffer
+from keypad.core import AttributedString
+from keypad.core.syntaxlib import SyntaxHighlighter, parallel
+from keypad.core.syntaxlib.syntax import _PendingLines
+from keypad.core.syntaxlib.syntaxlib import Tokenizer, TokenizerEvent
+from keypad.plugins.cpp.syntax import cpplexer
+from keypad.plugins.pymodel.syntax import pylexer
+
+LineCount = 10 ** 4
+
+CppSource = r'''
+#include <vector>
+#if 0
+unused();
+#endif
+/** Documentation. */
+template<typename T>
+static int count(const std::vector<T> &items, T value) { // TODO: use std::count
+    int result = 0;
+    for(auto it = items.begin(); it != items.end(); ++it) {
+        if(*it == value) result += 0x1;
+    }
+    const char *s = "escapes\n\x41", c = '\'';
+    auto raw = R"delim(raw "string")delim";
+    return result * 1.5f;
+}
+'''
+
+
+def python_lines():
+    source = pathlib.Path(__file__).parent.parent.joinpath('keypad', 'buffers', 'buffer.py')
+    lines = source.read_text().splitlines()
+    return [AttributedString(lines[i % len(lines)]) for i in range(LineCount)]
+
+def cpp_lines():
+    lines = CppSource.splitlines()
+    return [AttributedString(lines[i % len(lines)]) for i in range(LineCount)]
+
+
+def tokenize_per_lexer(self, string, start, stop):
+    # the implementation used before the guards were combined into one regex
+    pop = object()
+    lexer_stack = self.lexer_stack
+    while lexer_stack and start <= stop:
+        exit_match = lexer_stack[-1].exit_match(string, start, stop)
+        if exit_match:
+            first_guard = exit_match[0], exit_match[1], pop
+        else:
+            first_guard = None
+
+        for lexer in lexer_stack[-1].contains:
+            lresult = lexer.guard_match(string, start, stop)
+            if lresult and (not first_guard or first_guard[0] >= lresult[0]):
+                first_guard = lresult[0], lresult[1], lexer
+
+        if not first_guard:
+            break
+
+        fg_start, fg_stop, fg_lexer = first_guard
+        if fg_lexer is pop:
+            yield TokenizerEvent.token_end, lexer_stack[-1], fg_stop
+            lexer_stack.pop()
+        else:
+            lexer_stack.append(fg_lexer.enter())
+            yield TokenizerEvent.token_start, lexer_stack[-1], fg_start
+        start = fg_stop
+
+
+def tokenize_all(lexer, lines, tokenize):
+    tokenizer = Tokenizer(lexer)
+    for line in lines:
+        for _ in tokenize(tokenizer, line, 0, len(line)):
+            pass
+
+
+def bench_tokenize(*, number=3):
+    cases = [
+        ('python', pylexer(), python_lines()),
+        ('c++', cpplexer(), cpp_lines()),
+    ]
+
+    for name, lexer, lines in cases:
+        for variant, tokenize in (('per lexer', tokenize_per_lexer),
+                                  ('combined', Tokenizer.tokenize)):
+            elapsed = timeit.timeit(lambda: tokenize_all(lexer, lines, tokenize),
+                                    number=number)
+            print('{:<6} {:<10} {:>8.2f} us/line'.format(
+                name, variant, elapsed / number / len(lines) * 1e6))
+
+
+def highlight_cold(buff, *, in_parallel):
+    hl = SyntaxHighlighter('bench', pylexer(), dict(lexcat=None))
+    if not in_parallel:
+        hl.ParallelLineThreshold = float('inf')
+
+    start = time.perf_counter()
+    hl.highlight_buffer(buff)
+    cold_open = _PendingLines.for_buffer(buff, 'bench').cold_open
+    if cold_open is not None:
+        concurrent.futures.wait([chunk[1] for chunk in cold_open._chunks])
+    while SyntaxHighlighter.first_pending_line(buff) is not None:
+        hl.highlight_buffer(buff)
+    return time.perf_counter() - start
+
+
+def bench_cold_open(*, line_count=20 * LineCount):
+    text = '\n'.join(line.text for line in python_lines())
+    text = '\n'.join([text] * (line_count // LineCount))
+
+    # start the workers before timing
+    hl = SyntaxHighlighter('bench', pylexer(), dict(lexcat=None))
+    concurrent.futures.wait([parallel._worker_pool(hl).submit(int)])
+
+    for in_parallel in (False, True):
+        if in_parallel and not parallel.can_highlight_in_parallel():
+            print('cold open: only one CPU; parallel highlighting disabled')
+            continue
+        elapsed = highlight_cold(Buffer.from_text(text), in_parallel=in_parallel)
+        print('cold open  {:<10} {:>8.2f} s for {} lines'.format(
+            'parallel' if in_parallel else 'serial', elapsed, line_count))
+
+
+def main():
+    print('{} lines'.format(LineCount))
+    bench_tokenize()
+    bench_cold_open()
+
+if __name__ == '__main__':
+    main()
@@ -8,6 +8,8 @@ from keypad.core import write_atomically, errors
 
 import random
 
+import pytest
+
 buff_text = '''\
 12
 34
@@ -121,7 +123,57 @@ class TestBuffer(unittest.TestCase):
         self.buff.insert((0,0), '\n')
         
         assert self.buff.text == '\n12\n34\n56\n'
-        
+
+    def test_text_snapshot(self):
+        text = self.buff.text
+        version = self.buff.version
+        assert self.buff.text is text
+
+        self.buff.insert((1,1), 'x')
+        assert self.buff.version > version
+        assert self.buff.text == '12\n3x4\n56\n'
+
+        prng = random.Random(1234)
+        for i in range(100):
+            self.buff.execute(make_random_change(prng, self.buff))
+            if prng.randrange(3) == 0:
+                assert self.buff.text == '\n'.join(l.text for l in self.buff.lines)
+
+    def test_offsets_follow_edits(self):
+        prng = random.Random(1234)
+        for i in range(200):
+            self.buff.execute(make_random_change(prng, self.buff))
+            text = self.buff.text
+
+            index = prng.randrange(len(text) + 1)
+            y = text.count('\n', 0, index)
+            x = index - (text.rfind('\n', 0, index) + 1)
+
+            assert self.buff.calculate_pos((0,0), index) == (y, x)
+            assert self.buff.calculate_index((y, x)) == index
+            assert self.buff.calculate_pos((0,0), len(text) + 10) == self.buff.end_pos
+
+    def test_replace(self):
+        prng = random.Random(1234)
+        history = BufferHistory(self.buff)
+        for i in range(200):
+            text = self.buff.text
+            start = prng.randrange(len(text) + 1)
+            stop = prng.randrange(start, len(text) + 1)
+            insert = random_printable(prng)
+            version = self.buff.version
+
+            with history.transaction():
+                self.buff.replace(self.buff.calculate_pos((0,0), start), stop - start, insert)
+            assert self.buff.text == text[:start] + insert + text[stop:]
+            assert '\n'.join(l.text for l in self.buff.lines) == self.buff.text
+            # one modification
+            assert self.buff.version <= version + 1
+
+            if prng.randrange(4) == 0:
+                history.undo()
+                assert self.buff.text == text
+
 
 
 class TestSpan(unittest.TestCase):
@@ -225,6 +277,90 @@ class TestAtomicWrites(unittest.TestCase):
         self.check_file(self.filename, self.corpus2.encode())
 
 
+class TestLoading(unittest.TestCase):
+    def setUp(self):
+        fd, self.filename = tempfile.mkstemp(text=False)
+        os.close(fd)
+
+    def tearDown(self):
+        os.unlink(self.filename)
+
+    def check_load(self, contents, expected):
+        with open(self.filename, 'w') as f:
+            f.write(contents)
+
+        for chunk_size in (1, 2, 3, 1024):
+            buff = Buffer()
+            for _ in buff.iter_append_from_path(self.filename, chunk_size=chunk_size):
+                pass
+            assert buff.text == expected
+            assert len(buff.lines) == expected.count('\n') + 1
+
+    def test_load_trailing_newline(self):
+        self.check_load('ab\ncd\n', 'ab\ncd')
+
+    def test_load_no_trailing_newline(self):
+        self.check_load('ab\ncd', 'ab\ncd')
+
+    def test_load_blank_lines(self):
+        self.check_load('\n\nab\n\n', '\n\nab\n')
+
+    def test_load_empty(self):
+        self.check_load('', '')
+
+    def check_map(self, contents):
+        with open(self.filename, 'wb') as f:
+            f.write(contents.encode())
+
+        expected = Buffer()
+        expected.append_from_path(self.filename)
+
+        buff = Buffer()
+        buff.map_from_path(self.filename, cache_size=2)
+        buff._lines.IndexBlockSize = 3
+        try:
+            assert buff.read_only
+            assert len(buff.lines) == len(expected.lines)
+            assert [l.text for l in buff.lines] == [l.text for l in expected.lines]
+            assert buff.text == expected.text
+
+            for index in range(len(expected.text) + 1):
+                pos = expected.calculate_pos((0,0), index)
+                assert buff.calculate_pos((0,0), index) == pos
+                assert buff.calculate_index(pos) == index
+        finally:
+            buff.unmap()
+
+        assert not buff.read_only
+        assert buff.text == ''
+
+    def test_map(self):
+        self.check_map('ab\ncd\n')
+        self.check_map('ab\r\n\u00e9\u00e9\ncd')
+        self.check_map('\n\nabc\n\n')
+        self.check_map('')
+
+    def test_map_read_only(self):
+        with open(self.filename, 'w') as f:
+            f.write('abc\n')
+
+        buff = Buffer()
+        buff.map_from_path(self.filename)
+        with self.assertRaises(errors.ReadOnlyError):
+            buff.insert((0,0), 'x')
+        buff.unmap()
+
+    def test_load_progressively(self):
+        with open(self.filename, 'w') as f:
+            f.write('line\n' * 100)
+
+        buff = Buffer()
+        counts = [len(buff.lines)
+                  for _ in buff.iter_append_from_path(self.filename, chunk_size=50)]
+        assert counts == sorted(counts)
+        assert len(set(counts)) > 1
+
+
 def test_walk():
     buff = Buffer()
     buff.insert((0,0), 'hello\nworld')
@@ -236,5 +372,46 @@ def test_walk():
         print(ch)
     assert ''.join(chs) == 'hello\nworld'
 
+def test_save_after_failed_load(tmpdir, monkeypatch):
+    import pathlib
+    from keypad import control, core, options
+    from keypad.control import buffer_controller
+    from keypad.testutil import mocks
+
+    class App:
+        def timer(self, time_s, callback):
+            pass # load the rest in finish_loading instead
+
+    monkeypatch.setattr(buffer_controller, 'app', App)
+    monkeypatch.setattr(Buffer, 'LoadChunkSize', 16)
+
+    conf = core.Config.root.derive()
+    options.GeneralSettings.from_config(conf).background_load_threshold = 16
+    bctl = control.BufferController(buffer_set=None,
+                                    view=mocks.MockCodeView(),
+                                    buff=Buffer(),
+                                    provide_interaction_mode=False,
+                                    config=conf)
+
+    broken = tmpdir.join('broken.txt')
+    broken.write_binary(b'valid\n' * 10000 + b'\xff\n')
+    with bctl.history.transaction():
+        bctl.replace_from_path(pathlib.Path(str(broken)))
+    assert bctl.is_loading
+    with pytest.raises(UnicodeDecodeError):
+        bctl.finish_loading()
+    with pytest.raises(errors.UserError):
+        bctl.write_to_path(pathlib.Path(str(broken)))
+
+    small = tmpdir.join('small.txt')
+    small.write('hello\n')
+    with bctl.history.transaction():
+        bctl.replace_from_path(pathlib.Path(str(small)))
+    bctl.buffer.insert((0, 0), 'x')
+    bctl.write_to_path(pathlib.Path(str(small)))
+    assert small.read() == 'xhello\n'
+    assert broken.read_binary().endswith(b'\xff\n')
+
+
 if __name__ == '__main__':
     unittest.main()
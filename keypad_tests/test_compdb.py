@@ -0,0 +1,76 @@
+import json
+
+from keypad.plugins.cpp.compdb import CompilationDatabase, find_compilation_database, entry_flags
+
+
+def write_database(root, entries):
+    path = root.join('compile_commands.json')
+    path.write_text(json.dumps(entries), encoding='utf-8')
+    return path
+
+
+def test_entry_flags():
+    entry = {
+        'directory': '/proj/build',
+        'command': 'c++ -Iinclude -isystem ../third -DX="a b" -c -o a.o -MF a.d ../src/a.cpp -std=c++14',
+        'file': '../src/a.cpp'
+    }
+    assert entry_flags(entry) == ('-I/proj/build/include', '-isystem', '/proj/third',
+                                  '-DX=a b', '-std=c++14')
+
+
+def test_lookup_and_header_fallback(tmpdir):
+    root = str(tmpdir)
+    write_database(tmpdir, [
+        {'directory': root, 'arguments': ['cc', '-DA', 'src/a.c'], 'file': 'src/a.c'},
+        {'directory': root, 'arguments': ['c++', '-DB', 'src/b.cpp'], 'file': 'src/b.cpp'},
+        {'directory': root, 'arguments': ['c++', '-DC', 'lib/c.cpp'], 'file': 'lib/c.cpp'},
+    ])
+    tmpdir.join('src', 'deep').ensure(dir=True)
+
+    db = find_compilation_database(tmpdir.join('src', 'deep', 'x.cpp'))
+    assert isinstance(db, CompilationDatabase)
+    assert db.flags_for(tmpdir.join('src', 'b.cpp')) == ('-DB',)
+    # a header next to a source file with the same name
+    assert db.flags_for(tmpdir.join('src', 'a.h')) == ('-DA', '-x', 'c-header')
+    # a header nearest to sources in lib/
+    assert db.flags_for(tmpdir.join('lib', 'include', 'c.hpp')) == ('-DC', '-x', 'c++-header')
+
+
+def test_database_is_reloaded_when_changed(tmpdir):
+    path = write_database(tmpdir, [
+        {'directory': str(tmpdir), 'arguments': ['c++', '-DOLD', 'a.cpp'], 'file': 'a.cpp'},
+    ])
+    db = CompilationDatabase(path)
+    assert db.flags_for(tmpdir.join('a.cpp')) == ('-DOLD',)
+
+    write_database(tmpdir, [
+        {'directory': str(tmpdir), 'arguments': ['c++', '-DNEW', 'a.cpp'], 'file': 'a.cpp'},
+    ])
+    path.setmtime(path.mtime() + 10)
+    assert db.flags_for(tmpdir.join('a.cpp')) == ('-DNEW',)
+
+
+def test_database_created_later_is_found(tmpdir):
+    src = tmpdir.join('src', 'a.cpp')
+    assert find_compilation_database(src) is None
+
+    write_database(tmpdir, [
+        {'directory': str(tmpdir), 'arguments': ['c++', '-DA', 'src/a.cpp'], 'file': 'src/a.cpp'},
+    ])
+    db = find_compilation_database(src)
+    assert db is not None
+    assert db.flags_for(src) == ('-DA',)
+
+
+def test_sources_near(tmpdir):
+    root = str(tmpdir)
+    write_database(tmpdir, [
+        {'directory': root, 'arguments': ['c++', name], 'file': name}
+        for name in ['lib/c.cpp', 'src/b.cpp', 'src/deep/d.cpp', 'src/a.cpp', 'tools/e.cpp']
+    ])
+    db = CompilationDatabase(tmpdir.join('compile_commands.json'))
+    assert db.sources_near(tmpdir.join('src', 'a.cpp')) == [
+        str(tmpdir.join(*name.split('/')))
+        for name in ['src/b.cpp', 'src/deep/d.cpp', 'lib/c.cpp', 'tools/e.cpp']
+    ]
@@ -29,7 +29,9 @@ except ImportError:
 import unittest
 
 from keypad.plugins.cpp.cppmodel import CXXCodeModel, CXXCompletionResults
+from keypad.plugins.cpp.modelworker import FilterCompletionsTask
 from keypad.plugins.cpp.config import CXXConfig
+from keypad.plugins.cpp.preamble import PreambleCache, split_preamble
 from keypad.core.nconfig import Config
 from keypad.buffers import Buffer, Cursor, Span
 from keypad.abstract.code import RelatedName, Diagnostic
@@ -84,6 +86,39 @@ class TestCXXCodeModel(unittest.TestCase):
                 break
         else:
             self.fail('Expected abcdef when completing on s')
+
+    def test_completion_filter(self):
+        self.buffer.insert(
+            (0, 0),
+            'struct S { int abcdef; int abxyz; int other; };\n'
+            'void foo() { S s; s.ab'
+        )
+        ep = self.buffer.end_pos
+        self.buffer.insert(ep, '   }\n')
+
+        res = self.cmodel.completions_async(ep).result()
+        assert [res.text(i) for i in range(len(res.rows))][:2] == ['abxyz', 'abcdef']
+
+        res.filter('abc')
+        assert [res.text(i) for i in range(len(res.rows))] == ['abcdef']
+
+    def test_completions_survive_call_tips(self):
+        self.buffer.insert(
+            (0, 0),
+            'struct S { int abcdef; int abxyz; };\n'
+            'int f(int x);\n'
+            'void foo() { S s; f(s.ab'
+        )
+        ep = self.buffer.end_pos
+        self.buffer.insert(ep, ');   }\n')
+
+        res = self.cmodel.completions_async(ep).result()
+        self.cmodel.call_tip_async(ep).result()
+
+        page = self.cmodel.prox.submit(
+            FilterCompletionsTask(res._page.generation, 'abx')).result()
+        assert page is not None
+        assert [row[0].text for row in page.rows] == ['abxyz']
         
         
     def test_find_decl(self):
@@ -163,4 +198,44 @@ class TestCXXCodeModel(unittest.TestCase):
         
         assert isinstance(diag, Diagnostic)
         assert len(diag.ranges) == 1
-        assert diag.ranges[0][2] == missing_semicolon_pos
\ No newline at end of file
+        assert diag.ranges[0][2] == missing_semicolon_pos
+
+class TestSplitPreamble(unittest.TestCase):
+    def test_includes_after_comments_and_directives(self):
+        text = (b'// a comment\n/* another\n   comment */\n#include <vector>\n'
+                b'#define X \\\n  1\n#include "x.h"\nint main() {}\n#include "late.h"\n')
+        assert split_preamble(text) == text[:text.index(b'int main')]
+
+    def test_unclosed_conditionals_are_left_out(self):
+        assert split_preamble(b'#include <a>\n#if X\n#include <b>\nint x;\n') == b'#include <a>\n'
+        assert split_preamble(b'int x;\n#include <a>\n') == b''
+
+
+def test_preamble_cache_prunes_headers_and_failures(tmpdir):
+    def write(name, size, mtime):
+        path = tmpdir.join(name)
+        path.write_binary(b'x' * size)
+        path.setmtime(mtime)
+
+    cache = PreambleCache(None, str(tmpdir), 0)
+    cache.max_size = 250
+    cache.MaxFailures = 2
+    write('old.pch', 100, 1)
+    write('old.h', 50, 1)
+    write('new.pch', 100, 2)
+    write('new.h', 50, 2)
+    write('orphan.h', 10, 3)
+    for mtime, name in enumerate(['f1.pch', 'f2.pch', 'f3.pch'], 10):
+        write(name, 0, mtime)
+
+    cache._prune()
+    assert sorted(p.basename for p in tmpdir.listdir()) == ['f2.pch', 'f3.pch', 'new.h', 'new.pch']
+
+
+def test_preamble_cache_waits_for_save(tmpdir):
+    source = tmpdir.join('a.cpp')
+    source.write_binary(b'#include <a>\nint x;\n')
+
+    cache = PreambleCache(None, str(tmpdir.join('cache')), 1)
+    assert cache.args_for(str(source), [], b'#include <a>\n#include <b\nint x;\n') == []
+    assert not tmpdir.join('cache').exists()
@@ -0,0 +1,48 @@
+from keypad.core.fuzzy import FuzzyMatcher, FuzzySearch
+
+
+def test_match():
+    m = FuzzyMatcher('fb')
+    assert m.match('fooBar')
+    assert m.match('FOOBAR')
+    assert not m.match('barfoo')
+    assert FuzzyMatcher('').match('anything')
+    assert not FuzzyMatcher('fb', case_sensitive=True).match('FooBar')
+
+
+def test_boundaries_and_consecutive_matches_score_higher():
+    m = FuzzyMatcher('fb')
+    assert m.score('fooBar') > m.score('foobar')
+    assert m.score('foo_bar') > m.score('foobar')
+    assert m.score('fbx') > m.score('fxb')
+    assert FuzzyMatcher('Foo').score('Foo') > FuzzyMatcher('Foo').score('foo')
+
+
+def test_search_ranks_best_first():
+    items = ['frobnicate', 'fooBar', 'barfoo', 'fb', 'foobar']
+    search = FuzzySearch(items)
+    assert [items[i] for i in search.ranked('fb')] == ['fb', 'fooBar', 'foobar', 'frobnicate']
+    # equal scores are ordered by length
+    assert [items[i] for i in search.ranked('')] == ['fb', 'fooBar', 'barfoo', 'foobar', 'frobnicate']
+
+
+def test_search_narrows_and_widens():
+    items = ['abc', 'abd', 'xbc', 'a\nc']
+    search = FuzzySearch(items)
+    assert search.ranked('a') == [0, 1, 3]
+    assert search.ranked('ab') == [0, 1]
+    assert search.ranked('abc') == [0]
+    # after a newline is a word boundary
+    assert search.ranked('c') == [3, 0, 2]
+
+    filt = FuzzySearch([(x,) for x in items], key=lambda item: item[0]).filter('bc')
+    assert filt.indices == [0, 2]
+    assert filt.rows == [('abc',), ('xbc',)]
+
+
+def test_folding_that_changes_length():
+    # 'İ'.lower() is two characters
+    assert FuzzySearch(['İstanbul', 'Paris']).ranked('İs') == [0]
+    assert FuzzySearch(['İstanbul', 'Paris']).ranked('İ') == [0]
+    assert FuzzyMatcher('İ').score('İx') is not None
+    assert FuzzyMatcher('xİ').match('xİ')
@@ -0,0 +1,55 @@
+import re
+
+from keypad.plugins.grep import walk_files, grep_text, _grep_files
+
+
+def make_tree(root, files):
+    for name, content in files.items():
+        path = root.join(name)
+        path.dirpath().ensure(dir=True)
+        if isinstance(content, bytes):
+            path.write_binary(content)
+        else:
+            path.write_text(content, encoding='utf-8')
+
+
+def test_walk_files_skips_ignored(tmpdir):
+    make_tree(tmpdir, {
+        '.gitignore': '*.o\nbuild/\n!keep.o\n',
+        '.git/config': '',
+        'a.c': '',
+        'a.o': '',
+        'keep.o': '',
+        'build/b.c': '',
+        'src/.gitignore': '/gen.c\n',
+        'src/gen.c': '',
+        'src/lib/gen.c': '',
+    })
+
+    found = sorted(p[len(str(tmpdir)) + 1:].replace('\\', '/')
+                   for p in walk_files(str(tmpdir)))
+    assert found == ['.gitignore', 'a.c', 'keep.o', 'src/.gitignore', 'src/lib/gen.c']
+
+
+def test_grep_text():
+    rgx = re.compile(r'b\w', re.MULTILINE)
+    text = 'ab abc\nxyz\r\nbbq\n'
+    expected = [(0, 4, 'ab abc'), (2, 0, 'bbq')]
+    assert grep_text(rgx, text) == expected
+    assert grep_text(re.compile(rb'b\w', re.MULTILINE), text.encode()) == expected
+
+
+def test_grep_files(tmpdir):
+    make_tree(tmpdir, {
+        'ascii.txt': 'one\ntwo\nthree\n',
+        'utf8.txt': 'été\nthé\n',
+        'binary.bin': b'th\0e',
+        'empty.txt': '',
+    })
+    paths = sorted(str(p) for p in tmpdir.listdir())
+
+    results = dict(_grep_files(r'th\w', re.MULTILINE, paths))
+    assert results == {
+        str(tmpdir.join('ascii.txt')): [(2, 0, 'three')],
+        str(tmpdir.join('utf8.txt')): [(1, 0, 'thé')],
+    }
@@ -0,0 +1,172 @@
+import random
+import re
+
+from keypad.buffers import Buffer, BufferHistory, Cursor
+from keypad.buffers.buffer import Substitution
+from keypad.plugins.search import MatchIndex, RegexSearcher, iter_substitute
+
+
+def search_backwards_from_start(buff, pos, pattern):
+    index = buff.calculate_index(pos)
+    matches = list(re.compile(pattern).finditer(buff.text, 0, index))
+    if not matches:
+        return None
+    return buff.calculate_pos((0, 0), matches[-1].start()), len(matches[-1].group())
+
+
+def check_search_backwards(buff, text, prng):
+    searcher = RegexSearcher(buff)
+    searcher.BackwardsWindow = 2
+    expected = Buffer.from_text(text)
+
+    for pattern in ['ab', 'a b', r'b\n1', r'\d+', '^a', '(?m)^a', 'b$', r'(?<=1)2', 'x']:
+        for _ in range(50):
+            y = prng.randrange(len(buff.lines))
+            pos = y, prng.randrange(len(buff.lines[y]) + 1)
+            assert (searcher.search(pos, pattern, backwards=True) ==
+                    search_backwards_from_start(expected, pos, pattern))
+
+
+def test_search_backwards():
+    prng = random.Random(0)
+    text = ''.join(prng.choice('ab12 \n') for _ in range(2000))
+    check_search_backwards(Buffer.from_text(text), text, prng)
+
+
+def test_search_backwards_read_only(tmpdir):
+    prng = random.Random(0)
+    text = ''.join(prng.choice('ab12 \n') for _ in range(2000))
+    path = tmpdir.join('text')
+    path.write(text)
+
+    buff = Buffer()
+    buff.map_from_path(str(path))
+    check_search_backwards(buff, text, prng)
+
+
+def test_search_read_only(tmpdir, monkeypatch):
+    from keypad.buffers.mapped_lines import MappedLines
+
+    prng = random.Random(0)
+    text = ''.join(prng.choice('ab12 \n') for _ in range(2000))
+    path = tmpdir.join('text')
+    path.write(text)
+
+    buff = Buffer()
+    buff.map_from_path(str(path), cache_size=2)
+    searcher = RegexSearcher(buff)
+    searcher.ForwardWindow = 2
+    searcher.ChunkLines = 3
+    expected = RegexSearcher(Buffer.from_text(text))
+
+    for pattern in ['ab', 'a b', r'b\n1', r'\d+', '^a', '(?m)^a', 'b$', r'(?<=1)2', 'x', 'a*']:
+        for _ in range(50):
+            y = prng.randrange(len(buff.lines))
+            pos = y, prng.randrange(len(buff.lines[y]) + 1)
+            assert searcher.search(pos, pattern) == expected.search(pos, pattern)
+
+        assert list(searcher.searchall(pattern)) == list(expected.searchall(pattern))
+
+    def whole_text(lines):
+        raise AssertionError('the whole text was decoded')
+
+    monkeypatch.setattr(MappedLines, 'text', property(whole_text))
+    searcher.search((0, 0), 'x')
+    searcher.search((100, 0), 'x', backwards=True)
+    list(searcher.searchall('ab'))
+
+
+def check_match_index(index, buff, pattern):
+    index.scan_lines(0, len(buff.lines))
+    expected = [(buff.calculate_pos((0, 0), m.start()), len(m.group()))
+                for m in re.finditer(pattern, buff.text, re.MULTILINE) if m.group()]
+    assert list(index.matches_in_lines(0, len(buff.lines))) == expected
+
+
+def test_match_index_follows_edits():
+    prng = random.Random(0)
+    for pattern in ['ab', r'\d+', r'b\n1', '^a', 'b$']:
+        buff = Buffer.from_text(''.join(prng.choice('ab12 \n') for _ in range(2000)))
+        index = MatchIndex(buff, re.compile(pattern, re.MULTILINE))
+        index.ScanLines = 7
+        index.scan_lines(100, 120)
+
+        for i in range(50):
+            y = prng.randrange(len(buff.lines))
+            pos = y, prng.randrange(len(buff.lines[y]) + 1)
+            if prng.random() < 0.5:
+                buff.insert(pos, ''.join(prng.choice('ab12 \n') for _ in range(5)))
+            else:
+                buff.remove(pos, min(prng.randrange(1, 10),
+                                     len(buff.text) - buff.calculate_index(pos)))
+            if i == 25:
+                index.scan_more(float('inf'))
+                assert index.complete
+
+        check_match_index(index, buff, pattern)
+
+
+def test_match_index_scans_lazily():
+    buff = Buffer.from_text('\n'.join('line {}'.format(i) for i in range(100)))
+    index = MatchIndex(buff, re.compile(r'\d+'))
+    index.ScanLines = 10
+
+    index.scan_lines(50, 60)
+    assert list(index.matches_in_lines(0, 100)) == [((y, 5), len(str(y))) for y in range(50, 60)]
+    assert not index.complete
+
+    index.scan_more(float('inf'))
+    assert index.complete
+    assert len(index) == 100
+
+
+def test_substitute():
+    prng = random.Random(0)
+    text = ''.join(prng.choice('ab12 \n') for _ in range(2000))
+    cases = [('ab', 'ba'), (r'(\d)(\d)', r'\2\1'), (r'b\n', 'c'), ('a', 'a'),
+             ('^a', 'xa'), ('b*', '-'), ('a1', 'ab1'),
+             (r'(?P<d>\d)(a)?', r'<\g<d>\n\2\\>')]
+
+    for pattern, replacement in cases:
+        buff = Buffer.from_text(text)
+        history = BufferHistory(buff)
+        with history.transaction():
+            steps = list(iter_substitute(buff, re.compile(pattern), replacement,
+                                         chunk_size=10))
+
+        assert buff.text == re.sub(pattern, replacement, text)
+        assert steps[-1][0] == len(re.findall(pattern, text))
+
+        if buff.text != text:
+            substituted = buff.text
+            history.undo()
+            assert buff.text == text
+            history.redo()
+            assert buff.text == substituted
+
+    buff = Buffer.from_text(text)
+    start, end = (10, 0), (20, 1)
+    stop = buff.calculate_index(end)
+    index = buff.calculate_index(start)
+    list(iter_substitute(buff, re.compile('a'), 'xy', start, end))
+    assert buff.text == text[:index] + text[index:stop].replace('a', 'xy') + text[stop:]
+
+
+def test_substitute_records_compact_history():
+    text = '\n'.join('line {}'.format(i) for i in range(5000))
+    buff = Buffer.from_text(text)
+    history = BufferHistory(buff)
+    # cursors in replaced text stay on their lines
+    cursor = Cursor(buff).move(4000, 2)
+    with history.transaction():
+        list(iter_substitute(buff, re.compile(r'line (\d+)'), r'LINE \1', chunk_size=100))
+
+    assert buff.text == text.replace('line', 'LINE')
+    assert cursor.pos == (4000, 2)
+    changes, = history._changesets
+    assert len(changes) == 50
+    assert all(isinstance(change, Substitution) for change in changes)
+    assert sum(len(change._removed) for change in changes) == 4 * 5000
+
+    history.undo()
+    assert buff.text == text
@@ -0,0 +1,219 @@
+import random
+
+from keypad.buffers import Buffer
+from keypad.core.syntaxlib import SyntaxHighlighter
+from keypad.plugins.pymodel.syntax import pylexer
+
+
+class CountingHighlighter(SyntaxHighlighter):
+    TimeLimit = 60 * 1000
+
+    def __init__(self, name='test'):
+        super().__init__(name, pylexer(), dict(lexcat=None))
+        self.count = 0
+
+    def _highlight_line(self, *args):
+        self.count += 1
+        return super()._highlight_line(*args)
+
+
+def lexcats(buff):
+    return [[(chunk, deltas.get('lexcat')) for chunk, deltas in line.iterchunks()]
+            for line in buff.lines]
+
+def highlight_from_scratch(text):
+    buff = Buffer.from_text(text)
+    CountingHighlighter('scratch').highlight_buffer(buff)
+    return lexcats(buff)
+
+
+def test_highlight_only_changed_lines():
+    buff = Buffer.from_text('\n'.join('x = {}  # comment'.format(i)
+                                      for i in range(1000)))
+    hl = CountingHighlighter()
+    hl.highlight_buffer(buff)
+    assert hl.count == 1000
+
+    hl.count = 0
+    buff.insert((500, 0), 'def ')
+    hl.highlight_buffer(buff)
+    assert hl.count == 1
+
+    hl.count = 0
+    buff.insert((10, 0), '"""\n')
+    CountingHighlighter().highlight_buffer(buff) # shares the pending lines
+    hl.highlight_buffer(buff)
+    assert hl.count == 0
+    assert lexcats(buff) == highlight_from_scratch(buff.text)
+
+
+def test_highlight_follows_edits():
+    prng = random.Random(0)
+    buff = Buffer.from_text('\n'.join('s = "{}"  # {}'.format(i, i)
+                                      for i in range(100)))
+    hl = CountingHighlighter()
+    hl.highlight_buffer(buff)
+
+    for _ in range(50):
+        y = prng.randrange(len(buff.lines))
+        if prng.random() < 0.5:
+            buff.insert((y, 0), prng.choice(['"""', '#', 'def ', '\n', '"""\n']))
+        elif len(buff.lines[y]):
+            buff.remove((y, 0), prng.randrange(1, len(buff.lines[y]) + 2))
+
+        hl.highlight_buffer(buff)
+        assert lexcats(buff) == highlight_from_scratch(buff.text)
+
+
+def test_highlight_resumes_after_time_limit():
+    buff = Buffer.from_text('\n'.join('x = {}  # comment'.format(i)
+                                      for i in range(1000)))
+    hl = CountingHighlighter()
+
+    for _ in range(1000):
+        hl.highlight_buffer(buff, time_limit_ms=0)
+    assert hl.count == 1000
+    assert hl.TimeLimit == CountingHighlighter.TimeLimit
+
+    hl.highlight_buffer(buff)
+    assert hl.count == 1000
+    assert lexcats(buff) == highlight_from_scratch(buff.text)
+
+
+def test_highlight_visible_lines_first():
+    buff = Buffer.from_text('\n'.join('x = {}'.format(i) for i in range(1000)))
+    hl = CountingHighlighter()
+    hl.highlight_buffer(buff)
+    assert SyntaxHighlighter.first_pending_line(buff) is None
+
+    buff.insert((10, 0), '# ')
+    buff.insert((505, 0), '# ')
+    SyntaxHighlighter.prioritize_lines(buff, 500, 510)
+
+    hl.TimeLimit = 0
+    hl.highlight_buffer(buff)
+    assert lexcats(buff)[505] == [('# x = 505', 'comment')]
+    assert lexcats(buff)[10] != [('# x = 10', 'comment')]
+    assert SyntaxHighlighter.first_pending_line(buff) == 10
+
+    del hl.TimeLimit
+    hl.highlight_buffer(buff)
+    assert SyntaxHighlighter.first_pending_line(buff) is None
+    assert lexcats(buff) == highlight_from_scratch(buff.text)
+
+
+def test_tokenizer_combined_guards():
+    from keypad.core import AttributedString
+    from keypad.core.syntaxlib import regex, region, keyword
+    from keypad.core.syntaxlib.syntaxlib import Tokenizer
+
+    Word = regex(r'\w+', dict(lexcat='word'))
+    Keyword = keyword(['if'], dict(lexcat='keyword'), caseless=True)
+    Call = regex(r'(?P<body>\w+)\(', dict(lexcat='call'))
+    Paren = region(guard=regex(r'\('), exit=regex(r'\)'), contains=[Word])
+    Top = region(guard=None, exit=None, contains=[Word, Keyword, Call, Paren])
+
+    # ties go to the last lexer, and Call can't be combined with the others
+    tokens = [(ty.name, lexer.attrs.get('lexcat'), pos) for ty, lexer, pos
+              in Tokenizer(Top).tokenize(AttributedString('IF f(x)'), 0, 7)]
+    assert tokens == [
+        ('token_start', 'keyword', 0), ('token_end', 'keyword', 2),
+        ('token_start', 'call', 3), ('token_end', 'call', 4),
+        ('token_start', None, 4),
+        ('token_start', 'word', 5), ('token_end', 'word', 6),
+        ('token_end', None, 7),
+    ]
+
+
+def test_highlight_states_are_shared():
+    buff = Buffer.from_text('x = 1\n"""\ndoc\n"""\ny = 2')
+    CountingHighlighter().highlight_buffer(buff)
+
+    end_states = [line.caches['test.end_state'] for line in buff.lines]
+    assert end_states[0] is end_states[3] is end_states[4]
+    assert end_states[1] is end_states[2]
+    assert end_states[0] != end_states[1]
+
+
+def test_highlight_only_changed_lines_after_states_are_cleared():
+    from keypad.core.syntaxlib import syntaxlib
+
+    buff = Buffer.from_text('\n'.join('x = {}  # comment'.format(i)
+                                      for i in range(1000)))
+    hl = CountingHighlighter()
+    hl.highlight_buffer(buff)
+
+    syntaxlib._states.clear()
+    hl.count = 0
+    buff.insert((500, 0), 'def ')
+    hl.highlight_buffer(buff)
+    assert hl.count == 1
+
+
+def test_highlight_discarded_lines_of_mapped_buffer(tmpdir, monkeypatch):
+    from keypad.core.syntaxlib.syntax import _PendingLines
+
+    text = '\n'.join('x = {}  # comment'.format(i) for i in range(5000))
+    path = tmpdir.join('big.py')
+    path.write(text)
+    expected = highlight_from_scratch(text)
+
+    for max_checkpoints, first in [(1000, 896), (8, 0)]:
+        monkeypatch.setattr(_PendingLines, 'MaxCheckpoints', max_checkpoints)
+        buff = Buffer()
+        buff.map_from_path(str(path), cache_size=200)
+        hl = CountingHighlighter()
+        hl.highlight_buffer(buff)
+        assert hl.count == 5000
+        assert len(_PendingLines.for_buffer(buff, 'test').checkpoints) <= max_checkpoints
+
+        # lines 1000-1009 were discarded, and are highlighted again from the
+        # checkpoint before them when they are shown
+        hl.count = 0
+        SyntaxHighlighter.prioritize_lines(buff, 1000, 1010)
+        hl.highlight_buffer(buff)
+        assert hl.count == 1010 - first
+        assert SyntaxHighlighter.first_pending_line(buff) is None
+        assert [(chunk, deltas.get('lexcat')) for chunk, deltas
+                in buff.lines[1005].iterchunks()] == expected[1005]
+
+        hl.count = 0
+        hl.highlight_buffer(buff)
+        assert hl.count == 0
+        buff.unmap()
+
+
+class ParallelHighlighter(CountingHighlighter):
+    ParallelLineThreshold = 20
+    ParallelChunkLines = 10
+
+
+def test_highlight_in_parallel(monkeypatch):
+    import concurrent.futures
+    from keypad.core.syntaxlib import parallel
+    from keypad.core.syntaxlib.syntax import _PendingLines
+
+    monkeypatch.setattr(parallel, 'can_highlight_in_parallel', lambda: True)
+
+    text = '\n'.join('x = {}  # comment'.format(i) for i in range(100))
+    buff = Buffer.from_text(text)
+    buff.insert((27, 0), '"""\n') # a string that crosses a chunk boundary
+    buff.insert((34, 0), '"""\n')
+
+    hl = ParallelHighlighter()
+    hl.TimeLimit = 0
+    hl.highlight_buffer(buff)
+    cold_open = _PendingLines.for_buffer(buff, 'test').cold_open
+    assert cold_open is not None
+
+    # edits while the workers run drop the results for the changed lines
+    buff.insert((75, 0), 'def ')
+    buff.insert((50, 0), '#\n')
+
+    concurrent.futures.wait([chunk[1] for chunk in cold_open._chunks])
+    del hl.TimeLimit
+    hl.highlight_buffer(buff)
+
+    assert _PendingLines.for_buffer(buff, 'test').cold_open is None
+    assert hl.count < len(buff.lines) // 2
+    assert lexcats(buff) == highlight_from_scratch(buff.text)
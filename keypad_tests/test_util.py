@@ -29,3 +29,83 @@ def test_nonreentrant_ok():
 
 
 
+
+import random
+from keypad.util.linetree import LineTree
+
+class _SmallLineTree(LineTree):
+    __slots__ = ()
+    LeafMax = 4
+    BranchMax = 4
+
+def test_linetree_matches_list():
+    prng = random.Random(1234)
+    ref = list(range(20))
+    tree = _SmallLineTree(ref)
+    counter = 1000
+
+    for _ in range(2000):
+        n = len(ref)
+        op = prng.randrange(4)
+        if op == 0:
+            i = prng.randrange(n + 1)
+            items = list(range(counter, counter + prng.randrange(30)))
+            counter += 100
+            ref[i:i] = items
+            tree[i:i] = items
+        elif op == 1 and n:
+            i = prng.randrange(n + 1)
+            j = prng.randrange(i, n + 1)
+            del ref[i:j]
+            del tree[i:j]
+        elif op == 2 and n:
+            i = prng.randrange(-n, n)
+            ref[i] = tree[i] = counter
+            counter += 1
+        elif op == 3 and n:
+            i = prng.randrange(-n, n)
+            del ref[i]
+            del tree[i]
+
+        assert len(tree) == len(ref)
+        assert list(tree) == ref
+        if ref:
+            i = prng.randrange(len(ref))
+            assert tree[i] == ref[i]
+            assert tree[i:] == ref[i:]
+            assert list(tree.iter_from(i)) == ref[i:]
+
+from keypad.util.attributed_string import AttributedString
+from keypad.util.attributes import EmptyAttributes
+
+def test_attributed_string_lazy_storage():
+    s = AttributedString('hello')
+    assert s._attrs is EmptyAttributes
+    assert s._caches is None
+
+    t = AttributedString.join([s, AttributedString(' world', lexcat='x')])
+    s.insert(5, '!')
+    assert s._attrs is EmptyAttributes
+    assert list(s.iterchunks()) == [('hello!', {})]
+
+    s.set_attributes(0, 2, lexcat='k')
+    assert s._attrs is not EmptyAttributes
+    assert list(s.iterchunks()) == [('he', {'lexcat': 'k'}), ('llo!', {'lexcat': None})]
+    assert [chunk for chunk, _ in t.iterchunks()] == ['hello', ' world']
+
+def test_attributed_string_chunk_cache():
+    s = AttributedString('hello world')
+    s.set_attributes(0, 5, lexcat='k', bold=True)
+    s.set_attributes(6, 11, lexcat='n')
+
+    expected = [('hello', {'lexcat': 'k', 'bold': True}),
+                (' ', {'lexcat': None, 'bold': None}),
+                ('world', {'lexcat': 'n'})]
+    assert list(s.iterchunks()) == expected
+    assert list(s.iterchunks()) == expected
+
+    s.insert(5, ',')
+    assert [chunk for chunk, _ in s.iterchunks()] == ['hello,', ' ', 'world']
+
+    s.set_attributes(0, 1, lexcat=None)
+    assert [chunk for chunk, _ in s.iterchunks()] == ['h', 'ello,', ' ', 'world']